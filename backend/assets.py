@@ -0,0 +1,258 @@
+import os
+import json
+import time
+import hashlib
+import argparse
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+from urllib.parse import parse_qsl
+from starlette.responses import Response
+from starlette.staticfiles import StaticFiles
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+STATIC_DIR = os.path.join(SCRIPT_DIR, "static")
+# Built files live under static/build/ so the existing /static mount serves them.
+BUILD_DIR = os.getenv("ASSET_BUILD_DIR", os.path.join(STATIC_DIR, "build"))
+MANIFEST_PATH = os.path.join(BUILD_DIR, "manifest.json")
+
+SOURCE_EXTENSIONS = (".png", ".jpg", ".jpeg")
+# Resized variants (px, longest side); each format also gets a full-size variant.
+ASSET_WIDTHS = tuple(int(w) for w in os.getenv("ASSET_WIDTHS", "512,1024").split(",") if w.strip())
+ASSET_FORMATS = ("avif", "webp")
+# Width served when the client does not ask with ?w=
+ASSET_DEFAULT_WIDTH = int(os.getenv("ASSET_DEFAULT_WIDTH", "1024"))
+QUALITY = {"avif": 55, "webp": 80}
+MIME = {"avif": "image/avif", "webp": "image/webp", "png": "image/png", "jpg": "image/jpeg", "jpeg": "image/jpeg"}
+
+# Hashed URLs never change content, so browsers and CDNs may keep them for a year.
+IMMUTABLE = "public, max-age=31536000, immutable"
+MANIFEST_CHECK_SECONDS = 1.0
+
+def file_sha256(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+class Manifest:
+    """
+    static/build/manifest.json, reloaded when the file changes.
+
+    Keys are images.file_path values; each entry names the content-hashed copy of the
+    source (the public URL) and its resized/re-encoded variants.
+    """
+
+    def __init__(self, path: str = MANIFEST_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._entries: dict[str, dict] = {}
+        self._by_url: dict[str, dict] = {}
+        self._mtime = None
+        self._checked_at = 0.0
+
+    def _refresh(self):
+        now = time.monotonic()
+        if now - self._checked_at < MANIFEST_CHECK_SECONDS:
+            return
+        self._checked_at = now
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        if mtime == self._mtime:
+            return
+        entries = {}
+        if mtime is not None:
+            with open(self.path) as f:
+                entries = json.load(f).get("images", {})
+        with self._lock:
+            self._entries = entries
+            self._by_url = {e["url"]: e for e in entries.values()}
+            self._mtime = mtime
+
+    def url(self, file_path: str) -> Optional[str]:
+        self._refresh()
+        entry = self._entries.get(file_path)
+        return entry["url"] if entry else None
+
+    def entry_for_url(self, url_path: str) -> Optional[dict]:
+        self._refresh()
+        return self._by_url.get(url_path)
+
+manifest = Manifest()
+
+def url_for_path(file_path: str) -> str:
+    # Content-hashed URL when the asset build has run, the plain source file otherwise
+    built = manifest.url(file_path)
+    return f"/static/{built}" if built else f"/static/{file_path}"
+
+def accepted_formats(headers) -> list[str]:
+    """Variant formats this client takes, best first. ?format= style overrides go through X-Image-Format."""
+    forced = headers.get("x-image-format")
+    if forced:
+        return [forced.lower()]
+    accept = headers.get("accept", "")
+    return [fmt for fmt in ASSET_FORMATS if MIME[fmt] in accept]
+
+def choose_variant(entry: dict, formats: list[str], width: Optional[int]) -> Optional[dict]:
+    """Best variant for the client: preferred format, then the smallest width >= requested (else the largest)."""
+    for fmt in formats:
+        candidates = sorted((v for v in entry["variants"] if v["format"] == fmt), key=lambda v: v["width"])
+        if not candidates:
+            continue
+        if width:
+            for v in candidates:
+                if v["width"] >= width:
+                    return v
+        return candidates[-1]
+    return None
+
+class AssetStaticFiles(StaticFiles):
+    """
+    StaticFiles that serves manifest URLs with per-client variants.
+
+    A hashed URL maps to several files (AVIF/WebP at a few widths plus the source); the
+    best one is picked from Accept (or X-Image-Format / ?format=) and ?w= (default
+    ASSET_DEFAULT_WIDTH). Those responses are immutable, carry a strong ETag of the
+    bytes actually sent and Vary: Accept so shared caches keep one copy per format.
+    """
+
+    async def get_response(self, path: str, scope) -> Response:
+        entry = manifest.entry_for_url(path.replace(os.sep, "/"))
+        if entry is None:
+            return await super().get_response(path, scope)
+        headers = {k.decode("latin-1"): v.decode("latin-1") for k, v in scope.get("headers", [])}
+        query = dict(parse_qsl(scope.get("query_string", b"").decode("latin-1")))
+        if "format" in query:
+            headers["x-image-format"] = query["format"]
+        width = int(query["w"]) if query.get("w", "").isdigit() else ASSET_DEFAULT_WIDTH
+        variant = choose_variant(entry, accepted_formats(headers), width)
+        served_path, sha = (variant["path"], variant["sha256"]) if variant else (entry["url"], entry["sha256"])
+        etag = f'"{sha[:32]}"'
+        cache_headers = {"Cache-Control": IMMUTABLE, "ETag": etag, "Vary": "Accept, X-Image-Format"}
+        if etag in [t.strip() for t in headers.get("if-none-match", "").split(",")]:
+            return Response(status_code=304, headers=cache_headers)
+        response = await super().get_response(served_path, scope)
+        if response.status_code == 200:
+            response.headers.update(cache_headers)
+        return response
+
+def _variant_name(rel_stem: str, digest: str, width: int, fmt: str) -> str:
+    return f"{rel_stem}.{digest[:12]}.w{width}.{fmt}"
+
+def _build_image(source_dir: str, build_prefix: str, file_path: str, digest: str, widths: tuple,
+                 formats: tuple) -> dict:
+    """Hashed copy plus variants of one source image; returns its manifest entry."""
+    from PIL import Image
+
+    src = os.path.join(source_dir, file_path)
+    stem, ext = os.path.splitext(file_path)
+    hashed = f"{build_prefix}/{stem}.{digest[:12]}{ext.lower()}"
+    os.makedirs(os.path.dirname(os.path.join(source_dir, hashed)), exist_ok=True)
+    with open(src, "rb") as f_in, open(os.path.join(source_dir, hashed), "wb") as f_out:
+        f_out.write(f_in.read())
+
+    variants = []
+    with Image.open(src) as im:
+        im.load()
+        if im.mode not in ("RGB", "RGBA"):
+            im = im.convert("RGBA" if "transparency" in im.info else "RGB")
+        full = max(im.size)
+        for width in sorted({w for w in widths if w < full} | {full}):
+            scaled = im if width == full else im.copy()
+            if width != full:
+                scaled.thumbnail((width, width), Image.LANCZOS)
+            for fmt in formats:
+                rel = f"{build_prefix}/{_variant_name(stem, digest, width, fmt)}"
+                scaled.save(os.path.join(source_dir, rel), fmt.upper(), quality=QUALITY[fmt])
+                variants.append({"path": rel, "format": fmt, "width": width,
+                                 "sha256": file_sha256(os.path.join(source_dir, rel))})
+        return {"url": hashed, "sha256": digest, "width": im.size[0], "height": im.size[1], "variants": variants}
+
+def build(source_dir: str = STATIC_DIR, out_dir: str = BUILD_DIR, widths: tuple = ASSET_WIDTHS,
+          formats: tuple = ASSET_FORMATS, force: bool = False, workers: int = 1) -> dict:
+    """
+    Write hashed copies and AVIF/WebP variants of every image under source_dir/images
+    and the manifest. Unchanged sources (same sha256) are skipped unless force; the
+    rest are encoded by up to workers processes.
+    """
+    from PIL import features
+
+    formats = tuple(f for f in formats if features.check(f))
+    previous = {}
+    manifest_path = os.path.join(out_dir, "manifest.json")
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            previous = json.load(f).get("images", {})
+    old = {} if force else previous
+    build_prefix = os.path.relpath(out_dir, source_dir).replace(os.sep, "/")
+
+    entries, stats = {}, {"built": 0, "unchanged": 0, "bytes_source": 0, "bytes_smallest": 0}
+    todo = []
+    for root, dirs, files in os.walk(os.path.join(source_dir, "images")):
+        dirs.sort()
+        for name in sorted(files):
+            if not name.lower().endswith(SOURCE_EXTENSIONS):
+                continue
+            src = os.path.join(root, name)
+            file_path = os.path.relpath(src, source_dir).replace(os.sep, "/")
+            digest = file_sha256(src)
+            prev = old.get(file_path)
+            if prev and prev["sha256"] == digest and all(
+                os.path.exists(os.path.join(source_dir, p)) for p in [prev["url"]] + [v["path"] for v in prev["variants"]]
+            ):
+                entries[file_path] = prev
+                stats["unchanged"] += 1
+                continue
+            todo.append((file_path, digest))
+
+    jobs = [(source_dir, build_prefix, file_path, digest, widths, formats) for file_path, digest in todo]
+    if workers > 1 and len(jobs) > 1:
+        # Encoding (AVIF especially) is CPU-bound: one image per process
+        with ProcessPoolExecutor(min(workers, len(jobs))) as pool:
+            built = list(pool.map(_build_image, *zip(*jobs)))
+    else:
+        built = [_build_image(*job) for job in jobs]
+    for (file_path, _), entry in zip(todo, built):
+        entries[file_path] = entry
+        stats["built"] += 1
+
+    for entry in entries.values():
+        sizes = [os.path.getsize(os.path.join(source_dir, v["path"])) for v in entry["variants"]]
+        stats["bytes_source"] += os.path.getsize(os.path.join(source_dir, entry["url"]))
+        stats["bytes_smallest"] += min(sizes) if sizes else 0
+
+    os.makedirs(out_dir, exist_ok=True)
+    tmp = manifest_path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump({"images": entries}, f, indent=1, sort_keys=True)
+    os.replace(tmp, manifest_path)
+    _prune(out_dir, source_dir, [entries, previous])
+    return stats
+
+def _prune(out_dir: str, source_dir: str, generations: list[dict]):
+    # Drop files in neither the new manifest nor the one it replaced: workers that have not
+    # reloaded yet, and pages already rendered, keep serving the previous generation's URLs
+    keep = set()
+    for entries in generations:
+        keep |= {os.path.join(source_dir, e["url"]) for e in entries.values()}
+        keep |= {os.path.join(source_dir, v["path"]) for e in entries.values() for v in e["variants"]}
+    for root, _, files in os.walk(out_dir):
+        for name in files:
+            full = os.path.join(root, name)
+            if name != "manifest.json" and full not in keep:
+                os.remove(full)
+
+if __name__ == "__main__":
+    # Run before deploying and after adding images:  python assets.py
+    ap = argparse.ArgumentParser(description="Build content-hashed image variants and manifest.json")
+    ap.add_argument("--force", action="store_true", help="rebuild every image")
+    ap.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="encoder processes")
+    args = ap.parse_args()
+    t0 = time.perf_counter()
+    s = build(force=args.force, workers=args.workers)
+    print(f"Assets: {s['built']} built, {s['unchanged']} unchanged, "
+          f"{s['bytes_source'] / 1e6:.1f} MB source -> {s['bytes_smallest'] / 1e6:.1f} MB smallest variants "
+          f"({time.perf_counter() - t0:.2f}s)")
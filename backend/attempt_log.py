@@ -0,0 +1,174 @@
+import os
+import time
+import logging
+import threading
+from collections import deque
+from datetime import datetime
+from typing import Optional
+
+log = logging.getLogger("uvicorn.error")
+
+# ATTEMPT_LOG_ENABLED=0 makes record() a no-op.
+ATTEMPT_LOG_ENABLED = os.getenv("ATTEMPT_LOG_ENABLED", "1") == "1"
+# Rows held in memory per worker; beyond this the oldest are dropped (and counted).
+ATTEMPT_LOG_MAX_BUFFER = int(os.getenv("ATTEMPT_LOG_MAX_BUFFER", "20000"))
+# Flush when this many rows are waiting, or every ATTEMPT_LOG_FLUSH_SECONDS, whichever is first.
+ATTEMPT_LOG_FLUSH_ROWS = int(os.getenv("ATTEMPT_LOG_FLUSH_ROWS", "500"))
+ATTEMPT_LOG_FLUSH_SECONDS = float(os.getenv("ATTEMPT_LOG_FLUSH_SECONDS", "2"))
+
+class AttemptLog:
+    """
+    Write-behind buffer for submission_attempts.
+
+    record() only appends to a bounded deque; a background thread writes the rows with
+    multi-row INSERTs in their own transaction, so the submit path never waits on it.
+    A failed flush puts the rows back (space permitting) for the next try.
+
+    on_flush hooks run after the attempts are committed, each in its own transaction: a
+    failing hook is logged and counted (hook_failures) but never holds back the log.
+    """
+
+    def __init__(self, max_buffer: int = ATTEMPT_LOG_MAX_BUFFER, flush_rows: int = ATTEMPT_LOG_FLUSH_ROWS,
+                 flush_seconds: float = ATTEMPT_LOG_FLUSH_SECONDS):
+        self.max_buffer = max_buffer
+        self.flush_rows = flush_rows
+        self.flush_seconds = flush_seconds
+        self._buffer: deque = deque()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._hooks: list = []
+        self.recorded = 0
+        self.written = 0
+        self.dropped = 0
+        self.flushes = 0
+        self.flush_failures = 0
+        self.hook_failures = 0
+        self.last_flush_ms = 0.0
+
+    def on_flush(self, fn):
+        """Run fn(db, rows) after each flush commits, in a transaction of its own, for tables derived from attempts."""
+        self._hooks.append(fn)
+        return fn
+
+    def record(self, rows: list[dict]):
+        if not ATTEMPT_LOG_ENABLED or not rows:
+            return
+        now = datetime.now()
+        with self._lock:
+            for r in rows:
+                r.setdefault("attempted_at", now)
+                if len(self._buffer) >= self.max_buffer:
+                    self._buffer.popleft()
+                    self.dropped += 1
+                self._buffer.append(r)
+            self.recorded += len(rows)
+            full = len(self._buffer) >= self.flush_rows
+        if full:
+            self._wake.set()
+
+    def _take(self) -> list[dict]:
+        with self._lock:
+            rows = list(self._buffer)
+            self._buffer.clear()
+        return rows
+
+    def _requeue(self, rows: list[dict]):
+        with self._lock:
+            room = max(0, self.max_buffer - len(self._buffer))
+            self.dropped += max(0, len(rows) - room)
+            # Keep the newest rows, ahead of anything recorded since
+            self._buffer.extendleft(reversed(rows[-room:] if room else []))
+
+    def flush(self) -> int:
+        """Write everything buffered now; returns rows written."""
+        from database import SessionLocal
+        import crud
+        import scoring_service
+
+        with self._flush_lock:
+            rows = self._take()
+            if not rows:
+                return 0
+            t0 = time.perf_counter()
+            # Hashing the model folder once is this thread's job, not the request's
+            model = scoring_service.fingerprint()
+            for r in rows:
+                r.setdefault("model", model)
+            db = SessionLocal()
+            try:
+                for i in range(0, len(rows), self.flush_rows):
+                    crud.insert_attempts(db, rows[i:i + self.flush_rows])
+                db.commit()
+            except Exception as e:
+                db.rollback()
+                with self._lock:
+                    self.flush_failures += 1
+                self._requeue(rows)
+                log.warning("Attempt log flush of %d rows failed: %s", len(rows), e)
+                return 0
+            finally:
+                db.close()
+            with self._lock:
+                self.written += len(rows)
+                self.flushes += 1
+                self.last_flush_ms = round((time.perf_counter() - t0) * 1000, 2)
+            self._run_hooks(rows)
+            return len(rows)
+
+    def _run_hooks(self, rows: list[dict]):
+        from database import SessionLocal
+
+        for fn in self._hooks:
+            db = SessionLocal()
+            try:
+                fn(db, rows)
+                db.commit()
+            except Exception as e:
+                db.rollback()
+                with self._lock:
+                    self.hook_failures += 1
+                log.warning("Attempt log hook %s failed on %d rows (attempts kept): %s",
+                            getattr(fn, "__qualname__", fn), len(rows), e)
+            finally:
+                db.close()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.flush_seconds)
+            self._wake.clear()
+            self.flush()
+
+    def start(self):
+        if not ATTEMPT_LOG_ENABLED or (self._thread and self._thread.is_alive()):
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="attempt-log", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 10.0):
+        """Stop the flusher and write whatever is still buffered (lifespan shutdown)."""
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        self.flush()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "buffered": len(self._buffer),
+                "max_buffer": self.max_buffer,
+                "recorded": self.recorded,
+                "written": self.written,
+                "dropped": self.dropped,
+                "flushes": self.flushes,
+                "flush_failures": self.flush_failures,
+                "hook_failures": self.hook_failures,
+                "last_flush_ms": self.last_flush_ms,
+            }
+
+attempt_log = AttemptLog()
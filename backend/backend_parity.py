@@ -0,0 +1,66 @@
+import os
+import re
+import sys
+import json
+import argparse
+import numpy as np
+from inference_backends import BACKENDS, LOCAL_MODEL_PATH, load_backend
+from scoring_service import normalize
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+SEED_FILE = os.path.join(SCRIPT_DIR, "seed_images.sql")
+
+def seeded_prompts(path: str = SEED_FILE) -> list[str]:
+    with open(path, encoding="utf-8") as f:
+        sql = f.read()
+    rows = re.findall(r"'(?:easy|medium|hard)','[^']*','((?:[^']|'')*)'", sql)
+    return [r.replace("''", "'") for r in rows]
+
+def scoring_pairs(prompts: list[str]) -> list[tuple[str, str]]:
+    """
+    (user_prompt, original_prompt) pairs spanning the score range players actually hit:
+    exact copies, partial answers, shuffled word order and unrelated prompts.
+    """
+    pairs = []
+    for i, p in enumerate(prompts):
+        words = p.split()
+        pairs.append((p, p))
+        pairs.append((" ".join(words[: max(1, len(words) // 2)]), p))
+        pairs.append((" ".join(reversed(words)), p))
+        pairs.append((prompts[(i + 1) % len(prompts)], p))
+    return pairs
+
+def pair_scores(backend, pairs: list[tuple[str, str]]) -> np.ndarray:
+    texts = list(dict.fromkeys(normalize(t) for pair in pairs for t in pair))
+    vecs = backend.encode(texts)
+    vecs = vecs / np.clip(np.linalg.norm(vecs, axis=1, keepdims=True), 1e-8, None)
+    rows = {t: vecs[i] for i, t in enumerate(texts)}
+    sims = np.array([float(np.dot(rows[normalize(u)], rows[normalize(o)])) for u, o in pairs])
+    return np.round(np.clip(sims, 0.0, 1.0) * 100.0, 2)
+
+def main():
+    ap = argparse.ArgumentParser(description="Score drift of ONNX backends against the PyTorch baseline on the seeded prompts.")
+    ap.add_argument("--backends", nargs="+", default=[b for b in BACKENDS if b not in ("torch", "fake")])
+    ap.add_argument("--tolerance", type=float, default=1.0, help="max allowed |score drift| in percentage points")
+    args = ap.parse_args()
+
+    pairs = scoring_pairs(seeded_prompts())
+    baseline = pair_scores(load_backend("torch", LOCAL_MODEL_PATH), pairs)
+    report, ok = {"pairs": len(pairs), "tolerance": args.tolerance, "backends": {}}, True
+    for name in args.backends:
+        drift = np.abs(pair_scores(load_backend(name, LOCAL_MODEL_PATH), pairs) - baseline)
+        worst = int(drift.argmax())
+        within = bool(drift.max() <= args.tolerance)
+        ok = ok and within
+        report["backends"][name] = {
+            "max_drift": round(float(drift.max()), 3),
+            "mean_drift": round(float(drift.mean()), 3),
+            "p95_drift": round(float(np.percentile(drift, 95)), 3),
+            "worst_pair": {"user_prompt": pairs[worst][0], "original_prompt": pairs[worst][1]},
+            "within_tolerance": within,
+        }
+    print(json.dumps(report, indent=2))
+    sys.exit(0 if ok else 1)
+
+if __name__ == "__main__":
+    main()
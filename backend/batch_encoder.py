@@ -0,0 +1,139 @@
+import queue
+import threading
+import time
+import numpy as np
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from typing import Callable
+
+# Upper bounds (ms) for the queue-wait histogram; the last bucket is +Inf.
+WAIT_BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250)
+
+class EncodeTimeout(Exception):
+    """The batch worker did not answer within result_timeout."""
+
+class _Pending:
+    __slots__ = ("text", "future", "enqueued_at")
+
+    def __init__(self, text: str):
+        self.text = text
+        self.future: Future = Future()
+        self.enqueued_at = time.perf_counter()
+
+class BatchEncoder:
+    """
+    Cross-request micro-batcher in front of a batch encode function.
+
+    Callers from any thread enqueue sentences and block on a future. A single worker
+    thread drains the queue: it flushes as soon as max_batch_size sentences are waiting
+    or max_wait_ms after the oldest one arrived, runs one encode for the batch and
+    hands each caller its row. Every collected batch resolves its futures, with rows or
+    the exception; callers give up after result_timeout seconds regardless.
+    """
+
+    def __init__(self, encode_fn: Callable[[list[str]], np.ndarray], max_batch_size: int = 32, max_wait_ms: float = 5.0,
+                 result_timeout: float = 30.0):
+        self.encode_fn = encode_fn
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self.result_timeout = result_timeout
+        self._queue: "queue.Queue[_Pending]" = queue.Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._batches = 0
+        self._items = 0
+        self._batch_sizes: dict[int, int] = {}
+        self._wait_count = 0
+        self._wait_sum_ms = 0.0
+        self._wait_max_ms = 0.0
+        self._wait_buckets = [0] * (len(WAIT_BUCKETS_MS) + 1)
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                t = threading.Thread(target=self._run, name="batch-encoder", daemon=True)
+                t.start()
+                self._thread = t
+
+    def encode(self, texts: list[str]) -> np.ndarray:
+        """Encode texts (already normalized); blocks until every row is ready."""
+        self._ensure_started()
+        pending = [_Pending(t) for t in texts]
+        for p in pending:
+            self._queue.put(p)
+        deadline = time.monotonic() + self.result_timeout
+        try:
+            return np.vstack([p.future.result(timeout=max(0.0, deadline - time.monotonic())) for p in pending])
+        except FutureTimeout:
+            raise EncodeTimeout(f"no embedding within {self.result_timeout:g}s") from None
+
+    def _collect(self) -> list[_Pending]:
+        first = self._queue.get()
+        batch = [first]
+        deadline = first.enqueued_at + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            try:
+                self._encode_batch(batch)
+            except BaseException as e:
+                # Also covers bad encoder output (short or ragged rows) and stats errors
+                for p in batch:
+                    if not p.future.done():
+                        p.future.set_exception(e)
+
+    def _encode_batch(self, batch: list[_Pending]):
+        started = time.perf_counter()
+        # Identical prompts in one batch (copy-pasted answers) are encoded once.
+        unique = list(dict.fromkeys(p.text for p in batch))
+        vecs = np.asarray(self.encode_fn(unique))
+        rows = {t: vecs[i] for i, t in enumerate(unique)}
+        for p in batch:
+            p.future.set_result(rows[p.text])
+        self._record(batch, started)
+
+    def _record(self, batch: list[_Pending], started: float):
+        with self._stats_lock:
+            self._batches += 1
+            self._items += len(batch)
+            self._batch_sizes[len(batch)] = self._batch_sizes.get(len(batch), 0) + 1
+            for p in batch:
+                wait_ms = (started - p.enqueued_at) * 1000.0
+                self._wait_count += 1
+                self._wait_sum_ms += wait_ms
+                self._wait_max_ms = max(self._wait_max_ms, wait_ms)
+                for i, bound in enumerate(WAIT_BUCKETS_MS):
+                    if wait_ms <= bound:
+                        self._wait_buckets[i] += 1
+                        break
+                else:
+                    self._wait_buckets[-1] += 1
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            labels = [f"le_{b}" for b in WAIT_BUCKETS_MS] + ["le_inf"]
+            return {
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait * 1000.0,
+                "queue_depth": self._queue.qsize(),
+                "batches": self._batches,
+                "items": self._items,
+                "mean_batch_size": round(self._items / self._batches, 3) if self._batches else 0.0,
+                "batch_sizes": dict(sorted(self._batch_sizes.items())),
+                "queue_wait_ms": {
+                    "count": self._wait_count,
+                    "mean": round(self._wait_sum_ms / self._wait_count, 3) if self._wait_count else 0.0,
+                    "max": round(self._wait_max_ms, 3),
+                    "buckets": dict(zip(labels, self._wait_buckets)),
+                },
+            }
@@ -0,0 +1,174 @@
+import os
+import time
+import random
+import threading
+import uuid
+from typing import Optional
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool
+from models import Image, Level
+from shared_store import SharedStore
+
+# Reload the active images at least this often even without a version bump.
+CATALOG_TTL_SECONDS = float(os.getenv("CATALOG_TTL_SECONDS", "300"))
+# How often a worker looks at the shared version stamp.
+VERSION_CHECK_SECONDS = 1.0
+# CATALOG_BALANCE=1 draws images whose pass rate is far from their level's median less
+# often (weights come from image_stats and are refreshed with the catalog). image_stats is
+# filled by the attempt log, so with ATTEMPT_LOG_ENABLED=0 the weights stop updating;
+# `python image_stats.py --rebuild` recomputes them from session_images.
+CATALOG_BALANCE = os.getenv("CATALOG_BALANCE", "0") == "1"
+# Images with fewer attempts than this keep full weight until their pass rate means something.
+CATALOG_BALANCE_MIN_ATTEMPTS = int(os.getenv("CATALOG_BALANCE_MIN_ATTEMPTS", "30"))
+# Lowest draw weight, so outliers still come up now and then and keep being measured (> 0).
+CATALOG_BALANCE_FLOOR = max(0.01, float(os.getenv("CATALOG_BALANCE_FLOOR", "0.2")))
+
+VERSION_KEY = "catalog_version"
+
+class ImageRecord:
+    __slots__ = ("id", "level", "file_path", "original_prompt", "weight")
+
+    def __init__(self, id: str, level: Level, file_path: str, original_prompt: str, weight: float = 1.0):
+        self.id = id
+        self.level = level
+        self.file_path = file_path
+        self.original_prompt = original_prompt
+        self.weight = weight  # draw probability relative to 1.0, in (0, 1]
+
+def _sample(pool: list, k: int, rng: random.Random, weighted: bool = False) -> list:
+    # Rejection sampling of k distinct indices: O(k) for k << len(pool), whatever the pool size.
+    # Weighted: a drawn index is kept with probability record.weight.
+    n = len(pool)
+    if k >= n:
+        out = list(pool)
+        rng.shuffle(out)
+        return out
+    seen, picked = set(), []
+    while len(picked) < k:
+        i = rng.randrange(n)
+        if i in seen or (weighted and rng.random() >= pool[i].weight):
+            continue
+        seen.add(i)
+        picked.append(pool[i])
+    return picked
+
+def balance_weights(records: list[ImageRecord], rates: dict[str, tuple[int, float]]):
+    """Per level: weight = 1 - |pass rate - level median|, floored; unmeasured images keep 1.0."""
+    measured = [rates[r.id][1] for r in records
+                if r.id in rates and rates[r.id][0] >= CATALOG_BALANCE_MIN_ATTEMPTS]
+    if not measured:
+        return
+    median = sorted(measured)[len(measured) // 2]
+    for r in records:
+        attempts, rate = rates.get(r.id, (0, 0.0))
+        if attempts >= CATALOG_BALANCE_MIN_ATTEMPTS:
+            r.weight = max(CATALOG_BALANCE_FLOOR, 1.0 - abs(rate - median))
+
+class Catalog:
+    """
+    Process-local snapshot of the active images, grouped by Level.
+
+    The snapshot is swapped as a whole on refresh, so readers never see a partial
+    catalog. It is reloaded after CATALOG_TTL_SECONDS or as soon as the shared version
+    stamp changes (see bump_version), which is how every worker picks up catalog edits.
+    """
+
+    def __init__(self, ttl: float = CATALOG_TTL_SECONDS, balance: bool = CATALOG_BALANCE):
+        self.ttl = ttl
+        self.balance = balance
+        self._lock = threading.Lock()
+        self._by_level: dict[Level, list[ImageRecord]] = {}
+        self._by_id: dict[str, ImageRecord] = {}
+        self._loaded_at = 0.0
+        self._version = None
+        self._checked_at = 0.0
+        self._store = None
+        self._rng = random.Random()
+
+    def _versions(self) -> SharedStore:
+        if self._store is None:
+            self._store = SharedStore("catalog")
+        return self._store
+
+    def _current_version(self) -> Optional[bytes]:
+        return self._versions().get(VERSION_KEY)
+
+    def _stale(self) -> bool:
+        now = time.monotonic()
+        if not self._by_id or now - self._loaded_at > self.ttl:
+            return True
+        if now - self._checked_at > VERSION_CHECK_SECONDS:
+            self._checked_at = now
+            return self._current_version() != self._version
+        return False
+
+    def _read(self, db: Session) -> tuple[list, dict]:
+        """Active image rows and, when balancing, their pass rates (SQL only)."""
+        rows = db.execute(
+            select(Image.id, Image.level, Image.file_path, Image.original_prompt).where(Image.active == 1)
+        ).all()
+        rates = {}
+        if self.balance:
+            import image_stats
+            rates = image_stats.pass_rates(db)
+        return rows, rates
+
+    def _install(self, version: Optional[bytes], rows: list, rates: dict):
+        by_level: dict[Level, list[ImageRecord]] = {lvl: [] for lvl in Level}
+        by_id = {}
+        for r in rows:
+            rec = ImageRecord(r.id, Level(r.level), r.file_path, r.original_prompt)
+            by_level[rec.level].append(rec)
+            by_id[rec.id] = rec
+        if self.balance:
+            for records in by_level.values():
+                balance_weights(records, rates)
+        with self._lock:
+            self._by_level, self._by_id = by_level, by_id
+            self._version = version
+            self._loaded_at = self._checked_at = time.monotonic()
+
+    def refresh(self, db: Session):
+        version = self._current_version()
+        self._install(version, *self._read(db))
+
+    def ensure_fresh(self, db: Session):
+        if self._stale():
+            self.refresh(db)
+
+    async def ensure_fresh_async(self, db: AsyncSession):
+        """ensure_fresh() for request handlers: the version stamp and the snapshot build stay off the loop."""
+        if await run_in_threadpool(self._stale):
+            version = await run_in_threadpool(self._current_version)
+            rows, rates = await db.run_sync(self._read)
+            await run_in_threadpool(self._install, version, rows, rates)
+
+    def sample(self, db: Session, level: Level, k: int) -> list[ImageRecord]:
+        """
+        k distinct random active images of a level (fewer if the level has fewer). Only an
+        empty catalog is loaded here; callers keep it current with ensure_fresh[_async]().
+        """
+        if not self._by_id:
+            self.refresh(db)
+        with self._lock:
+            return _sample(self._by_level.get(level, []), k, self._rng, self.balance)
+
+    def get(self, image_id: str) -> Optional[ImageRecord]:
+        return self._by_id.get(image_id)
+
+    def counts(self) -> dict:
+        return {lvl.value: len(items) for lvl, items in self._by_level.items()}
+
+def bump_version() -> str:
+    """Tell every worker on the host to reload the catalog on its next access."""
+    token = uuid.uuid4().hex
+    SharedStore("catalog").set(VERSION_KEY, token.encode())
+    return token
+
+catalog = Catalog()
+
+if __name__ == "__main__":
+    # Run after editing the images table:  python catalog.py
+    print("catalog version", bump_version())
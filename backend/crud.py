@@ -1,8 +1,9 @@
 import uuid
 from typing import Optional
-from sqlalchemy import select, func, text, desc
+from sqlalchemy import select, text, desc
 from sqlalchemy.orm import Session
 from models import User, Image, Session as GameSession, SessionImage, State, Stage, Level
+from catalog import catalog
 
 def gen_id() -> str:
     return str(uuid.uuid4())
@@ -56,9 +57,8 @@ def has_active_session(db: Session, user_id: str) -> Optional[GameSession]:
     ).scalar_one_or_none()
 
 def random_images(db: Session, level: Level, limit: int):
-    return db.execute(
-        select(Image).where(Image.level==level, Image.active==1).order_by(func.rand()).limit(limit)
-    ).scalars().all()
+    # Sampled from the in-memory catalog; no ORDER BY RAND() scan of images
+    return catalog.sample(db, level, limit)
 
 def assign_stage_images(db: Session, session_id: str, stage: Stage, level: Level, count: int, start_order: int) -> list[SessionImage]:
     imgs = random_images(db, level, count)
@@ -140,7 +140,7 @@ def set_stage(db: Session, session_id: str, stage: Stage):
 
 def set_completed(db: Session, session_id: str, total_score: float, images_completed: int):
     db.execute(
-        text("UPDATE sessions SET state = 'completed', current_stage = 'done', total_score = :ts, images_completed = :ic, completed_at = NOW() WHERE id = :sid"),
+        text("UPDATE sessions SET state = 'completed', current_stage = 'done', total_score = :ts, images_completed = :ic, completed_at = CURRENT_TIMESTAMP WHERE id = :sid"),
         {"ts": total_score, "ic": images_completed, "sid": session_id}
     )
 
@@ -155,26 +155,11 @@ def get_session_image_prompt(db: Session, session_image_id: str):
         {"id": session_image_id}
     ).mappings().one_or_none()
 
-def get_failing_details_for_stage(db: Session, session_id: str, stage: Stage, threshold: float):
-    rows = db.execute(
-        text("""
-            SELECT 
-              si.id as session_image_id,
-              si.stage_order,
-              si.stage_name,
-              si.score,
-              si.points,
-              i.original_prompt,
-              i.file_path,
-              si.level
-            FROM session_images si
-            JOIN images i ON i.id = si.image_id
-            WHERE si.session_id = :sid AND si.stage_name = :stage
-            ORDER BY si.stage_order
-        """),
-        {"sid": session_id, "stage": stage.value}
-    ).mappings().all()
-
+def stage_details(rows, stage: Stage, threshold: float):
+    """
+    Pass/fail outcome for one stage from its rows (ordered by stage_order, each with
+    stage_order, level, score, points, original_prompt, file_path).
+    """
     if not rows:
         return None
 
@@ -205,6 +190,28 @@ def get_failing_details_for_stage(db: Session, session_id: str, stage: Stage, th
     # passed
     return {"matches": matches, "image_order": None}
 
+def get_failing_details_for_stage(db: Session, session_id: str, stage: Stage, threshold: float):
+    rows = db.execute(
+        text("""
+            SELECT 
+              si.id as session_image_id,
+              si.stage_order,
+              si.stage_name,
+              si.score,
+              si.points,
+              i.original_prompt,
+              i.file_path,
+              si.level
+            FROM session_images si
+            JOIN images i ON i.id = si.image_id
+            WHERE si.session_id = :sid AND si.stage_name = :stage
+            ORDER BY si.stage_order
+        """),
+        {"sid": session_id, "stage": stage.value}
+    ).mappings().all()
+
+    return stage_details(rows, stage, threshold)
+
 def get_stage_matches(db: Session, session_id: str, stage: Stage):
     rows = db.execute(
         text("""
@@ -257,4 +264,255 @@ def get_all_session_items_for_results(db: Session, session_id: str):
         ORDER BY si.stage_order
         """),
         {"sid": session_id}
-    ).mappings().all()
\ No newline at end of file
+    ).mappings().all()
+
+def get_session_items(db: Session, session_id: str):
+    """
+    Every session image (all stages, ordered) with the fields submit_stage needs, so a
+    submission can be validated, scored and resolved from one read.
+    """
+    return db.execute(
+        text("""
+        SELECT
+            si.id AS session_image_id,
+            si.stage_order,
+            si.stage_name,
+            si.level,
+            si.score,
+            si.points,
+            si.user_prompt,
+            i.id AS image_id,
+            i.file_path,
+            i.original_prompt
+        FROM session_images si
+        JOIN images i ON i.id = si.image_id
+        WHERE si.session_id = :sid
+        ORDER BY si.stage_order
+        """),
+        {"sid": session_id}
+    ).mappings().all()
+
+def update_scores_bulk(db: Session, updates: list[tuple[str, str, float, int]]):
+    """
+    Write [(session_image_id, prompt, score, points)] in a single UPDATE ... CASE statement.
+    """
+    if not updates:
+        return
+    params = {}
+    prompt_cases, score_cases, points_cases, ids = [], [], [], []
+    for i, (sid, prompt, score, points) in enumerate(updates):
+        params[f"id{i}"], params[f"p{i}"], params[f"s{i}"], params[f"pts{i}"] = sid, prompt, score, points
+        prompt_cases.append(f"WHEN :id{i} THEN :p{i}")
+        score_cases.append(f"WHEN :id{i} THEN :s{i}")
+        points_cases.append(f"WHEN :id{i} THEN :pts{i}")
+        ids.append(f":id{i}")
+    db.execute(
+        text(f"""
+            UPDATE session_images
+            SET user_prompt = CASE id {' '.join(prompt_cases)} END,
+                score = CASE id {' '.join(score_cases)} END,
+                points = CASE id {' '.join(points_cases)} END
+            WHERE id IN ({', '.join(ids)})
+        """),
+        params
+    )
+
+def set_scores_bulk(db: Session, updates: list[tuple[str, float, int]]):
+    """Rewrite [(session_image_id, score, points)] in one UPDATE ... CASE (re-scoring)."""
+    if not updates:
+        return
+    params = {}
+    score_cases, points_cases, ids = [], [], []
+    for i, (sid, score, points) in enumerate(updates):
+        params[f"id{i}"], params[f"s{i}"], params[f"pts{i}"] = sid, score, points
+        score_cases.append(f"WHEN :id{i} THEN :s{i}")
+        points_cases.append(f"WHEN :id{i} THEN :pts{i}")
+        ids.append(f":id{i}")
+    db.execute(
+        text(f"""
+            UPDATE session_images
+            SET score = CASE id {' '.join(score_cases)} END,
+                points = CASE id {' '.join(points_cases)} END
+            WHERE id IN ({', '.join(ids)})
+        """),
+        params
+    )
+
+def recompute_total_scores(db: Session) -> int:
+    """total_score = sum of points for every finished session; returns rows updated."""
+    return db.execute(text("""
+        UPDATE sessions
+        SET total_score = (SELECT COALESCE(SUM(si.points), 0) FROM session_images si WHERE si.session_id = sessions.id)
+        WHERE total_score IS NOT NULL
+    """)).rowcount
+
+def advance_stage(db: Session, session_id: str, stage: Stage, images_completed: int):
+    db.execute(
+        text("UPDATE sessions SET current_stage = :st, images_completed = :ic WHERE id = :sid"),
+        {"st": stage.value, "ic": images_completed, "sid": session_id}
+    )
+
+def _dialect(db: Session) -> str:
+    return db.get_bind().dialect.name
+
+def lock_user_sessions(db: Session, display_name: str):
+    """
+    Create the user if missing and return (user_id, [{session_id, state, current_stage}])
+    newest session first. Insert-or-ignore on the display_name unique key makes concurrent
+    first starts safe; on MySQL the rows are locked until commit so two tabs cannot both
+    create a session.
+    """
+    params = {"id": gen_id(), "n": display_name}
+    if _dialect(db) == "mysql":
+        db.execute(text("INSERT INTO users (id, display_name) VALUES (:id, :n) ON DUPLICATE KEY UPDATE id = id"), params)
+    else:
+        db.execute(text("INSERT INTO users (id, display_name) VALUES (:id, :n) ON CONFLICT (display_name) DO NOTHING"), params)
+    lock = " FOR UPDATE" if _dialect(db) == "mysql" else ""
+    rows = db.execute(
+        text(f"""
+        SELECT u.id AS user_id, s.id AS session_id, s.state, s.current_stage
+        FROM users u
+        LEFT JOIN sessions s ON s.user_id = u.id
+        WHERE u.display_name = :n
+        ORDER BY s.created_at DESC{lock}
+        """),
+        {"n": display_name}
+    ).mappings().all()
+    return rows[0]["user_id"], [dict(r) for r in rows if r["session_id"] is not None]
+
+def create_session_with_images(db: Session, user_id: str, plan: list[tuple[Stage, Level, int]]):
+    """
+    Insert a session plus all of its session_images (one multi-row INSERT) without
+    committing. plan is [(stage, level, count)] in play order. Returns (session_id, items)
+    with items shaped like get_session_items rows.
+    """
+    session_id = gen_id()
+    items, order = [], 1
+    for stage, level, count in plan:
+        for img in random_images(db, level, count):
+            items.append({
+                "session_image_id": gen_id(),
+                "stage_order": order,
+                "stage_name": stage.value,
+                "level": level.value,
+                "score": None,
+                "points": None,
+                "user_prompt": None,
+                "image_id": img.id,
+                "file_path": img.file_path,
+                "original_prompt": img.original_prompt,
+            })
+            order += 1
+    db.execute(
+        text("INSERT INTO sessions (id, user_id, state, current_stage) VALUES (:id, :uid, 'active', 'easy')"),
+        {"id": session_id, "uid": user_id}
+    )
+    if items:
+        params = {"sid": session_id}
+        values = []
+        for i, it in enumerate(items):
+            values.append(f"(:id{i}, :sid, :img{i}, :lvl{i}, :ord{i}, :st{i})")
+            params.update({f"id{i}": it["session_image_id"], f"img{i}": it["image_id"], f"lvl{i}": it["level"],
+                           f"ord{i}": it["stage_order"], f"st{i}": it["stage_name"]})
+        db.execute(
+            text("INSERT INTO session_images (id, session_id, image_id, level, stage_order, stage_name) VALUES "
+                 + ", ".join(values)),
+            params
+        )
+    return session_id, items
+
+ATTEMPT_COLUMNS = ("session_id", "session_image_id", "image_id", "stage_name", "user_prompt", "score", "points",
+                   "passed", "scoring_ms", "model", "attempted_at")
+
+def insert_attempts(db: Session, rows: list[dict]):
+    """Append rows to submission_attempts with one multi-row INSERT (no commit)."""
+    if not rows:
+        return
+    params, values = {}, []
+    for i, r in enumerate(rows):
+        values.append("(" + ", ".join(f":{c}{i}" for c in ATTEMPT_COLUMNS) + ")")
+        params.update({f"{c}{i}": r.get(c) for c in ATTEMPT_COLUMNS})
+    db.execute(
+        text(f"INSERT INTO submission_attempts ({', '.join(ATTEMPT_COLUMNS)}) VALUES " + ", ".join(values)),
+        params
+    )
+
+def merge_image_stats(db: Session, batch: dict[str, dict]):
+    """
+    Fold per-image batch aggregates {image_id: {attempts, passes, score_mean, score_m2,
+    score_min, score_max}} into image_stats with Chan's parallel Welford update. Additive,
+    so concurrent flushes from several workers need no locking.
+    """
+    if not batch:
+        return
+    mysql = _dialect(db) == "mysql"
+    new = (lambda c: f"VALUES({c})") if mysql else (lambda c: f"excluded.{c}")
+    least, greatest = ("LEAST", "GREATEST") if mysql else ("MIN", "MAX")
+    n = f"(attempts + {new('attempts')})"
+    delta = f"({new('score_mean')} - score_mean)"
+    # MySQL applies the assignments in order: everything that reads the old attempts/mean comes first
+    updates = f"""
+        score_m2 = score_m2 + {new('score_m2')} + {delta} * {delta} * attempts * {new('attempts')} / {n},
+        score_mean = score_mean + {delta} * {new('attempts')} / {n},
+        score_min = {least}(score_min, {new('score_min')}),
+        score_max = {greatest}(score_max, {new('score_max')}),
+        passes = passes + {new('passes')},
+        attempts = attempts + {new('attempts')},
+        updated_at = CURRENT_TIMESTAMP
+    """
+    params, values = {}, []
+    for i, (image_id, a) in enumerate(batch.items()):
+        values.append(f"(:id{i}, :n{i}, :p{i}, :mean{i}, :m2{i}, :lo{i}, :hi{i}, CURRENT_TIMESTAMP)")
+        params.update({f"id{i}": image_id, f"n{i}": a["attempts"], f"p{i}": a["passes"], f"mean{i}": a["score_mean"],
+                       f"m2{i}": a["score_m2"], f"lo{i}": a["score_min"], f"hi{i}": a["score_max"]})
+    conflict = "ON DUPLICATE KEY UPDATE" if mysql else "ON CONFLICT (image_id) DO UPDATE SET"
+    db.execute(
+        text("INSERT INTO image_stats (image_id, attempts, passes, score_mean, score_m2, score_min, score_max, updated_at) "
+             "VALUES " + ", ".join(values) + f" {conflict} {updates}"),
+        params
+    )
+
+def add_score_histogram(db: Session, counts: dict[tuple[str, int], int]):
+    """Add {(image_id, bucket): attempts} to image_score_hist."""
+    if not counts:
+        return
+    mysql = _dialect(db) == "mysql"
+    params, values = {}, []
+    for i, ((image_id, bucket), n) in enumerate(counts.items()):
+        values.append(f"(:id{i}, :b{i}, :n{i})")
+        params.update({f"id{i}": image_id, f"b{i}": bucket, f"n{i}": n})
+    conflict = ("ON DUPLICATE KEY UPDATE attempts = attempts + VALUES(attempts)" if mysql
+                else "ON CONFLICT (image_id, bucket) DO UPDATE SET attempts = attempts + excluded.attempts")
+    db.execute(
+        text("INSERT INTO image_score_hist (image_id, bucket, attempts) VALUES " + ", ".join(values) + " " + conflict),
+        params
+    )
+
+def get_image_stats(db: Session, image_id: Optional[str] = None):
+    """image_stats rows joined with the image's level and file; one image or all of them."""
+    where = "WHERE st.image_id = :id" if image_id else ""
+    return db.execute(
+        text(f"""
+        SELECT st.image_id, i.level, i.file_path, i.active, st.attempts, st.passes,
+               st.score_mean, st.score_m2, st.score_min, st.score_max, st.updated_at
+        FROM image_stats st
+        JOIN images i ON i.id = st.image_id
+        {where}
+        """),
+        {"id": image_id} if image_id else {}
+    ).mappings().all()
+
+def get_score_histograms(db: Session, image_id: Optional[str] = None) -> dict[str, dict[int, int]]:
+    where = "WHERE image_id = :id" if image_id else ""
+    rows = db.execute(
+        text(f"SELECT image_id, bucket, attempts FROM image_score_hist {where}"),
+        {"id": image_id} if image_id else {}
+    ).all()
+    out: dict[str, dict[int, int]] = {}
+    for r in rows:
+        out.setdefault(r.image_id, {})[int(r.bucket)] = int(r.attempts)
+    return out
+
+def clear_image_stats(db: Session):
+    db.execute(text("DELETE FROM image_score_hist"))
+    db.execute(text("DELETE FROM image_stats"))
@@ -1,3 +1,5 @@
+-- Matches the latest migration: on a database built from this file run `alembic stamp head`
+-- (not `alembic upgrade`), see alembic.ini.
 CREATE DATABASE IF NOT EXISTS flight_ai_game;
 USE flight_ai_game;
 
@@ -51,5 +53,52 @@ CREATE TABLE session_images (
   UNIQUE KEY uniq_sess_order (session_id, stage_order)
 );
 
+-- Append-only history of every scored prompt, written in batches by attempt_log.py
+CREATE TABLE submission_attempts (
+  id BIGINT AUTO_INCREMENT PRIMARY KEY,
+  session_id CHAR(36) NOT NULL,
+  session_image_id CHAR(36) NOT NULL,
+  image_id CHAR(36) NOT NULL,
+  stage_name ENUM('easy','medium','hard','done') NOT NULL,
+  user_prompt TEXT NOT NULL,
+  score DECIMAL(5,2) NOT NULL,
+  points INT NOT NULL,
+  passed TINYINT(1) NOT NULL,
+  scoring_ms FLOAT,              -- wall time of the stage's score_prompts call
+  model VARCHAR(64),             -- scoring_service.fingerprint()
+  attempted_at DATETIME(3) NOT NULL
+);
+
+-- Running per-image aggregates, folded in by every attempt-log flush (image_stats.py)
+CREATE TABLE image_stats (
+  image_id CHAR(36) PRIMARY KEY,
+  attempts INT NOT NULL,
+  passes INT NOT NULL,
+  score_mean DOUBLE NOT NULL,
+  score_m2 DOUBLE NOT NULL,      -- sum of squared deviations (Welford); variance = m2 / attempts
+  score_min DECIMAL(5,2),
+  score_max DECIMAL(5,2),
+  updated_at DATETIME
+);
+
+-- Score histogram per image, one row per 1-point bucket; percentiles are read from it
+CREATE TABLE image_score_hist (
+  image_id CHAR(36) NOT NULL,
+  bucket TINYINT NOT NULL,       -- floor(score), 100 folded into 99
+  attempts INT NOT NULL,
+  PRIMARY KEY (image_id, bucket)
+);
+
 CREATE INDEX idx_images_level_active ON images (level, active);
 CREATE INDEX idx_sessions_leaderboard ON sessions (state, total_score, completed_at);
+
+-- Access paths of the hot crud queries; explain_check.py fails if one stops being used.
+-- Existing databases get these from migrations/ (alembic upgrade head).
+CREATE INDEX idx_si_session_stage ON session_images (session_id, stage_name, stage_order);
+CREATE INDEX idx_sessions_user_state ON sessions (user_id, state, created_at);
+CREATE INDEX idx_sessions_user_created ON sessions (user_id, created_at);
+CREATE INDEX idx_sessions_rank ON sessions (total_score DESC, created_at);
+
+-- Attempt history by session and by image
+CREATE INDEX idx_attempts_session ON submission_attempts (session_id);
+CREATE INDEX idx_attempts_image ON submission_attempts (image_id, attempted_at);
@@ -0,0 +1,271 @@
+import os
+import json
+import fcntl
+import hashlib
+import threading
+import time
+import numpy as np
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import Callable, Iterable, Optional
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Where the reference-prompt embeddings live. Shared by every worker on the host.
+INDEX_DIR = os.getenv("EMBED_INDEX_DIR", os.path.join(SCRIPT_DIR, "index"))
+# float16 halves the file (and page cache) size; cosine scores move by < 0.01 points.
+INDEX_DTYPE = os.getenv("EMBED_INDEX_DTYPE", "float32")
+# How often a worker checks whether another process rewrote the index.
+RELOAD_CHECK_SECONDS = 1.0
+
+META_FILE = "embeddings.json"
+LOCK_FILE = "embeddings.lock"
+# Bumped when the on-disk layout changes; an index in an older layout is rebuilt.
+INDEX_LAYOUT = 2
+
+@lru_cache(maxsize=None)
+def model_fingerprint(model_path: str) -> str:
+    """
+    Content hash of every file in the model folder (weights, tokenizer, pooling config).
+    Any change to the model produces a new fingerprint and invalidates the index.
+    """
+    h = hashlib.sha256()
+    for root, dirs, files in os.walk(model_path):
+        dirs.sort()
+        for name in sorted(files):
+            full = os.path.join(root, name)
+            h.update(os.path.relpath(full, model_path).encode())
+            with open(full, "rb") as f:
+                for chunk in iter(lambda: f.read(1 << 20), b""):
+                    h.update(chunk)
+    return h.hexdigest()[:16]
+
+def text_hash(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+def set_hash(texts: list[str]) -> str:
+    return text_hash("\n".join(texts))
+
+def reference_texts(original_prompt: str, meta, normalize: Callable[[str], str]) -> list[str]:
+    """
+    Normalized reference prompts of an image: original_prompt first, then meta["references"]
+    (accepted paraphrases), without duplicates.
+    """
+    if isinstance(meta, (str, bytes)):
+        meta = json.loads(meta) if meta else None
+    extra = (meta or {}).get("references") or []
+    texts = [normalize(original_prompt)] + [normalize(t) for t in extra if isinstance(t, str)]
+    return [t for t in dict.fromkeys(texts) if t]
+
+def unit_rows(block: np.ndarray) -> np.ndarray:
+    block = np.atleast_2d(np.asarray(block, dtype=np.float32))
+    return block / np.clip(np.linalg.norm(block, axis=1, keepdims=True), 1e-12, None)
+
+class EmbeddingIndex:
+    """
+    Memory-mapped matrix of L2-normalized reference embeddings, one block of rows per Image.id.
+
+    Layout on disk (INDEX_DIR):
+      embeddings.json          -> {"fingerprint", "dtype", "layout", "dim", "matrix", "ids",
+                                   "starts", "counts", "heads", "sets"}
+      embeddings-<gen>.npy     -> float matrix; image ids[i] owns rows starts[i]:starts[i]+counts[i]
+
+    heads[i] hashes the image's original prompt (checked on every lookup), sets[i] its full
+    reference list (checked by sync_with_catalog). Writers produce a new .npy generation
+    and then atomically replace the json, so readers never see a half-written matrix.
+    """
+
+    def __init__(self, directory: str, fingerprint: str, dtype: str = INDEX_DTYPE):
+        self.directory = directory
+        self.fingerprint = fingerprint
+        self.dtype = np.dtype(dtype)
+        self._lock = threading.Lock()
+        # (matrix, {image_id: (start, count, head hash, set hash)}) swapped as one reference
+        self._state: tuple[Optional[np.ndarray], dict[str, tuple]] = (None, {})
+        self._meta_mtime = None
+        self._checked_at = 0.0
+        self._load()
+
+    @property
+    def _meta_path(self) -> str:
+        return os.path.join(self.directory, META_FILE)
+
+    def _load(self):
+        try:
+            st = os.stat(self._meta_path)
+            with open(self._meta_path) as f:
+                meta = json.load(f)
+        except (FileNotFoundError, ValueError):
+            self._state, self._meta_mtime = (None, {}), None
+            return
+        self._meta_mtime = st.st_mtime_ns
+        if (meta.get("fingerprint") != self.fingerprint or meta.get("dtype") != self.dtype.name
+                or meta.get("layout") != INDEX_LAYOUT):
+            # Built by another model/dtype/layout: treat as empty, the next write replaces it.
+            self._state = (None, {})
+            return
+        matrix = np.load(os.path.join(self.directory, meta["matrix"]), mmap_mode="r")
+        spans = {
+            image_id: (start, count, head, full)
+            for image_id, start, count, head, full in zip(meta["ids"], meta["starts"], meta["counts"], meta["heads"], meta["sets"])
+        }
+        self._state = (matrix, spans)
+
+    def _maybe_reload(self):
+        now = time.monotonic()
+        if now - self._checked_at < RELOAD_CHECK_SECONDS:
+            return
+        self._checked_at = now
+        try:
+            mtime = os.stat(self._meta_path).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        if mtime != self._meta_mtime:
+            with self._lock:
+                self._load()
+
+    def __len__(self) -> int:
+        return len(self._state[1])
+
+    def get(self, image_id: str, text: str) -> Optional[np.ndarray]:
+        """
+        (count, dim) unit-norm reference rows for image_id, or None if missing or built
+        from a different original prompt.
+        """
+        self._maybe_reload()
+        matrix, spans = self._state
+        span = spans.get(image_id)
+        if span is None or span[2] != text_hash(text):
+            return None
+        start, count = span[0], span[1]
+        block = matrix[start:start + count]
+        return block if block.dtype == np.float32 else block.astype(np.float32)
+
+    def reference_hash(self, image_id: str, text: str) -> Optional[str]:
+        """set_hash of the reference texts stored for image_id, or None when get() would miss."""
+        self._maybe_reload()
+        span = self._state[1].get(image_id)
+        if span is None or span[2] != text_hash(text):
+            return None
+        return span[3]
+
+    def stale(self, items: Iterable[tuple[str, list[str]]]) -> list[tuple[str, list[str]]]:
+        """Subset of (image_id, reference texts) pairs that are missing or out of date."""
+        self._maybe_reload()
+        spans = self._state[1]
+        out = []
+        for image_id, texts in items:
+            span = spans.get(image_id)
+            if span is None or span[2] != text_hash(texts[0]) or span[3] != set_hash(texts):
+                out.append((image_id, texts))
+        return out
+
+    def upsert(self, entries: list[tuple[str, list[str], np.ndarray]]):
+        """Insert or replace images: [(image_id, reference texts, (len(texts), dim) vectors)]."""
+        if not entries:
+            return
+        with self._exclusive():
+            matrix, spans = self._state
+            blocks = {
+                image_id: (np.asarray(matrix[s:s + c], dtype=np.float32), head, full)
+                for image_id, (s, c, head, full) in sorted(spans.items(), key=lambda kv: kv[1][0])
+            }
+            for image_id, texts, vecs in entries:
+                blocks[image_id] = (unit_rows(vecs), text_hash(texts[0]), set_hash(texts))
+            self._write(blocks)
+
+    def rebuild(self, items: list[tuple[str, list[str]]], encode: Callable[[list[str]], np.ndarray]):
+        """Re-encode everything: items are (image_id, normalized reference texts) for the whole catalog."""
+        with self._exclusive():
+            flat = [t for _, texts in items for t in texts]
+            vecs = np.asarray(encode(flat), dtype=np.float32) if flat else np.zeros((0, 0), np.float32)
+            blocks, pos = {}, 0
+            for image_id, texts in items:
+                blocks[image_id] = (unit_rows(vecs[pos:pos + len(texts)]), text_hash(texts[0]), set_hash(texts))
+                pos += len(texts)
+            self._write(blocks)
+
+    @contextmanager
+    def _exclusive(self):
+        # Thread lock for this process, flock for the other workers on the host.
+        os.makedirs(self.directory, exist_ok=True)
+        with self._lock, open(os.path.join(self.directory, LOCK_FILE), "w") as fh:
+            fcntl.flock(fh, fcntl.LOCK_EX)
+            try:
+                # Another process may have written since we last looked.
+                self._load()
+                yield
+            finally:
+                fcntl.flock(fh, fcntl.LOCK_UN)
+
+    def _write(self, blocks: dict[str, tuple[np.ndarray, str, str]]):
+        old = None
+        if os.path.exists(self._meta_path):
+            with open(self._meta_path) as f:
+                old = json.load(f).get("matrix")
+        ids = list(blocks)
+        counts = [len(blocks[i][0]) for i in ids]
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1])).astype(int).tolist() if ids else []
+        matrix = np.vstack([blocks[i][0] for i in ids]) if ids else np.zeros((0, 0), np.float32)
+        gen = f"embeddings-{time.time_ns()}.npy"
+        np.save(os.path.join(self.directory, gen), matrix.astype(self.dtype, copy=False))
+        meta = {
+            "fingerprint": self.fingerprint,
+            "dtype": self.dtype.name,
+            "layout": INDEX_LAYOUT,
+            "dim": int(matrix.shape[1]) if matrix.ndim == 2 and matrix.size else 0,
+            "matrix": gen,
+            "ids": ids,
+            "starts": starts,
+            "counts": counts,
+            "heads": [blocks[i][1] for i in ids],
+            "sets": [blocks[i][2] for i in ids],
+        }
+        tmp = self._meta_path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(meta, f)
+        os.replace(tmp, self._meta_path)
+        # Readers that still have the old generation mapped keep a valid view after unlink.
+        if old and old != gen:
+            try:
+                os.remove(os.path.join(self.directory, old))
+            except FileNotFoundError:
+                pass
+        self._load()
+
+def sync_with_catalog(db, index: "EmbeddingIndex", encode: Callable[[list[str]], np.ndarray], normalize: Callable[[str], str]) -> int:
+    """
+    Encode every image whose original_prompt or reference list is missing from / changed
+    in the index. Returns the number of images (re)encoded.
+    """
+    from sqlalchemy import select
+    from models import Image
+
+    rows = db.execute(select(Image.id, Image.original_prompt, Image.meta)).all()
+    items = [(r.id, reference_texts(r.original_prompt, r.meta, normalize)) for r in rows]
+    stale = index.stale(items)
+    if not stale:
+        return 0
+    flat = [t for _, texts in stale for t in texts]
+    vecs = np.asarray(encode(flat), dtype=np.float32)
+    entries, pos = [], 0
+    for image_id, texts in stale:
+        entries.append((image_id, texts, vecs[pos:pos + len(texts)]))
+        pos += len(texts)
+    index.upsert(entries)
+    return len(stale)
+
+if __name__ == "__main__":
+    # Run after seeding or editing the images table (prompts or meta.references):  python embedding_index.py
+    from database import SessionLocal
+    import scoring_service
+
+    db = SessionLocal()
+    try:
+        t0 = time.perf_counter()
+        n = scoring_service.sync_reference_index(db)
+        idx = scoring_service.reference_index()
+        print(f"Embedding index: {n} re-encoded, {len(idx)} total, fingerprint {idx.fingerprint} "
+              f"({time.perf_counter() - t0:.2f}s)")
+    finally:
+        db.close()
@@ -0,0 +1,243 @@
+"""
+Query-plan regression check: runs every crud query (plus the leaderboard, catalog and
+rescore readers) against a seeded database, EXPLAINs each statement it issued and exits 1
+if one of them reads a whole table or sorts without an index.
+
+    python explain_check.py                                     # throwaway SQLite from db_init.sql
+    python explain_check.py --database-url mysql+pymysql://u:p@localhost/plans --reset-db
+    python explain_check.py --database-url "$DATABASE_URL" --no-seed   # a migrated database as-is
+
+MySQL picks full scans for tiny tables, so seed enough sessions (--sessions) for the plan
+to match production; the seeded tables are ANALYZEd first.
+
+`pytest test_explain_check.py` runs the SQLite variant and fails on a regressed plan.
+Against MySQL it stays a pre-deploy step: run it before deploying a change to crud.py,
+the readers above or the schema/migrations; a non-zero exit means do not ship.
+"""
+import os
+import re
+import sys
+import random
+import argparse
+import tempfile
+from datetime import datetime, timedelta
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.orm import Session
+from loadtest import prepare_database
+
+# Steps that read (nearly) a whole table by design, with the reason.
+ALLOWED_SCANS = {
+    "catalog.refresh": "loads every active image into memory once per catalog version",
+    "leaderboard.rebuild": "loads every finished session into the in-memory leaderboard",
+    "image_stats.read_all": "one row per image; the stats listing and the sampler weights",
+}
+
+_SQLITE_SCAN = re.compile(r"^SCAN (?!CONSTANT ROW)")
+_SQLITE_SORT = re.compile(r"USE TEMP B-TREE FOR (ORDER|GROUP) BY")
+
+def seed(url: str, sessions: int, rng: random.Random) -> dict:
+    """Users with two sessions each, five session_images per session; returns sample ids."""
+    eng = create_engine(url)
+    with eng.begin() as conn:
+        images = {lvl: [r.id for r in conn.execute(text("SELECT id FROM images WHERE level = :l"), {"l": lvl})]
+                  for lvl in ("easy", "medium", "hard")}
+        users, rows, items = [], [], []
+        start = datetime(2026, 1, 1)
+        for i in range(sessions):
+            uid = f"plan-user-{i // 2}"
+            if i % 2 == 0:
+                users.append({"id": uid, "n": f"plan player {i // 2}"})
+            state = rng.choices(("active", "completed", "eliminated"), (2, 5, 3))[0]
+            total = None if state == "active" else round(rng.uniform(0, 200), 2)
+            rows.append({"id": f"plan-sess-{i}", "uid": uid, "st": state, "ts": total,
+                         "ca": start + timedelta(seconds=37 * i)})
+            for order, (stage, lvl) in enumerate((("easy", "easy"), ("easy", "easy"), ("medium", "medium"),
+                                                  ("medium", "medium"), ("hard", "hard")), 1):
+                score = None if state == "active" and order > 2 else round(rng.uniform(0, 100), 2)
+                items.append({"id": f"plan-si-{i}-{order}", "sid": f"plan-sess-{i}",
+                              "img": rng.choice(images[lvl]), "lvl": lvl, "ord": order, "stage": stage,
+                              "s": score, "p": None if score is None else int(score)})
+        conn.execute(text("INSERT INTO users (id, display_name) VALUES (:id, :n)"), users)
+        conn.execute(text("INSERT INTO sessions (id, user_id, state, total_score, created_at) "
+                          "VALUES (:id, :uid, :st, :ts, :ca)"), rows)
+        conn.execute(text("INSERT INTO session_images (id, session_id, image_id, level, stage_order, stage_name, "
+                          "user_prompt, score, points) VALUES (:id, :sid, :img, :lvl, :ord, :stage, 'a prompt', :s, :p)"),
+                     items)
+        if eng.dialect.name == "mysql":
+            conn.exec_driver_sql("ANALYZE TABLE users, images, sessions, session_images")
+        else:
+            conn.exec_driver_sql("ANALYZE")
+    eng.dispose()
+    return sample_ids(url)
+
+def sample_ids(url: str) -> dict:
+    # A finished session that has images, and its owner
+    eng = create_engine(url)
+    with eng.connect() as conn:
+        row = conn.execute(text("""
+            SELECT s.id AS session_id, s.user_id, u.display_name, si.id AS session_image_id, si.image_id
+            FROM sessions s
+            JOIN users u ON u.id = s.user_id
+            JOIN session_images si ON si.session_id = s.id
+            WHERE s.state = 'completed'
+            LIMIT 1
+        """)).mappings().first()
+    eng.dispose()
+    if row is None:
+        raise SystemExit("no completed session with images to query; seed the database first")
+    return dict(row)
+
+def steps(db: Session, ids: dict) -> list[tuple]:
+    """(name, callable) for every query path the game issues, with realistic arguments."""
+    import crud
+    import rescore
+    import image_stats
+    from catalog import catalog
+    from leaderboard import Leaderboard
+    from game_rules import PASS_THRESHOLD
+    from models import Stage, Level
+
+    sid, uid, si = ids["session_id"], ids["user_id"], ids["session_image_id"]
+    board = Leaderboard()
+    return [
+        ("crud.get_user_by_name", lambda: crud.get_user_by_name(db, ids["display_name"])),
+        ("crud.get_latest_session_for_user", lambda: crud.get_latest_session_for_user(db, uid)),
+        ("crud.has_any_finished_or_eliminated", lambda: crud.has_any_finished_or_eliminated(db, uid)),
+        ("crud.has_active_session", lambda: crud.has_active_session(db, uid)),
+        ("crud.lock_user_sessions", lambda: crud.lock_user_sessions(db, ids["display_name"])),
+        ("catalog.refresh", lambda: catalog.refresh(db)),
+        ("crud.create_session_with_images", lambda: crud.create_session_with_images(db, uid, [(Stage.easy, Level.easy, 2)])),
+        ("crud.get_session", lambda: crud.get_session(db, sid)),
+        ("crud.get_session_items", lambda: crud.get_session_items(db, sid)),
+        ("crud.get_stage_items", lambda: crud.get_stage_items(db, sid, Stage.medium)),
+        ("crud.get_stage_matches", lambda: crud.get_stage_matches(db, sid, Stage.medium)),
+        ("crud.get_failing_details_for_stage",
+         lambda: crud.get_failing_details_for_stage(db, sid, Stage.medium, PASS_THRESHOLD[Stage.medium])),
+        ("crud.get_all_session_items_for_results", lambda: crud.get_all_session_items_for_results(db, sid)),
+        ("crud.get_session_image_prompt", lambda: crud.get_session_image_prompt(db, si)),
+        ("crud.count_completed_images", lambda: crud.count_completed_images(db, sid)),
+        ("crud.sum_points", lambda: crud.sum_points(db, sid)),
+        ("crud.sum_scores", lambda: crud.sum_scores(db, sid)),
+        ("crud.update_prompt_score_points", lambda: crud.update_prompt_score_points(db, si, "a prompt", 50.0, 10)),
+        ("crud.update_scores_bulk", lambda: crud.update_scores_bulk(db, [(si, "a prompt", 50.0, 10)])),
+        ("crud.set_scores_bulk", lambda: crud.set_scores_bulk(db, [(si, 50.0, 10)])),
+        ("crud.advance_stage", lambda: crud.advance_stage(db, sid, Stage.medium, 2)),
+        ("crud.set_stage", lambda: crud.set_stage(db, sid, Stage.hard)),
+        ("crud.set_images_completed", lambda: crud.set_images_completed(db, sid, 4)),
+        ("crud.set_completed", lambda: crud.set_completed(db, sid, 150.0, 5)),
+        ("crud.set_eliminated_with_score",
+         lambda: crud.set_eliminated_with_score(db, sid, "hard-1", 4, Stage.hard, 1, 120)),
+        ("crud.recompute_total_scores", lambda: crud.recompute_total_scores(db)),
+        ("leaderboard.record_finish", lambda: board.record_finish(db, sid)),
+        ("leaderboard.rebuild", lambda: board.rebuild(db)),
+        ("image_stats.apply", lambda: image_stats.apply(
+            db, [{"image_id": ids["image_id"], "score": 62.5, "passed": True}] * 2)),
+        ("image_stats.read", lambda: image_stats.read(db, ids["image_id"])),
+        ("image_stats.read_all", lambda: image_stats.read(db)),
+        ("rescore.rows", lambda: db.execute(text(rescore._ROWS_SQL + " LIMIT 100"), {"after": ""}).all()),
+    ]
+
+def capture(url: str, ids: dict) -> list[tuple]:
+    """Run every step inside one rolled-back transaction; returns [(step, statement, EXPLAIN rows)]."""
+    eng = create_engine(url)
+    statements, current = [], [None]
+
+    @event.listens_for(eng, "before_cursor_execute")
+    def _record(conn, cursor, statement, parameters, context, executemany):
+        if current[0] and not executemany and re.match(r"\s*(SELECT|UPDATE|DELETE)\b", statement, re.I):
+            statements.append((current[0], statement, parameters))
+
+    with eng.connect() as conn:
+        trans = conn.begin()
+        db = Session(bind=conn)
+        try:
+            for name, fn in steps(db, ids):
+                current[0] = name
+                fn()
+            current[0] = None
+            plans = [(name, stmt, explain(conn, stmt, params)) for name, stmt, params in statements]
+        finally:
+            db.close()
+            trans.rollback()
+    eng.dispose()
+    return plans
+
+def explain(conn, statement: str, parameters) -> list[dict]:
+    if conn.dialect.name == "mysql":
+        return [dict(r) for r in conn.exec_driver_sql("EXPLAIN " + statement, parameters).mappings()]
+    return [{"detail": r[3]} for r in conn.exec_driver_sql("EXPLAIN QUERY PLAN " + statement, parameters)]
+
+def problems(plan: list[dict]) -> list[str]:
+    """Full scans and index-less sorts in one EXPLAIN result (MySQL or SQLite)."""
+    found = []
+    for row in plan:
+        if "detail" in row:
+            if _SQLITE_SCAN.match(row["detail"]):
+                found.append(row["detail"])
+            elif _SQLITE_SORT.search(row["detail"]):
+                found.append(row["detail"])
+            continue
+        table, extra = row.get("table"), row.get("Extra") or ""
+        if row.get("type") == "ALL":
+            found.append(f"full scan of {table}")
+        elif row.get("type") == "index":
+            found.append(f"full index scan of {table} ({row.get('key')})")
+        if "Using filesort" in extra:
+            found.append(f"filesort on {table}")
+    return found
+
+def summary(plan: list[dict]) -> str:
+    if plan and "detail" in plan[0]:
+        return "; ".join(r["detail"] for r in plan)
+    return "; ".join(f"{r.get('table')}:{r.get('type')}/{r.get('key')}" for r in plan)
+
+def check(url: str, ids: dict) -> list[tuple[str, str, list[dict], str]]:
+    """(step, statement, plan, verdict) per distinct statement; failing verdicts start with "FAIL"."""
+    out, seen = [], set()
+    for name, stmt, plan in capture(url, ids):
+        if (name, stmt) in seen:
+            continue
+        seen.add((name, stmt))
+        found = problems(plan)
+        if found and name in ALLOWED_SCANS:
+            verdict = f"allowed ({ALLOWED_SCANS[name]})"
+        elif found:
+            verdict = "FAIL: " + ", ".join(found)
+        else:
+            verdict = "ok"
+        out.append((name, stmt, plan, verdict))
+    return out
+
+def main():
+    ap = argparse.ArgumentParser(description="EXPLAIN every crud query and fail on full scans or filesorts")
+    ap.add_argument("--database-url", default=None, help="default: a throwaway SQLite file")
+    ap.add_argument("--reset-db", action="store_true", help="drop and re-create the game tables (MySQL)")
+    ap.add_argument("--no-seed", action="store_true", help="use the database's existing rows")
+    ap.add_argument("--sessions", type=int, default=5000, help="sessions to seed")
+    ap.add_argument("--seed", type=int, default=7)
+    ap.add_argument("-v", "--verbose", action="store_true", help="print every plan")
+    args = ap.parse_args()
+
+    workdir = None
+    url = args.database_url
+    if url is None:
+        workdir = tempfile.mkdtemp(prefix="pictoprompt-plans-")
+        url = f"sqlite:///{os.path.join(workdir, 'plans.db')}"
+    if args.no_seed:
+        ids = sample_ids(url)
+    else:
+        prepare_database(url, args.reset_db)
+        ids = seed(url, args.sessions, random.Random(args.seed))
+
+    results = check(url, ids)
+    failed = sum(1 for *_, verdict in results if verdict.startswith("FAIL"))
+    for name, stmt, plan, verdict in results:
+        if args.verbose or verdict.startswith("FAIL"):
+            print(f"{name:<40} {verdict}\n    {' '.join(stmt.split())[:160]}\n    {summary(plan)}")
+        else:
+            print(f"{name:<40} {verdict}")
+    print(f"\n{len(results)} statements, {failed} regressed")
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
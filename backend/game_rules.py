@@ -0,0 +1,24 @@
+import models as m
+
+# Game configuration
+EASY_COUNT = 1
+MEDIUM_COUNT = 2
+HARD_COUNT = 2
+EASY_PASS = 70.0
+MEDIUM_PASS = 75.0
+HARD_PASS = 85.0
+
+# Points per image (max total = 200)
+WEIGHT_EASY = 20   # 1 image
+WEIGHT_MED  = 40   # per image (2 images)
+WEIGHT_HARD = 50   # per image (2 images)
+
+def img_points(level: m.Level, score_pct: float) -> int:
+    if level == m.Level.easy:
+        return int(score_pct * (WEIGHT_EASY / 100.0))
+    if level == m.Level.medium:
+        return int(score_pct * (WEIGHT_MED / 100.0))
+    return int(score_pct * (WEIGHT_HARD / 100.0))
+
+PASS_THRESHOLD = {m.Stage.easy: EASY_PASS, m.Stage.medium: MEDIUM_PASS, m.Stage.hard: HARD_PASS}
+NEXT_STAGE = {m.Stage.easy: m.Stage.medium, m.Stage.medium: m.Stage.hard, m.Stage.hard: m.Stage.done}
@@ -0,0 +1,139 @@
+"""
+Per-image difficulty statistics, maintained incrementally.
+
+Every attempt-log flush folds its rows into image_stats (count, passes, Welford mean and
+M2, min, max) and image_score_hist (1-point score buckets, the percentile sketch) in the
+same transaction as the attempt rows, so reads never touch session history.
+
+    python image_stats.py --rebuild     # backfill from session_images (one offline pass)
+"""
+import math
+import time
+import argparse
+from typing import Optional
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+import crud
+
+BUCKETS = 100
+PERCENTILES = (10, 25, 50, 75, 90)
+
+def bucket(score: float) -> int:
+    return min(BUCKETS - 1, max(0, int(score)))
+
+def aggregate(rows: list[dict]) -> tuple[dict[str, dict], dict[tuple[str, int], int]]:
+    """Batch aggregates per image (Welford) and histogram increments from attempt rows."""
+    stats: dict[str, dict] = {}
+    hist: dict[tuple[str, int], int] = {}
+    for r in rows:
+        score = float(r["score"])
+        a = stats.get(r["image_id"])
+        if a is None:
+            a = stats[r["image_id"]] = {"attempts": 0, "passes": 0, "score_mean": 0.0, "score_m2": 0.0,
+                                        "score_min": score, "score_max": score}
+        a["attempts"] += 1
+        a["passes"] += int(bool(r["passed"]))
+        delta = score - a["score_mean"]
+        a["score_mean"] += delta / a["attempts"]
+        a["score_m2"] += delta * (score - a["score_mean"])
+        a["score_min"] = min(a["score_min"], score)
+        a["score_max"] = max(a["score_max"], score)
+        key = (r["image_id"], bucket(score))
+        hist[key] = hist.get(key, 0) + 1
+    return stats, hist
+
+def apply(db: Session, rows: list[dict]):
+    """attempt_log flush hook: merge a batch of attempts (no commit)."""
+    stats, hist = aggregate(rows)
+    crud.merge_image_stats(db, stats)
+    crud.add_score_histogram(db, hist)
+
+def percentiles(hist: dict[int, int], qs: tuple = PERCENTILES) -> dict[str, Optional[float]]:
+    """Percentiles from 1-point buckets, interpolating linearly inside a bucket."""
+    total = sum(hist.values())
+    out = {}
+    for q in qs:
+        if not total:
+            out[f"p{q}"] = None
+            continue
+        target, seen = total * q / 100, 0
+        for b in range(BUCKETS):
+            n = hist.get(b, 0)
+            if n and seen + n >= target:
+                out[f"p{q}"] = round(b + (target - seen) / n, 2)
+                break
+            seen += n
+    return out
+
+def summary(row, hist: dict[int, int]) -> dict:
+    n = int(row["attempts"])
+    lo = float(row["score_min"]) if row["score_min"] is not None else None
+    hi = float(row["score_max"]) if row["score_max"] is not None else None
+    # Buckets are 1 point wide; the exact extremes tighten the tails
+    pct = {k: v if v is None or lo is None else min(hi, max(lo, v)) for k, v in percentiles(hist).items()}
+    return {
+        "image_id": row["image_id"],
+        "level": row["level"],
+        "file_path": row["file_path"],
+        "active": bool(row["active"]),
+        "attempts": n,
+        "pass_rate": round(row["passes"] / n, 4) if n else None,
+        "mean": round(float(row["score_mean"]), 2),
+        "stddev": round(math.sqrt(float(row["score_m2"]) / n), 2) if n else None,
+        "min": lo,
+        "max": hi,
+        **pct,
+        "updated_at": row["updated_at"],
+    }
+
+def read(db: Session, image_id: Optional[str] = None) -> list[dict]:
+    rows = crud.get_image_stats(db, image_id)
+    hists = crud.get_score_histograms(db, image_id)
+    return [summary(r, hists.get(r["image_id"], {})) for r in rows]
+
+def pass_rates(db: Session) -> dict[str, tuple[int, float]]:
+    """{image_id: (attempts, pass rate)} for the catalog sampler."""
+    return {r["image_id"]: (int(r["attempts"]), r["passes"] / r["attempts"])
+            for r in crud.get_image_stats(db) if r["attempts"]}
+
+def rebuild(db: Session, chunk_size: int = 5000) -> int:
+    """Recompute both tables from answered session_images rows (offline; streams in id order)."""
+    from game_rules import PASS_THRESHOLD
+    import models as m
+
+    crud.clear_image_stats(db)
+    after, total = "", 0
+    while True:
+        rows = db.execute(text("""
+            SELECT id, image_id, stage_name, score
+            FROM session_images
+            WHERE score IS NOT NULL AND id > :after
+            ORDER BY id
+            LIMIT :n
+        """), {"after": after, "n": chunk_size}).mappings().all()
+        if not rows:
+            break
+        apply(db, [{"image_id": r["image_id"], "score": r["score"],
+                    "passed": float(r["score"]) >= PASS_THRESHOLD[m.Stage(r["stage_name"])]} for r in rows])
+        after = rows[-1]["id"]
+        total += len(rows)
+    return total
+
+if __name__ == "__main__":
+    from database import SessionLocal
+
+    ap = argparse.ArgumentParser(description="Per-image difficulty statistics")
+    ap.add_argument("--rebuild", action="store_true", help="recompute from session_images")
+    args = ap.parse_args()
+    db = SessionLocal()
+    try:
+        if args.rebuild:
+            t0 = time.perf_counter()
+            n = rebuild(db)
+            db.commit()
+            print(f"Rebuilt image stats from {n} answered rows ({time.perf_counter() - t0:.2f}s)")
+        for s in sorted(read(db), key=lambda s: (s["level"], s["pass_rate"] or 0)):
+            print(f"{s['level']:<7}{s['file_path']:<40}{s['attempts']:>7} attempts  pass {s['pass_rate']:.0%}  "
+                  f"mean {s['mean']:.1f} ± {s['stddev']:.1f}  p50 {s['p50']}")
+    finally:
+        db.close()
@@ -0,0 +1,185 @@
+import os
+import json
+import zlib
+import time
+import numpy as np
+from metrics import SCORING_STAGE
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+LOCAL_MODEL_PATH = os.path.join(SCRIPT_DIR, "model", "all-MiniLM-L6-v2")
+# Exported graphs live next to (not inside) the model folder so they don't change its fingerprint.
+ONNX_DIR = os.getenv("ONNX_MODEL_DIR", os.path.join(SCRIPT_DIR, "model", "onnx", "all-MiniLM-L6-v2"))
+ONNX_FP32 = "model.onnx"
+ONNX_INT8 = "model.int8.onnx"
+# Intra-op threads for ONNX Runtime; 0 lets ORT pick (all physical cores).
+ONNX_THREADS = int(os.getenv("ONNX_THREADS", "0"))
+# Same for torch (torch.set_num_threads); 0 keeps torch's default.
+TORCH_THREADS = int(os.getenv("SCORING_TORCH_THREADS", "0"))
+
+BACKENDS = ("torch", "onnx", "onnx-int8", "fake")
+
+class TorchBackend:
+    """The original sentence_transformers path."""
+    name = "torch"
+
+    def __init__(self, model_path: str = LOCAL_MODEL_PATH):
+        import torch
+        from sentence_transformers import SentenceTransformer
+        if TORCH_THREADS:
+            torch.set_num_threads(TORCH_THREADS)
+        self.model = SentenceTransformer(model_path)
+        # encode() tokenizes internally; time that step through the instance attribute it calls
+        tokenize = self.model.tokenize
+
+        def timed_tokenize(texts):
+            with SCORING_STAGE.time("tokenize"):
+                return tokenize(texts)
+        self.model.tokenize = timed_tokenize
+
+    def encode(self, texts: list[str]) -> np.ndarray:
+        return np.asarray(self.model.encode(texts, normalize_embeddings=False))
+
+class OnnxBackend:
+    """
+    ONNX Runtime encoder reproducing the sentence_transformers pipeline from the model
+    folder: tokenizer.json -> BERT graph -> pooling per 1_Pooling/config.json -> optional
+    L2 normalization when modules.json lists a Normalize module.
+    """
+
+    def __init__(self, onnx_path: str, model_path: str = LOCAL_MODEL_PATH, name: str = "onnx"):
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        self.name = name
+        with open(os.path.join(model_path, "1_Pooling", "config.json")) as f:
+            pooling = json.load(f)
+        if not pooling.get("pooling_mode_mean_tokens"):
+            raise RuntimeError("OnnxBackend only implements mean pooling; check 1_Pooling/config.json")
+        with open(os.path.join(model_path, "modules.json")) as f:
+            self.normalize = any(mod["type"].endswith("Normalize") for mod in json.load(f))
+
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_path, "tokenizer.json"))
+        # Pad to the longest sentence in the batch instead of tokenizer.json's fixed 128.
+        self.tokenizer.enable_padding(pad_id=0, pad_token="[PAD]")
+        self.tokenizer.enable_truncation(max_length=_max_seq_length(model_path))
+
+        opts = ort.SessionOptions()
+        opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if ONNX_THREADS:
+            opts.intra_op_num_threads = ONNX_THREADS
+        self.session = ort.InferenceSession(onnx_path, sess_options=opts, providers=["CPUExecutionProvider"])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+
+    def encode(self, texts: list[str]) -> np.ndarray:
+        t0 = time.perf_counter()
+        encs = self.tokenizer.encode_batch(list(texts))
+        SCORING_STAGE.observe(time.perf_counter() - t0, "tokenize")
+        feed = {
+            "input_ids": np.array([e.ids for e in encs], dtype=np.int64),
+            "attention_mask": np.array([e.attention_mask for e in encs], dtype=np.int64),
+            "token_type_ids": np.array([e.type_ids for e in encs], dtype=np.int64),
+        }
+        feed = {k: v for k, v in feed.items() if k in self.input_names}
+        token_embeddings = self.session.run(None, feed)[0]
+        mask = feed["attention_mask"][..., None].astype(np.float32)
+        pooled = (token_embeddings * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        if self.normalize:
+            pooled = pooled / np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+        return pooled.astype(np.float32)
+
+class FakeBackend:
+    """
+    Constant-time stand-in for load tests: hashed bag-of-words vectors, no model weights.
+    Identical sentences still score 100 and unrelated ones low, so game flow stays realistic.
+    """
+    name = "fake"
+
+    def __init__(self, dim: int = 384):
+        self.dim = dim
+
+    def encode(self, texts: list[str]) -> np.ndarray:
+        out = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for i, t in enumerate(texts):
+            for w in t.split():
+                out[i, zlib.crc32(w.encode()) % self.dim] += 1.0
+        out += 1e-3
+        return out / np.linalg.norm(out, axis=1, keepdims=True)
+
+def _max_seq_length(model_path: str) -> int:
+    # Same rule sentence_transformers uses: sentence_bert_config.json, else the model/tokenizer limit.
+    cfg = os.path.join(model_path, "sentence_bert_config.json")
+    if os.path.exists(cfg):
+        with open(cfg) as f:
+            return int(json.load(f)["max_seq_length"])
+    with open(os.path.join(model_path, "config.json")) as f:
+        max_pos = int(json.load(f).get("max_position_embeddings", 512))
+    with open(os.path.join(model_path, "tokenizer_config.json")) as f:
+        return min(max_pos, int(json.load(f).get("model_max_length", max_pos)))
+
+def import_runtime(backend: str):
+    """Import the heavy inference libraries for a backend (lets startup time them separately)."""
+    if backend == "torch":
+        import torch  # noqa: F401
+        import sentence_transformers  # noqa: F401
+    elif backend != "fake":
+        import onnxruntime  # noqa: F401
+        import tokenizers  # noqa: F401
+
+def onnx_path_for(backend: str) -> str:
+    return os.path.join(ONNX_DIR, ONNX_INT8 if backend == "onnx-int8" else ONNX_FP32)
+
+def load_backend(backend: str, model_path: str = LOCAL_MODEL_PATH):
+    if backend == "torch":
+        return TorchBackend(model_path)
+    if backend in ("onnx", "onnx-int8"):
+        path = onnx_path_for(backend)
+        if not os.path.exists(path):
+            raise RuntimeError(f"ONNX graph not found at {path}. Run: python inference_backends.py export")
+        return OnnxBackend(path, model_path, name=backend)
+    if backend == "fake":
+        return FakeBackend()
+    raise ValueError(f"Unknown scoring backend {backend!r}; expected one of {BACKENDS}")
+
+def export_onnx(model_path: str = LOCAL_MODEL_PATH, out_dir: str = ONNX_DIR) -> str:
+    """Export the transformer (token embeddings only; pooling stays in numpy) to ONNX."""
+    import torch
+    from transformers import AutoModel
+
+    os.makedirs(out_dir, exist_ok=True)
+    out = os.path.join(out_dir, ONNX_FP32)
+    model = AutoModel.from_pretrained(model_path).eval()
+    dummy = {
+        "input_ids": torch.ones(1, 8, dtype=torch.long),
+        "attention_mask": torch.ones(1, 8, dtype=torch.long),
+        "token_type_ids": torch.zeros(1, 8, dtype=torch.long),
+    }
+    dynamic = {"batch": 0, "seq": 1}
+    with torch.no_grad():
+        torch.onnx.export(
+            model,
+            (dummy,),
+            out,
+            input_names=list(dummy),
+            output_names=["last_hidden_state"],
+            dynamic_axes={**{k: dynamic for k in dummy}, "last_hidden_state": dynamic},
+            opset_version=14,
+        )
+    return out
+
+def quantize_int8(out_dir: str = ONNX_DIR) -> str:
+    """Dynamic (weight-only int8, activations quantized at runtime) quantization of the fp32 graph."""
+    from onnxruntime.quantization import quantize_dynamic, QuantType
+
+    src = os.path.join(out_dir, ONNX_FP32)
+    dst = os.path.join(out_dir, ONNX_INT8)
+    quantize_dynamic(src, dst, weight_type=QuantType.QInt8)
+    return dst
+
+if __name__ == "__main__":
+    # python inference_backends.py export   -> writes model.onnx and model.int8.onnx under ONNX_DIR
+    import sys
+
+    if sys.argv[1:] != ["export"]:
+        sys.exit("usage: python inference_backends.py export")
+    print("exported", export_onnx())
+    print("quantized", quantize_int8())
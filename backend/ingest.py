@@ -0,0 +1,219 @@
+"""
+Add a new image set: validate, copy, build derivatives and reference embeddings, insert
+the images rows in bulk and tell the running servers to swap catalogs.
+
+    python ingest.py drop-2026-11/ --manifest drop-2026-11/prompts.json
+    python ingest.py drop-2026-11/ --manifest prompts.csv --dry-run
+
+The manifest is JSON (a list of objects) or CSV with the columns
+file, level, prompt and optionally negative_prompt, generator_model, seed, references
+(a JSON list, or "|"-separated in CSV). file is relative to the folder.
+
+Derivatives and embeddings are ready before the rows are committed, so the first player
+to draw a new image gets warm caches. Servers pick the rows up through the catalog
+version stamp; the asset manifest and the embedding index are swapped by rename and
+reloaded by mtime, so no restart is needed.
+"""
+import os
+import csv
+import sys
+import json
+import time
+import shutil
+import argparse
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Optional
+from sqlalchemy import text
+import assets
+from models import Level
+
+# Smallest accepted side in px: derivatives are built at up to 1024px.
+INGEST_MIN_SIDE = int(os.getenv("INGEST_MIN_SIDE", "256"))
+
+class Item:
+    __slots__ = ("source", "file_path", "level", "prompt", "negative_prompt", "generator_model", "seed",
+                 "references", "sha256", "id")
+
+    def __init__(self, source: str, level: Level, prompt: str, negative_prompt: Optional[str],
+                 generator_model: Optional[str], seed: Optional[int], references: list[str]):
+        self.source = source
+        self.level = level
+        self.prompt = prompt
+        self.negative_prompt = negative_prompt
+        self.generator_model = generator_model
+        self.seed = seed
+        self.references = references
+        self.file_path = f"images/{level.value}/{os.path.basename(source)}"
+        self.sha256 = None
+        self.id = None
+
+    def row(self) -> dict:
+        return {"id": self.id, "level": self.level.value, "file_path": self.file_path,
+                "original_prompt": self.prompt, "negative_prompt": self.negative_prompt,
+                "generator_model": self.generator_model, "seed": self.seed,
+                "meta": json.dumps({"references": self.references}) if self.references else None}
+
+def load_manifest(path: str) -> list[dict]:
+    if path.lower().endswith(".csv"):
+        with open(path, newline="") as f:
+            rows = list(csv.DictReader(f))
+        for r in rows:
+            refs = (r.get("references") or "").strip()
+            r["references"] = json.loads(refs) if refs.startswith("[") else [x for x in refs.split("|") if x.strip()]
+        return rows
+    with open(path) as f:
+        data = json.load(f)
+    return data["images"] if isinstance(data, dict) else data
+
+def parse(folder: str, rows: list[dict]) -> tuple[list[Item], list[str]]:
+    """Manifest rows to Items; field errors are returned as messages."""
+    items, errors = [], []
+    for n, r in enumerate(rows, 1):
+        where = f"manifest row {n} ({r.get('file', '?')})"
+        try:
+            level = Level((r.get("level") or "").strip().lower())
+        except ValueError:
+            errors.append(f"{where}: level must be one of {[l.value for l in Level]}")
+            continue
+        prompt = " ".join((r.get("prompt") or "").split())
+        if not prompt or not r.get("file"):
+            errors.append(f"{where}: file and prompt are required")
+            continue
+        if not r["file"].lower().endswith(assets.SOURCE_EXTENSIONS):
+            errors.append(f"{where}: expected one of {assets.SOURCE_EXTENSIONS}")
+            continue
+        seed = r.get("seed")
+        try:
+            seed = int(seed) if seed not in (None, "") else None
+        except (TypeError, ValueError):
+            errors.append(f"{where}: seed must be an integer, got {seed!r}")
+            continue
+        items.append(Item(os.path.join(folder, r["file"]), level, prompt, r.get("negative_prompt") or None,
+                          r.get("generator_model") or None, seed,
+                          [" ".join(x.split()) for x in r.get("references") or [] if x.strip()]))
+    return items, errors
+
+def check_file(path: str) -> tuple[Optional[str], Optional[str]]:
+    """(sha256, None) for a readable image of acceptable size, else (None, reason). Runs in a worker."""
+    from PIL import Image
+
+    try:
+        with Image.open(path) as im:
+            im.verify()
+        with Image.open(path) as im:
+            w, h = im.size
+    except FileNotFoundError:
+        return None, "file not found"
+    except Exception as e:
+        return None, f"not a readable image ({e})"
+    if min(w, h) < INGEST_MIN_SIDE:
+        return None, f"{w}x{h} is below INGEST_MIN_SIDE={INGEST_MIN_SIDE}"
+    return assets.file_sha256(path), None
+
+def validate(items: list[Item], existing: set[str], pool) -> list[str]:
+    errors, seen = [], {}
+    for it, (digest, reason) in zip(items, pool.map(check_file, [it.source for it in items])):
+        if reason:
+            errors.append(f"{it.source}: {reason}")
+            continue
+        it.sha256 = digest
+        dest = os.path.join(assets.STATIC_DIR, it.file_path)
+        if it.file_path in existing:
+            errors.append(f"{it.source}: {it.file_path} is already in the images table")
+        elif it.file_path in seen:
+            errors.append(f"{it.source}: same destination as {seen[it.file_path]}")
+        elif os.path.exists(dest) and assets.file_sha256(dest) != digest:
+            errors.append(f"{it.source}: {dest} exists with different content")
+        seen[it.file_path] = it.source
+    return errors
+
+def encode_references(items: list[Item]) -> int:
+    """Write every new image's reference block to the persisted index; returns prompts encoded."""
+    import scoring_service
+    from embedding_index import reference_texts
+
+    texts = [reference_texts(it.prompt, {"references": it.references}, scoring_service.normalize) for it in items]
+    flat = [t for block in texts for t in block]
+    vecs = scoring_service.encode_texts(flat)
+    entries, pos = [], 0
+    for it, block in zip(items, texts):
+        entries.append((it.id, block, vecs[pos:pos + len(block)]))
+        pos += len(block)
+    scoring_service.reference_index().upsert(entries)
+    return len(flat)
+
+def insert_rows(db, items: list[Item]):
+    db.execute(text(
+        "INSERT INTO images (id, level, file_path, original_prompt, negative_prompt, generator_model, seed, meta, active) "
+        "VALUES (:id, :level, :file_path, :original_prompt, :negative_prompt, :generator_model, :seed, :meta, 1)"
+    ), [it.row() for it in items])
+
+def ingest(folder: str, manifest: str, workers: int, dry_run: bool) -> dict:
+    from database import SessionLocal
+    from catalog import bump_version
+    from crud import gen_id
+
+    timings = {}
+    t0 = time.perf_counter()
+    items, errors = parse(folder, load_manifest(manifest))
+    db = SessionLocal()
+    try:
+        existing = {r[0] for r in db.execute(text("SELECT file_path FROM images"))}
+    finally:
+        db.close()
+    with ProcessPoolExecutor(workers) as pool:
+        errors += validate(items, existing, pool)
+    timings["validate"] = time.perf_counter() - t0
+    if errors or dry_run or not items:
+        return {"items": len(items), "errors": errors, "timings": timings}
+
+    t0 = time.perf_counter()
+    for it in items:
+        it.id = gen_id()
+        dest = os.path.join(assets.STATIC_DIR, it.file_path)
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        if not os.path.exists(dest):
+            shutil.copyfile(it.source, dest)
+    timings["copy"] = time.perf_counter() - t0
+
+    # Derivatives fan out over processes while this process encodes the references
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(1) as bg:
+        built = bg.submit(assets.build, workers=workers)
+        encoded = encode_references(items)
+        timings["embeddings"] = time.perf_counter() - t0
+        stats = built.result()
+    timings["derivatives"] = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    db = SessionLocal()
+    try:
+        insert_rows(db, items)
+        db.commit()
+    finally:
+        db.close()
+    version = bump_version()
+    timings["insert"] = time.perf_counter() - t0
+    return {"items": len(items), "errors": [], "timings": timings, "encoded": encoded,
+            "assets": stats, "catalog_version": version}
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Ingest a folder of images described by a prompt manifest")
+    ap.add_argument("folder")
+    ap.add_argument("--manifest", help="JSON or CSV (default: <folder>/manifest.json)")
+    ap.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="validation / derivative processes")
+    ap.add_argument("--dry-run", action="store_true", help="validate only")
+    args = ap.parse_args()
+    result = ingest(args.folder, args.manifest or os.path.join(args.folder, "manifest.json"),
+                    args.workers, args.dry_run)
+    for e in result["errors"]:
+        print("error:", e)
+    times = ", ".join(f"{k} {v:.2f}s" for k, v in result["timings"].items())
+    if result["errors"]:
+        print(f"{len(result['errors'])} problems, nothing ingested ({times})")
+        sys.exit(1)
+    if args.dry_run or not result["items"]:
+        print(f"{result['items']} images valid, nothing written ({times})")
+        sys.exit(0)
+    print(f"Ingested {result['items']} images: {result['encoded']} prompts encoded, "
+          f"{result['assets']['built']} derivative sets built; catalog version {result['catalog_version']} ({times})")
@@ -0,0 +1,172 @@
+import os
+import time
+import json
+import base64
+import hashlib
+import threading
+from bisect import bisect_left, bisect_right, insort
+from datetime import datetime
+from typing import Optional
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool
+from database import REPLICA_MAX_LAG_SECONDS
+
+# Finishes recorded by other workers are merged by a full reload at most this often.
+LEADERBOARD_SYNC_SECONDS = float(os.getenv("LEADERBOARD_SYNC_SECONDS", "15"))
+
+_FINISHED_SQL = """
+    SELECT s.id, u.display_name, s.total_score, s.state, s.eliminated_at, s.created_at
+    FROM sessions s
+    JOIN users u ON u.id = s.user_id
+    WHERE (s.total_score IS NOT NULL OR s.state = 'eliminated')
+"""
+
+class Entry:
+    __slots__ = ("session_id", "display_name", "total_score", "state", "eliminated_at", "created_at", "key")
+
+    def __init__(self, session_id: str, display_name: str, total_score: Optional[float], state: str,
+                 eliminated_at: Optional[str], created_at: Optional[datetime]):
+        self.session_id = session_id
+        self.display_name = display_name
+        self.total_score = total_score
+        self.state = state
+        self.eliminated_at = eliminated_at
+        self.created_at = created_at
+        self.key = sort_key(session_id, total_score, created_at)
+
+    @classmethod
+    def from_row(cls, r) -> "Entry":
+        score = float(r["total_score"]) if r["total_score"] is not None else None
+        state = r["state"].value if hasattr(r["state"], "value") else r["state"]
+        return cls(r["id"], r["display_name"], score, state, r["eliminated_at"], r["created_at"])
+
+    def as_row(self) -> dict:
+        return {
+            "display_name": self.display_name,
+            "total_score": float(self.total_score or 0),
+            "state": self.state,
+            "eliminated_at": self.eliminated_at,
+            "created_at": str(self.created_at),
+        }
+
+def sort_key(session_id: str, total_score: Optional[float], created_at: Optional[datetime]) -> tuple:
+    # Same order as the old SQL: scored first, score desc, oldest first; a hash of the
+    # session id breaks ties without putting the id itself in public cursors.
+    return (
+        0 if total_score is not None else 1,
+        -(total_score or 0.0),
+        str(created_at) if created_at is not None else "",
+        hashlib.sha1(session_id.encode()).hexdigest()[:12],
+    )
+
+def encode_cursor(key: tuple) -> str:
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> tuple:
+    """Inverse of encode_cursor; ValueError for anything it did not produce."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        flag, neg_score, created, tie = json.loads(raw)
+        return (int(flag), float(neg_score), str(created), str(tie))
+    except (TypeError, ValueError) as e:
+        raise ValueError(f"invalid cursor: {e}") from None
+
+class Leaderboard:
+    """
+    Finished sessions kept sorted in memory.
+
+    Sessions are inserted where submit_stage finishes them (record_finish), so the
+    worker that finished a game shows it immediately; a periodic reload merges games
+    finished on other workers. top() is O(limit) after an O(log n) seek, rank() is
+    O(log n).
+
+    The reload may read a replica up to hold_seconds behind, so finishes recorded here
+    more recently than that are carried over instead of dropped until the next reload.
+    """
+
+    def __init__(self, sync_seconds: float = LEADERBOARD_SYNC_SECONDS, hold_seconds: float = REPLICA_MAX_LAG_SECONDS):
+        self.sync_seconds = sync_seconds
+        self.hold_seconds = hold_seconds
+        self._lock = threading.Lock()
+        self._keys: list[tuple] = []
+        self._entries: dict[tuple, Entry] = {}
+        self._by_session: dict[str, tuple] = {}
+        self._loaded_at = 0.0
+        self._recent: dict[str, tuple[float, Entry]] = {}
+
+    @staticmethod
+    def _read(db: Session) -> list:
+        return db.execute(text(_FINISHED_SQL)).mappings().all()
+
+    def rebuild(self, db: Session):
+        self._install(self._read(db))
+
+    def _install(self, rows: list):
+        entries = {}
+        for r in rows:
+            e = Entry.from_row(r)
+            entries[e.session_id] = e
+        with self._lock:
+            cutoff = time.monotonic() - self.hold_seconds
+            self._recent = {sid: (t, e) for sid, (t, e) in self._recent.items() if t > cutoff}
+            entries.update({sid: e for sid, (t, e) in self._recent.items()})
+        entries = sorted(entries.values(), key=lambda e: e.key)
+        with self._lock:
+            self._keys = [e.key for e in entries]
+            self._entries = {e.key: e for e in entries}
+            self._by_session = {e.session_id: e.key for e in entries}
+            self._loaded_at = time.monotonic()
+
+    def ensure_fresh(self, db: Session):
+        if time.monotonic() - self._loaded_at > self.sync_seconds:
+            self.rebuild(db)
+
+    async def ensure_fresh_async(self, db: AsyncSession):
+        """ensure_fresh() for request handlers: only the SELECT runs on the loop, the sort in the threadpool."""
+        if time.monotonic() - self._loaded_at > self.sync_seconds:
+            rows = await db.run_sync(self._read)
+            await run_in_threadpool(self._install, rows)
+
+    def upsert(self, entry: Entry):
+        with self._lock:
+            old = self._by_session.get(entry.session_id)
+            if old is not None:
+                i = bisect_left(self._keys, old)
+                if i < len(self._keys) and self._keys[i] == old:
+                    del self._keys[i]
+                self._entries.pop(old, None)
+            insort(self._keys, entry.key)
+            self._entries[entry.key] = entry
+            self._by_session[entry.session_id] = entry.key
+
+    def record_finish(self, db: Session, session_id: str):
+        """Call after committing a completed/eliminated session."""
+        row = db.execute(text(_FINISHED_SQL + " AND s.id = :sid"), {"sid": session_id}).mappings().one_or_none()
+        if row is not None:
+            entry = Entry.from_row(row)
+            self.upsert(entry)
+            with self._lock:
+                self._recent[session_id] = (time.monotonic(), entry)
+
+    def top(self, limit: int, after: Optional[tuple] = None) -> tuple[list[Entry], Optional[str]]:
+        """One page of rows plus the cursor for the next page (None on the last page)."""
+        with self._lock:
+            start = bisect_right(self._keys, after) if after is not None else 0
+            keys = self._keys[start:start + limit]
+            more = start + limit < len(self._keys)
+            page = [self._entries[k] for k in keys]
+        return page, (encode_cursor(keys[-1]) if keys and more else None)
+
+    def rank(self, session_id: str) -> Optional[tuple[int, Entry]]:
+        with self._lock:
+            key = self._by_session.get(session_id)
+            if key is None:
+                return None
+            return bisect_left(self._keys, key) + 1, self._entries[key]
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+leaderboard = Leaderboard()
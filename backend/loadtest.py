@@ -0,0 +1,350 @@
+"""
+End-to-end load benchmark: N simulated players against a real uvicorn server.
+
+Each player runs /api/start -> next_stage -> submit_stage (x3, stopping early when
+eliminated) -> status -> leaderboard. Results (throughput, p50/p95/p99 per endpoint,
+SQL statements per request) are printed and saved under bench_results/.
+
+    python loadtest.py --players 200 --concurrency 50            # throwaway SQLite + fake encoder
+    python loadtest.py --encoder torch                           # real MiniLM
+    python loadtest.py --database-url mysql+pymysql://u:p@localhost/bench \\
+        --async-database-url mysql+aiomysql://u:p@localhost/bench --reset-db
+    python loadtest.py --compare bench_results/<earlier run>.json
+"""
+import os
+import re
+import sys
+import json
+import time
+import random
+import signal
+import shutil
+import asyncio
+import argparse
+import tempfile
+import subprocess
+from datetime import datetime
+from typing import Optional
+import httpx
+from sqlalchemy import create_engine, text
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+RESULTS_DIR = os.path.join(SCRIPT_DIR, "bench_results")
+ENDPOINTS = ("start", "next_stage", "submit_stage", "status", "leaderboard")
+STAGES = ("easy", "medium", "hard")
+
+def sqlite_schema(sql: str) -> str:
+    """db_init.sql rewritten for SQLite (ENUMs become VARCHAR, MySQL-only clauses dropped)."""
+    sql = re.sub(r"--[^\n]*|/\*.*?\*/", "", sql, flags=re.S)
+    sql = re.sub(r"CREATE DATABASE[^;]*;|USE [^;]*;", "", sql)
+    sql = re.sub(r"(?s)ALTER TABLE.*?;", "", sql)
+    sql = re.sub(r"ENUM\([^)]*\)", "VARCHAR(20)", sql)
+    sql = re.sub(r"TINYINT\(1\)", "INTEGER", sql)
+    sql = re.sub(r",\s*UNIQUE KEY \w+ \(([^)]*)\)", r", UNIQUE (\1)", sql)
+    sql = sql.replace("BIGINT AUTO_INCREMENT PRIMARY KEY", "INTEGER PRIMARY KEY AUTOINCREMENT")
+    sql = re.sub(r" (ASC|DESC)\b", "", sql)
+    return sql
+
+def seed_rows(sql: str) -> list[dict]:
+    """(level, file_path, original_prompt) tuples from seed_images.sql, with fresh ids."""
+    rows = re.findall(r"\(UUID\(\),\s*'(\w+)',\s*'([^']*)',\s*'((?:[^']|'')*)',\s*1\)", sql)
+    return [
+        {"id": f"bench-img-{i}", "level": lvl, "file_path": fp, "original_prompt": prompt.replace("''", "'")}
+        for i, (lvl, fp, prompt) in enumerate(rows, 1)
+    ]
+
+def prepare_database(url: str, reset: bool):
+    """Create the schema and seed images. SQLite files are always fresh; MySQL needs --reset-db."""
+    with open(os.path.join(SCRIPT_DIR, "db_init.sql")) as f:
+        schema = f.read()
+    with open(os.path.join(SCRIPT_DIR, "seed_images.sql")) as f:
+        seed = seed_rows(f.read())
+    sqlite = url.startswith("sqlite")
+    if not sqlite:
+        if not reset:
+            raise SystemExit("refusing to touch a MySQL database without --reset-db (it drops the game tables)")
+        schema = re.sub(r"CREATE DATABASE[^;]*;|USE [^;]*;", "", schema)
+    eng = create_engine(url)
+    with eng.begin() as conn:
+        if sqlite:
+            conn.exec_driver_sql("PRAGMA journal_mode=WAL")
+            schema = sqlite_schema(schema)
+        for table in ("image_score_hist", "image_stats", "submission_attempts", "session_images", "sessions", "users", "images"):
+            conn.exec_driver_sql(f"DROP TABLE IF EXISTS {table}")
+        for stmt in schema.split(";"):
+            if stmt.strip():
+                conn.exec_driver_sql(stmt)
+        conn.execute(text(
+            "INSERT INTO images (id, level, file_path, original_prompt, active) "
+            "VALUES (:id, :level, :file_path, :original_prompt, 1)"
+        ), seed)
+    eng.dispose()
+
+def load_prompts(url: str) -> dict[str, str]:
+    """image_id -> original prompt, so simulated players can answer well or badly on purpose."""
+    eng = create_engine(url)
+    try:
+        with eng.connect() as conn:
+            return dict(conn.execute(text("SELECT id, original_prompt FROM images")).all())
+    finally:
+        eng.dispose()
+
+def start_server(args, workdir: str) -> subprocess.Popen:
+    env = dict(os.environ)
+    env.update({
+        "DATABASE_URL": args.database_url,
+        "ASYNC_DATABASE_URL": args.async_database_url,
+        "SCORING_BACKEND": args.encoder,
+        "QUERY_COUNT_HEADER": "1",
+        "EMBED_INDEX_DIR": os.path.join(workdir, "index"),
+        "SHARED_STORE_PATH": os.path.join(workdir, "shared.sqlite3"),
+    })
+    cmd = [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(args.port),
+           "--workers", str(args.workers), "--log-level", "warning"]
+    return subprocess.Popen(cmd, cwd=SCRIPT_DIR, env=env, start_new_session=True)
+
+async def wait_ready(base_url: str, timeout: float, proc: Optional[subprocess.Popen]):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient(base_url=base_url) as client:
+        while time.monotonic() < deadline:
+            if proc is not None and proc.poll() is not None:
+                raise SystemExit(f"server exited with code {proc.returncode}")
+            try:
+                if (await client.get("/readyz")).status_code == 200:
+                    return
+            except httpx.TransportError:
+                pass
+            await asyncio.sleep(0.25)
+    raise SystemExit(f"server not ready after {timeout:.0f}s")
+
+class Recorder:
+    """Latency and query counts per endpoint."""
+
+    def __init__(self):
+        self.samples = {name: [] for name in ENDPOINTS}
+        self.errors = {name: 0 for name in ENDPOINTS}
+        self.status_codes: dict[str, int] = {}
+
+    async def call(self, client: httpx.AsyncClient, name: str, method: str, url: str, **kw) -> Optional[httpx.Response]:
+        t0 = time.perf_counter()
+        try:
+            resp = await client.request(method, url, **kw)
+        except httpx.HTTPError as e:
+            self.errors[name] += 1
+            self.status_codes[type(e).__name__] = self.status_codes.get(type(e).__name__, 0) + 1
+            return None
+        elapsed = time.perf_counter() - t0
+        self.status_codes[str(resp.status_code)] = self.status_codes.get(str(resp.status_code), 0) + 1
+        if resp.status_code >= 400:
+            self.errors[name] += 1
+            return None
+        queries = resp.headers.get("X-Query-Count")
+        commits = resp.headers.get("X-Commit-Count")
+        self.samples[name].append((
+            elapsed,
+            int(queries) if queries is not None else None,
+            int(commits) if commits is not None else None,
+        ))
+        return resp
+
+def answer(original: Optional[str], skill: float, rng: random.Random) -> str:
+    if original is None:
+        return "a picture of something"
+    if rng.random() < skill:
+        return original
+    words = original.split()
+    return " ".join(rng.sample(words, max(1, len(words) // 3)))
+
+async def play(client: httpx.AsyncClient, rec: Recorder, name: str, prompts: dict, skill: float,
+               rng: random.Random) -> bool:
+    resp = await rec.call(client, "start", "POST", "/api/start", json={"display_name": name})
+    if resp is None:
+        return False
+    sid = resp.json()["session_id"]
+    for _ in STAGES:
+        resp = await rec.call(client, "next_stage", "GET", f"/api/session/{sid}/next_stage")
+        if resp is None:
+            return False
+        images = resp.json()["images"]
+        items = [
+            {"session_image_id": img["session_image_id"], "user_prompt": answer(prompts.get(img["image_id"]), skill, rng)}
+            for img in images
+        ]
+        resp = await rec.call(client, "submit_stage", "POST", f"/api/session/{sid}/submit_stage", json={"items": items})
+        if resp is None:
+            return False
+        result = resp.json()
+        if not result["passed"] or result["next_stage"] == "done":
+            break
+    await rec.call(client, "status", "GET", f"/api/session/{sid}/status")
+    await rec.call(client, "leaderboard", "GET", "/api/leaderboard", params={"limit": 50})
+    return True
+
+async def run_players(args, prompts: dict) -> dict:
+    rec = Recorder()
+    run_id = datetime.now().strftime("%H%M%S") + f"-{os.getpid()}"
+    sem = asyncio.Semaphore(args.concurrency)
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    finished = 0
+
+    async with httpx.AsyncClient(base_url=args.url, timeout=args.timeout, limits=limits) as client:
+        async def one(i: int):
+            nonlocal finished
+            async with sem:
+                rng = random.Random(args.seed * 1_000_003 + i)
+                if await play(client, rec, f"bench-{run_id}-{i}", prompts, args.skill, rng):
+                    finished += 1
+
+        t0 = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(args.players)))
+        duration = time.perf_counter() - t0
+        try:
+            server_stats = (await client.get("/api/scoring/stats")).json()
+        except (httpx.HTTPError, ValueError):
+            server_stats = None
+
+    requests = sum(len(v) for v in rec.samples.values())
+    return {
+        "duration_s": round(duration, 3),
+        "players": args.players,
+        "games_finished": finished,
+        "requests": requests,
+        "errors": sum(rec.errors.values()),
+        "status_codes": rec.status_codes,
+        "throughput_rps": round(requests / duration, 2) if duration else None,
+        "games_per_s": round(finished / duration, 2) if duration else None,
+        "endpoints": {name: summarize(rec.samples[name], rec.errors[name]) for name in ENDPOINTS},
+        "server": server_stats,
+    }
+
+def percentile(sorted_values: list[float], pct: float) -> Optional[float]:
+    # Nearest-rank percentile
+    if not sorted_values:
+        return None
+    k = max(0, min(len(sorted_values) - 1, int(round(pct / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[k]
+
+def _mean(values: list) -> Optional[float]:
+    values = [v for v in values if v is not None]
+    return round(sum(values) / len(values), 2) if values else None
+
+def summarize(samples: list[tuple], errors: int) -> dict:
+    latencies = sorted(s[0] * 1000 for s in samples)
+    ms = lambda v: round(v, 2) if v is not None else None
+    return {
+        "count": len(samples),
+        "errors": errors,
+        "mean_ms": ms(sum(latencies) / len(latencies)) if latencies else None,
+        "p50_ms": ms(percentile(latencies, 50)),
+        "p95_ms": ms(percentile(latencies, 95)),
+        "p99_ms": ms(percentile(latencies, 99)),
+        "max_ms": ms(latencies[-1]) if latencies else None,
+        "queries_per_request": _mean([s[1] for s in samples]),
+        "commits_per_request": _mean([s[2] for s in samples]),
+    }
+
+def git_revision() -> Optional[str]:
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=SCRIPT_DIR, capture_output=True, text=True)
+        return out.stdout.strip() or None
+    except OSError:
+        return None
+
+def print_report(result: dict):
+    print(f"\n{result['players']} players, {result['games_finished']} finished, {result['requests']} requests "
+          f"in {result['duration_s']}s: {result['throughput_rps']} req/s, {result['games_per_s']} games/s, "
+          f"{result['errors']} errors")
+    print(f"{'endpoint':<14}{'count':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'queries':>9}{'commits':>9}")
+    for name, e in result["endpoints"].items():
+        cells = [e["p50_ms"], e["p95_ms"], e["p99_ms"], e["queries_per_request"], e["commits_per_request"]]
+        cells = ["-" if c is None else c for c in cells]
+        print(f"{name:<14}{e['count']:>7}{cells[0]:>10}{cells[1]:>10}{cells[2]:>10}{cells[3]:>9}{cells[4]:>9}")
+
+def print_comparison(old: dict, new: dict):
+    def delta(a, b):
+        if a in (None, 0) or b is None:
+            return "-"
+        return f"{(b - a) / a * 100:+.1f}%"
+
+    print(f"\ncompared with {old['run'].get('started_at')} ({old['run'].get('git_revision')}):")
+    print(f"  throughput {old['throughput_rps']} -> {new['throughput_rps']} req/s "
+          f"({delta(old['throughput_rps'], new['throughput_rps'])})")
+    for name, e in new["endpoints"].items():
+        o = old["endpoints"].get(name)
+        if not o:
+            continue
+        print(f"  {name:<14} p95 {o['p95_ms']} -> {e['p95_ms']} ms ({delta(o['p95_ms'], e['p95_ms'])}), "
+              f"p99 {o['p99_ms']} -> {e['p99_ms']} ms ({delta(o['p99_ms'], e['p99_ms'])}), "
+              f"queries {o['queries_per_request']} -> {e['queries_per_request']}")
+
+def main():
+    ap = argparse.ArgumentParser(description="Load-test the game API with simulated players")
+    ap.add_argument("--players", type=int, default=100)
+    ap.add_argument("--concurrency", type=int, default=25, help="players in flight at once")
+    ap.add_argument("--encoder", default="fake", help="SCORING_BACKEND for the server: fake (constant time), torch, onnx, ...")
+    ap.add_argument("--database-url", help="sync SQLAlchemy URL (default: a throwaway SQLite file)")
+    ap.add_argument("--async-database-url", help="async URL for the same database")
+    ap.add_argument("--reset-db", action="store_true", help="drop, recreate and seed the tables (required for MySQL)")
+    ap.add_argument("--url", help="benchmark an already running server instead of starting one")
+    ap.add_argument("--port", type=int, default=8765)
+    ap.add_argument("--workers", type=int, default=1, help="uvicorn workers")
+    ap.add_argument("--skill", type=float, default=0.6, help="chance a player types the exact prompt")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--timeout", type=float, default=60.0, help="per-request timeout in seconds")
+    ap.add_argument("--startup-timeout", type=float, default=300.0)
+    ap.add_argument("--out", help="result file (default bench_results/<timestamp>-<encoder>.json)")
+    ap.add_argument("--compare", help="earlier result file to diff against")
+    args = ap.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="pictoprompt-bench-")
+    external = bool(args.url)
+    if not args.database_url and not external:
+        db_path = os.path.join(workdir, "bench.sqlite3")
+        args.database_url = f"sqlite:///{db_path}?timeout=30"
+        args.async_database_url = f"sqlite+aiosqlite:///{db_path}?timeout=30"
+        args.reset_db = True
+    elif args.database_url and not args.async_database_url and not external:
+        raise SystemExit("--async-database-url is required with --database-url")
+
+    started_at = datetime.now().isoformat(timespec="seconds")
+    proc = None
+    try:
+        if args.reset_db:
+            prepare_database(args.database_url, reset=True)
+        # Without database access, players against an external server answer generically.
+        prompts = load_prompts(args.database_url) if args.database_url else {}
+        if not external:
+            args.url = f"http://127.0.0.1:{args.port}"
+            proc = start_server(args, workdir)
+        asyncio.run(wait_ready(args.url, args.startup_timeout, proc))
+        result = asyncio.run(run_players(args, prompts))
+    finally:
+        if proc is not None:
+            os.killpg(proc.pid, signal.SIGTERM)
+            proc.wait(timeout=30)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    result["run"] = {
+        "started_at": started_at,
+        "git_revision": git_revision(),
+        "encoder": args.encoder,
+        "database": args.database_url.split(":", 1)[0] if args.database_url else None,
+        "workers": args.workers,
+        "concurrency": args.concurrency,
+        "skill": args.skill,
+        "seed": args.seed,
+    }
+    print_report(result)
+
+    out = args.out or os.path.join(RESULTS_DIR, f"{started_at.replace(':', '')}-{args.encoder}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w") as f:
+        json.dump(result, f, indent=2)
+    print(f"\nsaved {out}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            print_comparison(json.load(f), result)
+
+if __name__ == "__main__":
+    main()
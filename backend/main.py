@@ -1,20 +1,110 @@
-from fastapi import FastAPI, Depends, HTTPException
+import time
+_IMPORT_STARTED = time.perf_counter()
+
+import os
+import hmac
+import logging
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Depends, HTTPException, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
+from fastapi.responses import JSONResponse, PlainTextResponse
+from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from starlette.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import text
-from typing import List
-from database import get_db
+from typing import List, Optional
+from database import (get_async_db, SessionLocal, async_engine, count_statements, pool_diagnostics, read_session,
+                      replica_router, REPLICA_MAX_LAG_SECONDS)
 import schema as s
 import models as m
 import crud
-from scoring_service import score_prompt
-
-app = FastAPI(title="Flight with AI — Progressive Prompt Game")
+from game_rules import EASY_COUNT, MEDIUM_COUNT, HARD_COUNT, PASS_THRESHOLD, NEXT_STAGE, img_points
+from leaderboard import leaderboard, decode_cursor
+from catalog import catalog, CATALOG_BALANCE
+from session_cache import session_cache, SessionState
+import scoring_service
+from scoring_service import score_prompts, batching_stats, cache_stats
+from scoring_pool import scoring_pool, ScoringOverloaded, SCORING_RETRY_AFTER_SECONDS
+from scoring_daemon import ScoringUnavailable, ScoringRequestTooLarge, SCORING_DAEMON_SOCKET
+from batch_encoder import EncodeTimeout
+import metrics
+from assets import AssetStaticFiles, url_for_path
+from attempt_log import attempt_log, ATTEMPT_LOG_ENABLED
+import image_stats
+import profiler
+
+_IMPORT_SECONDS = round(time.perf_counter() - _IMPORT_STARTED, 3)
+log = logging.getLogger("uvicorn.error")
+
+# Set PRELOAD_MODEL=0 for `--reload` development to skip model load/warmup at startup.
+PRELOAD_MODEL = os.getenv("PRELOAD_MODEL", "1") == "1"
+
+def _ping_db() -> None:
+    db = SessionLocal()
+    try:
+        db.execute(text("SELECT 1"))
+    finally:
+        db.close()
+
+def _warm_start() -> dict:
+    """Runs once per worker before it reports ready. Returns seconds per phase."""
+    timings = {"app_imports": _IMPORT_SECONDS}
+    t0 = time.perf_counter()
+    try:
+        _ping_db()
+        timings["db_ping"] = round(time.perf_counter() - t0, 3)
+    except Exception as e:
+        # Not fatal: /readyz keeps reporting not-ready until the database answers.
+        timings["db_ping"] = None
+        log.warning("Startup DB ping failed: %s", e)
+    if timings["db_ping"] is not None:
+        t1 = time.perf_counter()
+        db = SessionLocal()
+        try:
+            leaderboard.rebuild(db)
+        finally:
+            db.close()
+        timings["leaderboard"] = round(time.perf_counter() - t1, 3)
+    if PRELOAD_MODEL:
+        timings.update(scoring_service.warmup())
+        # With a scoring daemon the model and reference index live there
+        if timings["db_ping"] is not None and not SCORING_DAEMON_SOCKET:
+            t1 = time.perf_counter()
+            db = SessionLocal()
+            try:
+                scoring_service.sync_reference_index(db)
+            finally:
+                db.close()
+            timings["reference_index"] = round(time.perf_counter() - t1, 3)
+    timings["total"] = round(time.perf_counter() - t0 + _IMPORT_SECONDS, 3)
+    return timings
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    app.state.ready = False
+    app.state.startup = await run_in_threadpool(_warm_start)
+    log.info("Worker ready: %s", app.state.startup)
+    attempt_log.start()
+    if CATALOG_BALANCE and not ATTEMPT_LOG_ENABLED:
+        log.warning("CATALOG_BALANCE=1 with ATTEMPT_LOG_ENABLED=0: image_stats (the draw weights) will not update")
+    app.state.ready = True
+    yield
+    app.state.ready = False
+    scoring_pool.shutdown()
+    # Write out buffered attempts before the worker exits
+    await run_in_threadpool(attempt_log.stop)
+
+# Per-image difficulty aggregates are merged after every attempt-log flush; a batch the hook
+# fails on is missing from them until `python image_stats.py --rebuild`
+attempt_log.on_flush(image_stats.apply)
+
+app = FastAPI(title="Flight with AI — Progressive Prompt Game", lifespan=lifespan)
 
 # NOTE: This path assumes you run `uvicorn main:app --reload` from inside the backend/ folder.
 # If you run from project root with `uvicorn backend.main:app --reload`, change to directory="backend/static".
-app.mount("/static", StaticFiles(directory="static"), name="static")
+# Hashed asset URLs from `python assets.py` are served with immutable caching and per-client variants.
+app.mount("/static", AssetStaticFiles(directory="static"), name="static")
 
 app.add_middleware(
     CORSMiddleware,
@@ -24,97 +114,136 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-def url_for_path(fp: str) -> str:
-    return f"/static/{fp}"
-
-# Game configuration
-EASY_COUNT = 1
-MEDIUM_COUNT = 2
-HARD_COUNT = 2
-EASY_PASS = 70.0
-MEDIUM_PASS = 75.0
-HARD_PASS = 85.0
-
-# Points per image (max total = 200)
-WEIGHT_EASY = 20   # 1 image
-WEIGHT_MED  = 40   # per image (2 images)
-WEIGHT_HARD = 50   # per image (2 images)
-
-def img_points(level: m.Level, score_pct: float) -> int:
-    if level == m.Level.easy:
-        return int(score_pct * (WEIGHT_EASY / 100.0))
-    if level == m.Level.medium:
-        return int(score_pct * (WEIGHT_MED / 100.0))
-    return int(score_pct * (WEIGHT_HARD / 100.0))
-
-@app.post("/api/start", response_model=s.StartResponse)
-def start(req: s.StartRequest, db: Session = Depends(get_db)):
+# QUERY_COUNT_HEADER=1 adds X-Query-Count / X-Commit-Count to every response (benchmarks, debugging)
+if os.getenv("QUERY_COUNT_HEADER", "0") == "1":
+    @app.middleware("http")
+    async def query_count_header(request, call_next):
+        with count_statements() as counts:
+            response = await call_next(request)
+        response.headers["X-Query-Count"] = str(counts["statements"])
+        response.headers["X-Commit-Count"] = str(counts["commits"])
+        return response
+
+# Installed only with PROFILE_SECRET or ADMIN_TOKEN; an unprofiled request costs one header/toggle check
+if profiler.PROFILING_ENABLED:
+    @app.middleware("http")
+    async def profile_request(request, call_next):
+        try:
+            prof = await profiler.profiler.begin(request.method, request.url.path, request.headers.get(profiler.HEADER))
+            if prof is None:
+                return await call_next(request)
+            try:
+                response = await call_next(request)
+            except Exception:
+                await profiler.profiler.finish(prof, metrics.route_template(request.scope), 500)
+                raise
+            profile_id = await profiler.profiler.finish(prof, metrics.route_template(request.scope), response.status_code)
+            response.headers["X-Profile-Id"] = str(profile_id)
+            return response
+        finally:
+            profiler.profiler.end()
+
+if metrics.METRICS_ENABLED:
+    @app.middleware("http")
+    async def route_latency(request, call_next):
+        t0 = time.perf_counter()
+        status = 500
+        try:
+            response = await call_next(request)
+            status = response.status_code
+            return response
+        finally:
+            metrics.HTTP_LATENCY.observe(
+                time.perf_counter() - t0, request.method, metrics.route_template(request.scope), str(status)
+            )
+
+def _image_out(r) -> dict:
+    return {
+        "session_image_id": r["session_image_id"],
+        "image_id": r["image_id"],
+        "image_url": url_for_path(r["file_path"]),
+        "level": r["level"],
+        "stage_order": int(r["stage_order"]),
+        "stage_name": r["stage_name"]
+    }
+
+def _with_manifest(body: dict, items: list, response: Response) -> dict:
+    """Add every stage's images (no prompts) and Link hints: preload this stage, prefetch the rest."""
+    stages = {}
+    for it in items:
+        stages.setdefault(it["stage_name"], []).append(_image_out(it))
+    body["stages"] = stages
+    links = [f'<{img["image_url"]}>; rel={"preload" if stage == body["current_stage"] else "prefetch"}; as=image'
+             for stage, imgs in stages.items() for img in imgs]
+    if links:
+        response.headers["Link"] = ", ".join(links)
+    return body
+
+@app.post("/api/start", response_model=s.StartResponse, response_model_exclude_none=True)
+async def start(req: s.StartRequest, response: Response, db: AsyncSession = Depends(get_async_db), manifest: bool = False):
+    # run_sync carries only the SQL; the catalog stamp and the session stamp go through the threadpool.
+    # ?manifest=1 also returns the later stages' images so the client can fetch them ahead of time
+    await catalog.ensure_fresh_async(db)
+    body, items, state = await db.run_sync(_start, req, manifest)
+    if state is not None:
+        await run_in_threadpool(session_cache.put, state)
+    return _with_manifest(body, items, response) if manifest else body
+
+def _start(db: Session, req: s.StartRequest, manifest: bool = False):
     name = req.display_name.strip()
     if not name:
         raise HTTPException(400, "Display name required.")
 
-    # Get or create user by unique display_name
-    user = crud.upsert_user(db, name)
+    # Get or create user by unique display_name, together with their sessions (one transaction)
+    user_id, sessions = crud.lock_user_sessions(db, name)
 
     # Prevent reattempts if any prior session is completed or eliminated
-    if crud.has_any_finished_or_eliminated(db, user.id):
+    if any(r["state"] in (m.State.completed.value, m.State.eliminated.value) for r in sessions):
+        db.commit()
         raise HTTPException(
             status_code=403,
             detail="No reruns, ace! You've already flown this mission. Leaderboard’s that way."
         )
 
     # If there’s an active session, resume it
-    active = crud.has_active_session(db, user.id)
+    active = next((r for r in sessions if r["state"] == m.State.active.value), None)
     if active:
-        sess = active
-        rows = crud.get_stage_items(db, sess.id, sess.current_stage)
-        images = [{
-            "session_image_id": r["session_image_id"],
-            "image_id": r["image_id"],
-            "image_url": url_for_path(r["file_path"]),
-            "level": r["level"],
-            "stage_order": int(r["stage_order"]),
-            "stage_name": r["stage_name"]
-        } for r in rows]
-        return {"session_id": sess.id, "current_stage": sess.current_stage.value, "images": images}
-
-    # Create a fresh session
-    sess = crud.create_session(db, user.id)
-
-    # Assign all images upfront (locks randomness for the session)
-    crud.assign_stage_images(db, sess.id, m.Stage.easy, m.Level.easy, EASY_COUNT, start_order=1)
-    crud.assign_stage_images(db, sess.id, m.Stage.medium, m.Level.medium, MEDIUM_COUNT, start_order=EASY_COUNT + 1)
-    crud.assign_stage_images(db, sess.id, m.Stage.hard, m.Level.hard, HARD_COUNT, start_order=EASY_COUNT + MEDIUM_COUNT + 1)
-
-    rows = crud.get_stage_items(db, sess.id, m.Stage.easy)
-    images = [{
-        "session_image_id": r["session_image_id"],
-        "image_id": r["image_id"],
-        "image_url": url_for_path(r["file_path"]),
-        "level": str(m.Level.easy.value),
-        "stage_order": int(r["stage_order"]),
-        "stage_name": m.Stage.easy.value
-    } for r in rows]
-    return {"session_id": sess.id, "current_stage": m.Stage.easy.value, "images": images}
+        current = m.Stage(active["current_stage"])
+        if manifest:
+            items = crud.get_session_items(db, active["session_id"])
+            rows = [r for r in items if r["stage_name"] == current.value]
+        else:
+            rows = crud.get_stage_items(db, active["session_id"], current)
+        db.commit()
+        body = {"session_id": active["session_id"], "current_stage": current.value,
+                "images": [_image_out(r) for r in rows]}
+        return body, (items if manifest else rows), None
+
+    # Create a fresh session and assign all images upfront (locks randomness for the session)
+    session_id, items = crud.create_session_with_images(db, user_id, [
+        (m.Stage.easy, m.Level.easy, EASY_COUNT),
+        (m.Stage.medium, m.Level.medium, MEDIUM_COUNT),
+        (m.Stage.hard, m.Level.hard, HARD_COUNT),
+    ])
+    db.commit()
 
-@app.get("/api/session/{session_id}/next_stage", response_model=s.StartResponse)
-def next_stage(session_id: str, db: Session = Depends(get_db)):
-    sess = crud.get_session(db, session_id)
-    if not sess:
+    body = {"session_id": session_id, "current_stage": m.Stage.easy.value,
+            "images": [_image_out(it) for it in items if it["stage_name"] == m.Stage.easy.value]}
+    return body, items, SessionState(session_id, m.State.active.value, m.Stage.easy.value, None, 0, None, items)
+
+@app.get("/api/session/{session_id}/next_stage", response_model=s.StartResponse, response_model_exclude_none=True)
+async def next_stage(session_id: str, db: AsyncSession = Depends(get_async_db)):
+    # Served from the session cache; MySQL is only read on a miss
+    st = await session_cache.load_async(db, session_id)
+    if not st:
         raise HTTPException(404, "Session not found.")
-    if sess.state != m.State.active:
+    if st.state != m.State.active.value:
         raise HTTPException(400, "Session not active.")
 
-    if sess.current_stage == m.Stage.easy:
-        stage = m.Stage.easy
-    elif sess.current_stage == m.Stage.medium:
-        stage = m.Stage.medium
-    elif sess.current_stage == m.Stage.hard:
-        stage = m.Stage.hard
-    else:
+    stage = m.Stage(st.current_stage)
+    if stage not in (m.Stage.easy, m.Stage.medium, m.Stage.hard):
         raise HTTPException(400, "No active stage.")
 
-    rows = crud.get_stage_items(db, session_id, stage)
     images = [{
         "session_image_id": r["session_image_id"],
         "image_id": r["image_id"],
@@ -122,12 +251,11 @@ def next_stage(session_id: str, db: Session = Depends(get_db)):
         "level": r["level"],
         "stage_order": int(r["stage_order"]),
         "stage_name": r["stage_name"]
-    } for r in rows]
+    } for r in st.stage_items(stage.value)]
 
-    return {"session_id": sess.id, "current_stage": stage.value, "images": images}
+    return {"session_id": st.session_id, "current_stage": stage.value, "images": images}
 
-@app.post("/api/session/{session_id}/submit_stage", response_model=s.StageResult)
-def submit_stage(session_id: str, req: s.SubmitStageRequest, db: Session = Depends(get_db)):
+def _prepare_submission(db: Session, session_id: str, req: s.SubmitStageRequest):
     sess = crud.get_session(db, session_id)
     if not sess:
         raise HTTPException(404, "Session not found.")
@@ -138,12 +266,14 @@ def submit_stage(session_id: str, req: s.SubmitStageRequest, db: Session = Depen
     if stage not in (m.Stage.easy, m.Stage.medium, m.Stage.hard):
         raise HTTPException(400, "No active stage to submit.")
 
-    rows = crud.get_stage_items(db, session_id, stage)
-    stage_map = {r["session_image_id"]: r for r in rows}
+    # One read of the whole session; everything below is decided from these rows
+    items = [dict(r) for r in crud.get_session_items(db, session_id)]
+    stage_map = {r["session_image_id"]: r for r in items if r["stage_name"] == stage.value}
     expected = 1 if stage == m.Stage.easy else (2 if stage == m.Stage.medium else 2)
     if len(req.items) != expected:
         raise HTTPException(400, f"Expected {expected} prompts for stage {stage.value}, got {len(req.items)}.")
 
+    submitted = []
     for item in req.items:
         sid = item.get("session_image_id")
         up = (item.get("user_prompt") or "").strip()
@@ -151,110 +281,120 @@ def submit_stage(session_id: str, req: s.SubmitStageRequest, db: Session = Depen
             raise HTTPException(400, "Each item must include session_image_id and non-empty user_prompt.")
         if sid not in stage_map:
             raise HTTPException(400, f"session_image_id {sid} not part of current stage.")
-        original = stage_map[sid]["original_prompt"]
-        level = m.Level(stage_map[sid]["level"])
-        score_pct = score_prompt(up, original)
-        points = img_points(level, score_pct)
-        crud.update_prompt_score_points(db, sid, up, score_pct, points)
+        submitted.append((sid, up))
+    return stage, items, stage_map, submitted
 
-    db.commit()
-
-    completed = crud.count_completed_images(db, session_id)
-    crud.set_images_completed(db, session_id, completed)
-    db.commit()
+@app.post("/api/session/{session_id}/submit_stage", response_model=s.StageResult)
+async def submit_stage(session_id: str, req: s.SubmitStageRequest, db: AsyncSession = Depends(get_async_db)):
+    # DB work is async, the transformer runs on the dedicated scoring pool,
+    # so a burst of submissions cannot starve lightweight routes such as /api/leaderboard.
+    try:
+        with scoring_pool.admit():
+            stage, items, stage_map, submitted = await db.run_sync(_prepare_submission, session_id, req)
+            # Score the whole stage in one encode batch
+            t0 = time.perf_counter()
+            scores = await scoring_pool.run(score_prompts, [
+                (up, stage_map[sid]["original_prompt"], stage_map[sid]["image_id"]) for sid, up in submitted
+            ])
+            scoring_ms = round((time.perf_counter() - t0) * 1000, 2)
+            result, state = await db.run_sync(_apply_stage, session_id, stage, items, stage_map, submitted, scores)
+            await run_in_threadpool(session_cache.put, state)
+            if state.state != m.State.active.value:
+                await db.run_sync(leaderboard.record_finish, session_id)
+            _record_attempts(session_id, stage, stage_map, submitted, scores, scoring_ms)
+            return result
+    except ScoringRequestTooLarge as e:
+        # Only with the scoring daemon: its wire format bounds each prompt's byte length
+        raise HTTPException(422, f"Prompt too long to score: {e}.")
+    except (ScoringOverloaded, ScoringUnavailable, EncodeTimeout):
+        raise HTTPException(
+            status_code=503,
+            detail="Scoring is busy, please retry shortly.",
+            headers={"Retry-After": str(SCORING_RETRY_AFTER_SECONDS)},
+        )
 
-    if stage == m.Stage.easy:
-        details = crud.get_failing_details_for_stage(db, session_id, stage, 70.0)
-        if details and "eliminated_at" in details:
-            eliminated_at = details["eliminated_at"]
-            total_pts_now = crud.sum_points(db, session_id)
-            crud.set_eliminated_with_score(db, session_id, eliminated_at, completed, m.Stage.easy, details["image_order"], total_pts_now)
-            db.commit()
-            return {
-                "next_stage": m.Stage.done.value,
-                "eliminated_at": eliminated_at,
-                "passed": False,
-                "images_completed": completed,
-                "eliminated_prompt": details["eliminated_prompt"],
-                "eliminated_image_url": url_for_path(details["eliminated_image_url"]),
-                "matches": details["matches"]
-            }
-        crud.set_stage(db, session_id, m.Stage.medium)
-        db.commit()
-        matches = crud.get_stage_matches(db, session_id, m.Stage.easy)
-        completed_now = crud.count_completed_images(db, session_id)
-        return {
-            "next_stage": m.Stage.medium.value,
-            "passed": True,
-            "images_completed": completed_now,
-            "matches": matches
-        }
-
-    if stage == m.Stage.medium:
-        details = crud.get_failing_details_for_stage(db, session_id, stage, 75.0)
-        if details and "eliminated_at" in details:
-            eliminated_at = details["eliminated_at"]
-            total_pts_now = crud.sum_points(db, session_id)
-            crud.set_eliminated_with_score(db, session_id, eliminated_at, completed, m.Stage.medium, details["image_order"], total_pts_now)
-            db.commit()
-            return {
-                "next_stage": m.Stage.done.value,
-                "eliminated_at": eliminated_at,
-                "passed": False,
-                "images_completed": completed,
-                "eliminated_prompt": details["eliminated_prompt"],
-                "eliminated_image_url": url_for_path(details["eliminated_image_url"]),
-                "matches": details["matches"]
-            }
-        crud.set_stage(db, session_id, m.Stage.hard)
+def _record_attempts(session_id: str, stage: m.Stage, stage_map: dict, submitted: list, scores: list, scoring_ms: float):
+    # History goes through the write-behind buffer: no DB round trip on this request
+    attempt_log.record([{
+        "session_id": session_id,
+        "session_image_id": sid,
+        "image_id": stage_map[sid]["image_id"],
+        "stage_name": stage.value,
+        "user_prompt": up,
+        "score": score_pct,
+        "points": stage_map[sid]["points"],
+        "passed": int(score_pct >= PASS_THRESHOLD[stage]),
+        "scoring_ms": scoring_ms,
+    } for (sid, up), score_pct in zip(submitted, scores)])
+
+def _apply_stage(db: Session, session_id: str, stage: m.Stage, items: list, stage_map: dict, submitted: list, scores: list):
+    updates = []
+    for (sid, up), score_pct in zip(submitted, scores):
+        points = img_points(m.Level(stage_map[sid]["level"]), score_pct)
+        stage_map[sid].update(user_prompt=up, score=score_pct, points=points)
+        updates.append((sid, up, score_pct, points))
+
+    # Outcome from the in-memory rows (they now carry this submission's scores)
+    completed = sum(1 for r in items if r["score"] is not None)
+    total_pts = sum(int(r["points"] or 0) for r in items)
+    stage_rows = [r for r in items if r["stage_name"] == stage.value]
+    details = crud.stage_details(stage_rows, stage, PASS_THRESHOLD[stage])
+
+    # One UPDATE for the scores, one for the session, one commit
+    crud.update_scores_bulk(db, updates)
+    if details and "eliminated_at" in details:
+        eliminated_at = details["eliminated_at"]
+        crud.set_eliminated_with_score(db, session_id, eliminated_at, completed, stage, details["image_order"], total_pts)
         db.commit()
-        matches = crud.get_stage_matches(db, session_id, m.Stage.medium)
-        completed_now = crud.count_completed_images(db, session_id)
-        return {
-            "next_stage": m.Stage.hard.value,
-            "passed": True,
-            "images_completed": completed_now,
-            "matches": matches
-        }
-
-    if stage == m.Stage.hard:
-        details = crud.get_failing_details_for_stage(db, session_id, stage, 85.0)
-        if details and "eliminated_at" in details:
-            eliminated_at = details["eliminated_at"]
-            total_pts_now = crud.sum_points(db, session_id)
-            crud.set_eliminated_with_score(db, session_id, eliminated_at, completed, m.Stage.hard, details["image_order"], total_pts_now)
-            db.commit()
-            return {
-                "next_stage": m.Stage.done.value,
-                "eliminated_at": eliminated_at,
-                "passed": False,
-                "images_completed": completed,
-                "eliminated_prompt": details["eliminated_prompt"],
-                "eliminated_image_url": url_for_path(details["eliminated_image_url"]),
-                "matches": details["matches"]
-            }
-        total_pts = crud.sum_points(db, session_id)
-        crud.set_completed(db, session_id, total_score=total_pts, images_completed=completed)
-        db.commit()
-        matches = crud.get_stage_matches(db, session_id, m.Stage.hard)
-        completed_now = crud.count_completed_images(db, session_id)
+        state = SessionState(session_id, m.State.eliminated.value, stage.value, float(total_pts), completed, eliminated_at, items)
         return {
             "next_stage": m.Stage.done.value,
-            "passed": True,
-            "images_completed": completed_now,
-            "matches": matches
-        }
-
-    raise HTTPException(400, "Invalid stage logic.")
+            "eliminated_at": eliminated_at,
+            "passed": False,
+            "images_completed": completed,
+            "eliminated_prompt": details["eliminated_prompt"],
+            "eliminated_image_url": url_for_path(details["eliminated_image_url"]),
+            "matches": details["matches"]
+        }, state
+
+    next_stage = NEXT_STAGE[stage]
+    if next_stage == m.Stage.done:
+        crud.set_completed(db, session_id, total_score=total_pts, images_completed=completed)
+    else:
+        crud.advance_stage(db, session_id, next_stage, completed)
+    db.commit()
+    finished = next_stage == m.Stage.done
+    state = SessionState(
+        session_id,
+        m.State.completed.value if finished else m.State.active.value,
+        next_stage.value,
+        float(total_pts) if finished else None,
+        completed,
+        None,
+        items,
+    )
+    return {
+        "next_stage": next_stage.value,
+        "passed": True,
+        "images_completed": completed,
+        "matches": details["matches"] if details else []
+    }, state
+
+async def get_read_db(request: Request):
+    # Replica for read-only routes, except a session written within the lag bound (read-your-writes)
+    session_id = request.path_params.get("session_id")
+    pinned = session_id is not None and await run_in_threadpool(
+        session_cache.written_within, session_id, REPLICA_MAX_LAG_SECONDS)
+    async with read_session(pinned) as db:
+        yield db
 
 @app.get("/api/session/{session_id}/status")
-def status(session_id: str, db: Session = Depends(get_db)):
-    sess = crud.get_session(db, session_id)
-    if not sess:
+async def status(session_id: str, db: AsyncSession = Depends(get_read_db)):
+    st = await session_cache.load_async(db, session_id)
+    if not st:
         raise HTTPException(404, "Session not found.")
 
-    # Fetch all per-image results for dashboard (ordered by stage_order)
-    rows = crud.get_all_session_items_for_results(db, session_id)
+    # All per-image results for dashboard (ordered by stage_order)
     images = [{
         "session_image_id": r["session_image_id"],
         "stage_order": int(r["stage_order"]),
@@ -264,37 +404,177 @@ def status(session_id: str, db: Session = Depends(get_db)):
         "image_id": r["image_id"],
         "image_url": url_for_path(r["file_path"]),
         "user_prompt": r["user_prompt"]
-    } for r in rows]
+    } for r in st.items]
 
     return {
-        "state": sess.state.value,
-        "current_stage": sess.current_stage.value,
-        "total_score": float(sess.total_score) if sess.total_score is not None else None,
-        "images_completed": int(sess.images_completed or 0),
-        "eliminated_at": sess.eliminated_at,
+        "state": st.state,
+        "current_stage": st.current_stage,
+        "total_score": st.total_score,
+        "images_completed": st.images_completed,
+        "eliminated_at": st.eliminated_at,
         "images": images
     }
 
 @app.get("/api/leaderboard", response_model=List[s.LeaderboardRow])
-def leaderboard(db: Session = Depends(get_db), limit: int = 50):
-    rows = db.execute(
-        text("""
-        SELECT u.display_name, s.total_score, s.state, s.eliminated_at, s.created_at
-        FROM sessions s
-        JOIN users u ON u.id = s.user_id
-        WHERE s.total_score IS NOT NULL OR s.state = 'eliminated'
-        ORDER BY 
-          (s.total_score IS NOT NULL) DESC,  -- completed first
-          s.total_score DESC,
-          s.created_at ASC
-        LIMIT :lim
-        """),
-        {"lim": limit}
-    ).mappings().all()
-    return [{
-        "display_name": r["display_name"],
-        "total_score": float(r["total_score"] or 0),
-        "state": r["state"],
-        "eliminated_at": r["eliminated_at"],
-        "created_at": str(r["created_at"])
-    } for r in rows]
+async def leaderboard_top(response: Response, db: AsyncSession = Depends(get_read_db), limit: int = 50, after: Optional[str] = None):
+    # Served from the in-memory board; pass X-Next-Cursor back as ?after= for the next page
+    await leaderboard.ensure_fresh_async(db)
+    try:
+        cursor = decode_cursor(after) if after else None
+    except ValueError:
+        raise HTTPException(400, "Invalid cursor.")
+    page, next_cursor = leaderboard.top(max(1, min(limit, 500)), cursor)
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return [e.as_row() for e in page]
+
+@app.get("/api/leaderboard/rank/{session_id}", response_model=s.LeaderboardRank)
+async def leaderboard_rank(session_id: str, db: AsyncSession = Depends(get_read_db)):
+    await leaderboard.ensure_fresh_async(db)
+    found = leaderboard.rank(session_id)
+    if not found:
+        # Finished on another worker since the last reload; db is the primary if that was recent
+        await db.run_sync(leaderboard.record_finish, session_id)
+        found = leaderboard.rank(session_id)
+    if not found:
+        raise HTTPException(404, "Session not on the leaderboard.")
+    rank, entry = found
+    return {"rank": rank, "total": len(leaderboard), "row": entry.as_row()}
+
+@app.get("/api/scoring/stats")
+def scoring_stats():
+    # Micro-batching telemetry: batch size distribution and queue wait times
+    if SCORING_DAEMON_SOCKET:
+        return {"daemon": scoring_service.daemon_stats(), "admission": scoring_pool.stats(), "sessions": session_cache.stats(),
+                "attempts": attempt_log.stats()}
+    return {**batching_stats(), "admission": scoring_pool.stats(), "cache": cache_stats(), "sessions": session_cache.stats(),
+            "attempts": attempt_log.stats()}
+
+@metrics.REGISTRY.collector
+def _service_metrics():
+    # Existing stats() dicts, read only when /metrics is scraped
+    daemon = scoring_service.daemon_stats()
+    if daemon is not None:
+        # The batcher and cache live in the scoring daemon
+        batching = daemon.get("remote") or {}
+        cache = batching.get("cache") or {}
+    else:
+        batching, cache = batching_stats(), cache_stats()
+    pools = pool_diagnostics()
+    out = metrics.families("scoring_batch", "Micro-batcher", {
+        "queue_depth": "gauge", "batches": "counter", "items": "counter"}, [({}, batching)])
+    out += metrics.families("scoring_queue_wait_ms", "Micro-batcher queue wait", {
+        "mean": "gauge", "max": "gauge"}, [({}, batching.get("queue_wait_ms", {}))])
+    if daemon is not None:
+        out += metrics.families("scoring_daemon", "Scoring daemon client", {
+            "calls": "counter", "failures": "counter"}, [({}, daemon)])
+    out += metrics.families("scoring_admission", "Scoring admission control", {
+        "inflight": "gauge", "max_inflight": "gauge", "admitted": "counter", "rejected": "counter"},
+        [({}, scoring_pool.stats())])
+    cache_rows = [({"tier": "local"}, cache.get("local", {}))]
+    if "shared" in cache:
+        cache_rows.append(({"tier": "shared"}, cache["shared"]))
+    out += metrics.families("score_cache", "Score cache", {
+        "size": "gauge", "hits": "counter", "misses": "counter", "evictions": "counter", "expirations": "counter"},
+        cache_rows)
+    out += metrics.families("session_cache", "Session cache", {
+        "size": "gauge", "hits": "counter", "misses": "counter", "stale": "counter", "evictions": "counter",
+        "stamp_expirations": "counter", "stamp_evictions": "counter"}, [({}, session_cache.stats())])
+    out += metrics.families("db_pool", "Connection pool", {
+        "pool_size": "gauge", "checked_out": "gauge", "overflow": "gauge", "acquisitions": "counter",
+        "acquire_timeouts": "counter", "overflow_checkouts": "counter", "connects": "counter"},
+        [({"pool": name}, snap) for name, snap in pools.items()])
+    out += metrics.families("attempt_log", "Submission attempt write-behind buffer", {
+        "buffered": "gauge", "recorded": "counter", "written": "counter", "dropped": "counter",
+        "flushes": "counter", "flush_failures": "counter", "hook_failures": "counter"}, [({}, attempt_log.stats())])
+    replica = replica_router.stats()
+    if replica["configured"]:
+        out += metrics.families("db_replica", "Read replica routing", {
+            "lag_seconds": "gauge", "replica_reads": "counter", "primary_reads": "counter", "pinned_reads": "counter",
+            "lag_fallbacks": "counter", "lag_check_failures": "counter"},
+            [({}, replica)])
+    out.append(("leaderboard_entries", "gauge", "Finished sessions on the in-memory leaderboard",
+                [({}, len(leaderboard))]))
+    return out
+
+@app.get("/metrics", include_in_schema=False)
+def prometheus_metrics():
+    # Prometheus text exposition; collectors above only run on scrape
+    return PlainTextResponse(metrics.REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/healthz")
+def healthz():
+    # Liveness: the process is up and the event loop answers
+    return {"status": "ok"}
+
+@app.get("/readyz")
+async def readyz():
+    # Readiness: model warmed up and the database reachable
+    ready = bool(getattr(app.state, "ready", False))
+    db_ok = True
+    if ready:
+        try:
+            async with async_engine.connect() as conn:
+                await conn.execute(text("SELECT 1"))
+        except Exception:
+            db_ok = False
+    body = {"ready": ready and db_ok, "db": db_ok, "startup": getattr(app.state, "startup", None)}
+    return JSONResponse(body, status_code=200 if body["ready"] else 503)
+
+_bearer = HTTPBearer(auto_error=False)
+
+def require_admin(creds: Optional[HTTPAuthorizationCredentials] = Depends(_bearer)):
+    # The admin API (profiling, image stats, DB diagnostics) does not exist unless ADMIN_TOKEN is set
+    if not profiler.ADMIN_TOKEN:
+        raise HTTPException(404, "Not Found")
+    if creds is None or not hmac.compare_digest(creds.credentials, profiler.ADMIN_TOKEN):
+        raise HTTPException(401, "Admin token required.", headers={"WWW-Authenticate": "Bearer"})
+
+@app.get("/api/images/stats", dependencies=[Depends(require_admin)])
+async def images_stats(db: AsyncSession = Depends(get_async_db), level: Optional[m.Level] = None):
+    # Difficulty per image from the running aggregates (one row per image, no history scan).
+    # Admin-only: pass rates tell players which images are easy.
+    rows = await db.run_sync(image_stats.read)
+    if level is not None:
+        rows = [r for r in rows if r["level"] == level.value]
+    return {"images": rows}
+
+@app.get("/api/images/{image_id}/stats", dependencies=[Depends(require_admin)])
+async def image_stats_one(image_id: str, db: AsyncSession = Depends(get_async_db)):
+    rows = await db.run_sync(image_stats.read, image_id)
+    if not rows:
+        raise HTTPException(404, "No attempts recorded for this image.")
+    return rows[0]
+
+@app.get("/api/admin/profiling", dependencies=[Depends(require_admin)])
+def profiling_status():
+    return profiler.profiler.stats()
+
+@app.put("/api/admin/profiling", dependencies=[Depends(require_admin)])
+def profiling_on(req: s.ProfilingToggle):
+    # Sample a fraction of requests on every worker of this host for req.seconds
+    return profiler.profiler.set_sampling(req.rate, req.paths, req.seconds)
+
+@app.delete("/api/admin/profiling", dependencies=[Depends(require_admin)])
+def profiling_off():
+    profiler.profiler.clear_sampling()
+    return {"sampling": None}
+
+@app.get("/api/admin/profiles", dependencies=[Depends(require_admin)])
+def profiles():
+    return {"profiles": profiler.profiler.recent()}
+
+@app.get("/api/admin/profiles/{profile_id}", dependencies=[Depends(require_admin)])
+def profile_one(profile_id: int, format: str = "json"):
+    # format=collapsed: folded stacks for flamegraph.pl / speedscope; SQL is in the JSON form
+    data = profiler.profiler.get(profile_id)
+    if data is None:
+        raise HTTPException(404, "Profile no longer in the ring.")
+    if format == "collapsed":
+        return PlainTextResponse(profiler.collapsed(data))
+    return data
+
+@app.get("/api/diagnostics/db", dependencies=[Depends(require_admin)])
+def db_diagnostics():
+    # Pool telemetry: checked-out connections, acquire wait, overflow checkouts, timeouts
+    return {**pool_diagnostics(), "replica": replica_router.stats()}
@@ -0,0 +1,190 @@
+import os
+import sys
+import time
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Iterable, Optional
+
+# METRICS_ENABLED=0 turns every observation into a no-op and detaches the SQL event hooks.
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") == "1"
+
+# Seconds; Prometheus-style cumulative buckets (+Inf is implicit).
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _labels(names: tuple, values: tuple, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+class Counter:
+    """Monotonic counter with positional label values."""
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: tuple = ()):
+        self.name, self.help, self.labelnames = name, help, tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values: dict[tuple, float] = {}
+
+    def inc(self, *labelvalues, amount: float = 1.0):
+        if not METRICS_ENABLED:
+            return
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0.0) + amount
+
+    def render(self) -> list[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_labels(self.labelnames, k)} {v}" for k, v in items]
+
+class Histogram:
+    """Cumulative-bucket histogram. observe() is a bisect and three adds under a lock."""
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        self.name, self.help, self.labelnames = name, help, tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        self._series: dict[tuple, list] = {}  # labels -> [bucket counts..., sum, count]
+
+    def observe(self, value: float, *labelvalues):
+        if not METRICS_ENABLED:
+            return
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            s = self._series.get(labelvalues)
+            if s is None:
+                s = self._series[labelvalues] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+            s[i] += 1
+            s[-2] += value
+            s[-1] += 1
+
+    @contextmanager
+    def time(self, *labelvalues):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - t0, *labelvalues)
+
+    def render(self) -> list[str]:
+        with self._lock:
+            items = sorted((k, list(v)) for k, v in self._series.items())
+        lines = []
+        for k, s in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float("inf"),), s):
+                cumulative += n
+                le = 'le="+Inf"' if bound == float("inf") else f'le="{bound!r}"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, k, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, k)} {s[-2]}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, k)} {s[-1]}")
+        return lines
+
+class Registry:
+    """
+    Metrics owned by this module plus collectors: callables run only at scrape time that
+    turn existing stats() dicts into (name, kind, help, [(labels dict, value)]) families.
+    """
+
+    def __init__(self):
+        self._metrics: list = []
+        self._collectors: list[Callable[[], Iterable[tuple]]] = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def collector(self, fn: Callable[[], Iterable[tuple]]):
+        self._collectors.append(fn)
+        return fn
+
+    def render(self) -> str:
+        lines = []
+        for m in self._metrics:
+            lines.append(f"# HELP {m.name} {m.help}")
+            lines.append(f"# TYPE {m.name} {m.kind}")
+            lines.extend(m.render())
+        for fn in self._collectors:
+            try:
+                families = list(fn())
+            except Exception as e:  # a broken collector must not take /metrics down
+                lines.append(f"# collector {getattr(fn, '__name__', fn)} failed: {_escape(e)}")
+                continue
+            for name, kind, help, samples in families:
+                lines.append(f"# HELP {name} {help}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in samples:
+                    lines.append(f"{name}{_labels(tuple(labels), tuple(labels.values()))} {float(value)}")
+        return "\n".join(lines) + "\n"
+
+REGISTRY = Registry()
+
+HTTP_LATENCY = REGISTRY.register(Histogram(
+    "http_request_duration_seconds", "Request latency by route template.", ("method", "route", "status")))
+SCORING_SECONDS = REGISTRY.register(Histogram(
+    "scoring_seconds", "Wall time of one score_prompts call (one stage submission)."))
+SCORING_STAGE = REGISTRY.register(Histogram(
+    "scoring_stage_seconds",
+    "Time per scoring step: normalize, cache, encode (waiting on the batch encoder), reference, similarity; "
+    "model (one backend batch) and tokenize (the part of model spent tokenizing).",
+    ("stage",)))
+DB_QUERY = REGISTRY.register(Histogram(
+    "db_query_seconds", "SQL statement latency by originating function.", ("origin",)))
+DB_COMMITS = REGISTRY.register(Counter(
+    "db_commits_total", "Transaction commits.", ()))
+
+# Modules whose functions issue SQL; the innermost frame from one of them tags the statement.
+QUERY_ORIGIN_MODULES = frozenset({"crud", "leaderboard", "catalog", "session_cache", "embedding_index", "main"})
+
+def query_origin() -> str:
+    f = sys._getframe(2)
+    while f is not None:
+        module = f.f_globals.get("__name__")
+        if module in QUERY_ORIGIN_MODULES:
+            return f"{module}.{f.f_code.co_name}"
+        f = f.f_back
+    return "other"
+
+def _before_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context._metrics_started = time.perf_counter()
+
+def _after_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, "_metrics_started", None)
+    if started is not None:
+        DB_QUERY.observe(time.perf_counter() - started, query_origin())
+
+def _on_commit(conn):
+    DB_COMMITS.inc()
+
+def instrument_engine(engine):
+    """Time every statement on a sync engine (for async engines pass .sync_engine)."""
+    if not METRICS_ENABLED:
+        return
+    from sqlalchemy import event
+    event.listen(engine, "before_cursor_execute", _before_execute)
+    event.listen(engine, "after_cursor_execute", _after_execute)
+    event.listen(engine, "commit", _on_commit)
+
+def route_template(scope: dict) -> str:
+    # Label by the matched route's template so /api/session/{session_id}/... stays one series
+    route = scope.get("route")
+    return getattr(route, "path", None) or "unmatched"
+
+def families(prefix: str, help: str, kinds: dict, rows: list[tuple[dict, dict]]) -> list[tuple]:
+    """
+    Collector families from stats() dicts: kinds maps a key to "counter" or "gauge",
+    rows pairs each dict with its labels (e.g. one row per connection pool).
+    """
+    out = []
+    for key, kind in kinds.items():
+        samples = [(labels, stats[key]) for labels, stats in rows if isinstance(stats.get(key), (int, float))]
+        if samples:
+            name = f"{prefix}_{key}" + ("_total" if kind == "counter" else "")
+            out.append((name, kind, f"{help}: {key.replace('_', ' ')}", samples))
+    return out
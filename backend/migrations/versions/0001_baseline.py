@@ -0,0 +1,79 @@
+"""Baseline: the schema db_init.sql created before migrations existed
+
+Revision ID: 0001_baseline
+Revises:
+Create Date: 2026-10-18
+
+Databases that already have these tables should be stamped, not upgraded:
+alembic stamp 0001_baseline, then alembic upgrade head. A database built from the
+current db_init.sql already matches head: alembic stamp head.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0001_baseline"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+LEVEL = ("easy", "medium", "hard")
+STAGE = ("easy", "medium", "hard", "done")
+
+def upgrade():
+    op.create_table(
+        "users",
+        sa.Column("id", sa.CHAR(36), primary_key=True),
+        sa.Column("display_name", sa.String(80), nullable=False, unique=True),
+        sa.Column("created_at", sa.DateTime, server_default=sa.func.current_timestamp()),
+    )
+    op.create_table(
+        "images",
+        sa.Column("id", sa.CHAR(36), primary_key=True),
+        sa.Column("level", sa.Enum(*LEVEL, name="level"), nullable=False),
+        sa.Column("file_path", sa.String(255), nullable=False),
+        sa.Column("original_prompt", sa.Text, nullable=False),
+        sa.Column("negative_prompt", sa.Text),
+        sa.Column("generator_model", sa.String(80)),
+        sa.Column("seed", sa.Integer),
+        sa.Column("meta", sa.JSON),
+        sa.Column("active", sa.SmallInteger, server_default="1"),
+        sa.Column("created_at", sa.DateTime, server_default=sa.func.current_timestamp()),
+    )
+    op.create_table(
+        "sessions",
+        sa.Column("id", sa.CHAR(36), primary_key=True),
+        sa.Column("user_id", sa.CHAR(36), nullable=False),
+        sa.Column("state", sa.Enum("active", "completed", "eliminated", name="state"),
+                  nullable=False, server_default="active"),
+        sa.Column("current_stage", sa.Enum(*STAGE, name="stage"), nullable=False, server_default="easy"),
+        sa.Column("total_score", sa.DECIMAL(6, 2)),
+        sa.Column("images_completed", sa.Integer, server_default="0"),
+        sa.Column("eliminated_at", sa.String(20)),
+        sa.Column("eliminated_stage", sa.Enum(*LEVEL, name="level")),
+        sa.Column("eliminated_image_order", sa.SmallInteger),
+        sa.Column("created_at", sa.DateTime, server_default=sa.func.current_timestamp()),
+        sa.Column("completed_at", sa.DateTime),
+        sa.ForeignKeyConstraint(["user_id"], ["users.id"], name="fk_user"),
+    )
+    op.create_table(
+        "session_images",
+        sa.Column("id", sa.CHAR(36), primary_key=True),
+        sa.Column("session_id", sa.CHAR(36), nullable=False),
+        sa.Column("image_id", sa.CHAR(36), nullable=False),
+        sa.Column("level", sa.Enum(*LEVEL, name="level"), nullable=False),
+        sa.Column("stage_order", sa.SmallInteger, nullable=False),
+        sa.Column("stage_name", sa.Enum(*STAGE, name="stage"), nullable=False),
+        sa.Column("user_prompt", sa.Text),
+        sa.Column("score", sa.DECIMAL(5, 2)),
+        sa.Column("points", sa.Integer),
+        sa.Column("created_at", sa.DateTime, server_default=sa.func.current_timestamp()),
+        sa.ForeignKeyConstraint(["session_id"], ["sessions.id"], name="fk_sess", ondelete="CASCADE"),
+        sa.ForeignKeyConstraint(["image_id"], ["images.id"], name="fk_img"),
+        sa.UniqueConstraint("session_id", "stage_order", name="uniq_sess_order"),
+    )
+    op.create_index("idx_images_level_active", "images", ["level", "active"])
+    op.create_index("idx_sessions_leaderboard", "sessions", ["state", "total_score", "completed_at"])
+
+def downgrade():
+    for table in ("session_images", "sessions", "images", "users"):
+        op.drop_table(table)
@@ -0,0 +1,33 @@
+"""Indexes for the hot crud queries and the leaderboard order
+
+Revision ID: 0002_query_indexes
+Revises: 0001_baseline
+Create Date: 2026-10-18
+
+- session_images (session_id, stage_name, stage_order): per-stage reads, already in order
+- sessions (user_id, state, created_at): has_active_session / has_any_finished_or_eliminated
+- sessions (user_id, created_at): latest session per user, lock_user_sessions
+- sessions (total_score DESC, created_at): leaderboard order; finished-session reads
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0002_query_indexes"
+down_revision = "0001_baseline"
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    op.create_index("idx_si_session_stage", "session_images", ["session_id", "stage_name", "stage_order"])
+    op.create_index("idx_sessions_user_state", "sessions", ["user_id", "state", "created_at"])
+    op.create_index("idx_sessions_user_created", "sessions", ["user_id", "created_at"])
+    op.create_index("idx_sessions_rank", "sessions", [sa.text("total_score DESC"), "created_at"])
+
+def downgrade():
+    if op.get_bind().dialect.name == "mysql":
+        # MySQL dropped fk_user's implicit index once the user_id indexes covered it
+        op.create_index("fk_user", "sessions", ["user_id"])
+    op.drop_index("idx_sessions_rank", table_name="sessions")
+    op.drop_index("idx_sessions_user_created", table_name="sessions")
+    op.drop_index("idx_sessions_user_state", table_name="sessions")
+    op.drop_index("idx_si_session_stage", table_name="session_images")
@@ -0,0 +1,38 @@
+"""submission_attempts: append-only log of scored prompts
+
+Revision ID: 0003_submission_attempts
+Revises: 0002_query_indexes
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import mysql
+
+revision = "0003_submission_attempts"
+down_revision = "0002_query_indexes"
+branch_labels = None
+depends_on = None
+
+STAGE = ("easy", "medium", "hard", "done")
+
+def upgrade():
+    op.create_table(
+        "submission_attempts",
+        sa.Column("id", sa.BigInteger().with_variant(sa.Integer, "sqlite"), primary_key=True, autoincrement=True),
+        sa.Column("session_id", sa.CHAR(36), nullable=False),
+        sa.Column("session_image_id", sa.CHAR(36), nullable=False),
+        sa.Column("image_id", sa.CHAR(36), nullable=False),
+        sa.Column("stage_name", sa.Enum(*STAGE, name="stage"), nullable=False),
+        sa.Column("user_prompt", sa.Text, nullable=False),
+        sa.Column("score", sa.DECIMAL(5, 2), nullable=False),
+        sa.Column("points", sa.Integer, nullable=False),
+        sa.Column("passed", sa.SmallInteger, nullable=False),
+        sa.Column("scoring_ms", sa.Float),
+        sa.Column("model", sa.String(64)),
+        sa.Column("attempted_at", sa.DateTime().with_variant(mysql.DATETIME(fsp=3), "mysql"), nullable=False),
+    )
+    op.create_index("idx_attempts_session", "submission_attempts", ["session_id"])
+    op.create_index("idx_attempts_image", "submission_attempts", ["image_id", "attempted_at"])
+
+def downgrade():
+    op.drop_table("submission_attempts")
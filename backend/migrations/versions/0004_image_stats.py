@@ -0,0 +1,38 @@
+"""image_stats and image_score_hist: incrementally maintained per-image difficulty
+
+Revision ID: 0004_image_stats
+Revises: 0003_submission_attempts
+Create Date: 2026-10-18
+
+Starts empty; `python image_stats.py --rebuild` backfills from session_images.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0004_image_stats"
+down_revision = "0003_submission_attempts"
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    op.create_table(
+        "image_stats",
+        sa.Column("image_id", sa.CHAR(36), primary_key=True),
+        sa.Column("attempts", sa.Integer, nullable=False),
+        sa.Column("passes", sa.Integer, nullable=False),
+        sa.Column("score_mean", sa.Float(53), nullable=False),
+        sa.Column("score_m2", sa.Float(53), nullable=False),
+        sa.Column("score_min", sa.DECIMAL(5, 2)),
+        sa.Column("score_max", sa.DECIMAL(5, 2)),
+        sa.Column("updated_at", sa.DateTime),
+    )
+    op.create_table(
+        "image_score_hist",
+        sa.Column("image_id", sa.CHAR(36), primary_key=True),
+        sa.Column("bucket", sa.SmallInteger, primary_key=True, autoincrement=False),
+        sa.Column("attempts", sa.Integer, nullable=False),
+    )
+
+def downgrade():
+    op.drop_table("image_score_hist")
+    op.drop_table("image_stats")
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, Enum, DateTime, Text, ForeignKey, DECIMAL, JSON, Integer, UniqueConstraint
+from sqlalchemy import Column, String, Enum, DateTime, Text, ForeignKey, DECIMAL, JSON, Integer, UniqueConstraint, Index, BigInteger, Float
 from sqlalchemy.sql import func
 import enum
 from database import Base
@@ -37,6 +37,7 @@ class Image(Base):
     meta = Column(JSON)
     active = Column(Integer, default=1)
     created_at = Column(DateTime, server_default=func.now())
+    __table_args__ = (Index("idx_images_level_active", "level", "active"),)
 
 class Session(Base):
     __tablename__ = "sessions"
@@ -47,8 +48,17 @@ class Session(Base):
     total_score = Column(DECIMAL(6,2))  # only set if completed
     images_completed = Column(Integer, default=0) # count of images with scores
     eliminated_at = Column(String(20))   # "easy-1", "medium-2", "hard-1" or NULL
+    eliminated_stage = Column(Enum(Level))
+    eliminated_image_order = Column(Integer)
     created_at = Column(DateTime, server_default=func.now())
     completed_at = Column(DateTime)
+    # Mirrors db_init.sql / migrations; see explain_check.py for the queries each one serves
+    __table_args__ = (
+        Index("idx_sessions_leaderboard", "state", "total_score", "completed_at"),
+        Index("idx_sessions_user_state", "user_id", "state", "created_at"),
+        Index("idx_sessions_user_created", "user_id", "created_at"),
+        Index("idx_sessions_rank", total_score.desc(), created_at),
+    )
 
 class SessionImage(Base):
     __tablename__ = "session_images"
@@ -60,5 +70,45 @@ class SessionImage(Base):
     stage_name = Column(Enum(Stage), nullable=False)  # easy, medium, hard at time of assignment
     user_prompt = Column(Text)
     score = Column(DECIMAL(5,2))
+    points = Column(Integer)
     created_at = Column(DateTime, server_default=func.now())
-    __table_args__ = (UniqueConstraint('session_id','stage_order', name='uniq_session_stage_order'),)
+    __table_args__ = (
+        UniqueConstraint('session_id','stage_order', name='uniq_sess_order'),
+        Index("idx_si_session_stage", "session_id", "stage_name", "stage_order"),
+    )
+
+class SubmissionAttempt(Base):
+    __tablename__ = "submission_attempts"
+    id = Column(BigInteger().with_variant(Integer, "sqlite"), primary_key=True, autoincrement=True)
+    session_id = Column(String(36), nullable=False)
+    session_image_id = Column(String(36), nullable=False)
+    image_id = Column(String(36), nullable=False)
+    stage_name = Column(Enum(Stage), nullable=False)
+    user_prompt = Column(Text, nullable=False)
+    score = Column(DECIMAL(5,2), nullable=False)
+    points = Column(Integer, nullable=False)
+    passed = Column(Integer, nullable=False)
+    scoring_ms = Column(Float)          # wall time of the stage's score_prompts call
+    model = Column(String(64))          # scoring_service.fingerprint()
+    attempted_at = Column(DateTime, nullable=False)
+    __table_args__ = (
+        Index("idx_attempts_session", "session_id"),
+        Index("idx_attempts_image", "image_id", "attempted_at"),
+    )
+
+class ImageStats(Base):
+    __tablename__ = "image_stats"
+    image_id = Column(String(36), primary_key=True)
+    attempts = Column(Integer, nullable=False)
+    passes = Column(Integer, nullable=False)
+    score_mean = Column(Float(53), nullable=False)
+    score_m2 = Column(Float(53), nullable=False)   # sum of squared deviations (Welford)
+    score_min = Column(DECIMAL(5,2))
+    score_max = Column(DECIMAL(5,2))
+    updated_at = Column(DateTime)
+
+class ImageScoreHist(Base):
+    __tablename__ = "image_score_hist"
+    image_id = Column(String(36), primary_key=True)
+    bucket = Column(Integer, primary_key=True)   # floor(score), 100 folded into 99
+    attempts = Column(Integer, nullable=False)
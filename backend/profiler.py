@@ -0,0 +1,336 @@
+"""
+On-demand request profiling.
+
+A request is profiled when it carries a valid signed X-Profile header, or while an admin
+has switched on sampling (a fraction of requests, optionally only paths matching a glob,
+for a limited time). During a profile a sampler thread records every thread's stack each
+PROFILE_INTERVAL_MS and the request's SQL statements are timed. Stacks are kept folded
+(flamegraph.pl, speedscope, inferno) in a host-wide ring of the last PROFILE_RING_SIZE
+profiles; the response carries X-Profile-Id.
+
+The stacks cover the whole worker process while the profile runs, not just the profiled
+request: other requests on the event loop and in the thread pools are sampled too
+(`concurrent` counts the requests that were in flight). The SQL list is the request's own.
+
+    python profiler.py sign --ttl 600                 # an X-Profile value (needs PROFILE_SECRET)
+    python profiler.py list
+    python profiler.py collapsed 42 > submit.folded   # flamegraph.pl submit.folded > submit.svg
+"""
+import os
+import re
+import sys
+import hmac
+import json
+import time
+import zlib
+import random
+import hashlib
+import argparse
+import threading
+from collections import Counter
+from contextvars import ContextVar
+from datetime import datetime
+from fnmatch import fnmatch
+from typing import Optional
+from starlette.concurrency import run_in_threadpool
+from shared_store import SharedStore
+
+# HMAC key for X-Profile headers; unset = signed profiling is off.
+PROFILE_SECRET = os.getenv("PROFILE_SECRET", "")
+# Bearer token for the admin endpoints (sampling toggle, profile ring, image stats, DB diagnostics); unset = no admin API.
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+# Neither set: the middleware is not installed at all.
+PROFILING_ENABLED = bool(PROFILE_SECRET or ADMIN_TOKEN)
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "1"))
+# Profiles kept per host (oldest overwritten).
+PROFILE_RING_SIZE = int(os.getenv("PROFILE_RING_SIZE", "50"))
+PROFILE_MAX_STATEMENTS = int(os.getenv("PROFILE_MAX_STATEMENTS", "500"))
+# Sampling stops after this long even if the request is still running (streams, hangs).
+PROFILE_MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", "30"))
+# Signed headers may not be valid for longer than this.
+PROFILE_TOKEN_MAX_TTL = int(os.getenv("PROFILE_TOKEN_MAX_TTL_SECONDS", "3600"))
+
+HEADER = "x-profile"
+TOGGLE_KEY = "toggle"
+
+# The profile of the request being handled, for the SQL listener
+_current: ContextVar = ContextVar("profile", default=None)
+
+def sign(expires: int, secret: str = PROFILE_SECRET) -> str:
+    """X-Profile value valid until the unix time `expires`."""
+    return f"{expires}.{hmac.new(secret.encode(), str(expires).encode(), hashlib.sha256).hexdigest()}"
+
+def verify(value: str, secret: str = PROFILE_SECRET) -> bool:
+    if not secret:
+        return False
+    expires, _, _ = value.partition(".")
+    if not expires.isdigit() or not 0 < int(expires) - time.time() <= PROFILE_TOKEN_MAX_TTL:
+        return False
+    return hmac.compare_digest(value, sign(int(expires), secret))
+
+_labels: dict = {}
+
+def _label(code) -> str:
+    label = _labels.get(code)
+    if label is None:
+        name = getattr(code, "co_qualname", code.co_name)
+        label = _labels[code] = f"{name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})".replace(";", ",")
+    return label
+
+def thread_label(name: str) -> str:
+    # Pool threads differ only by a counter or id; fold them together
+    name = re.sub(r"^Thread-\d+ \((.*)\)$", r"\1", name)
+    return re.sub(r"[_-](\d+|[0-9a-f]{8,})$", "", name)
+
+def fold(thread: str, frame) -> str:
+    stack = []
+    while frame is not None:
+        stack.append(_label(frame.f_code))
+        frame = frame.f_back
+    stack.append(thread)
+    return ";".join(reversed(stack))
+
+class Profile:
+    __slots__ = ("id", "method", "path", "route", "status", "trigger", "started_at", "t0", "duration_ms",
+                 "stacks", "samples", "concurrent", "statements", "statements_dropped", "_token", "_stop", "_thread")
+
+    def __init__(self, method: str, path: str, trigger: str):
+        self.id = None
+        self.method = method
+        self.path = path
+        self.route = None
+        self.status = None
+        self.trigger = trigger
+        self.started_at = datetime.now()
+        self.t0 = time.perf_counter()
+        self.duration_ms = None
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self.concurrent = 0
+        self.statements: list[dict] = []
+        self.statements_dropped = 0
+        self._token = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _sample(self, interval: float):
+        me = threading.get_ident()
+        deadline = time.perf_counter() + PROFILE_MAX_SECONDS
+        names: dict[int, str] = {}
+        while not self._stop.wait(interval) and time.perf_counter() < deadline:
+            frames = sys._current_frames()
+            if frames.keys() - names.keys():
+                names = {t.ident: thread_label(t.name) for t in threading.enumerate()}
+            for ident, frame in frames.items():
+                if ident != me:
+                    self.stacks[fold(names.get(ident, "thread"), frame)] += 1
+            self.samples += 1
+
+    def add_statement(self, statement: str, ms: float, origin: str, executemany: bool):
+        if len(self.statements) >= PROFILE_MAX_STATEMENTS:
+            self.statements_dropped += 1
+            return
+        self.statements.append({"at_ms": round((time.perf_counter() - self.t0) * 1000 - ms, 3), "ms": round(ms, 3),
+                                "origin": origin, "executemany": executemany, "statement": " ".join(statement.split())})
+
+    def summary(self) -> dict:
+        return {
+            "id": self.id,
+            "method": self.method,
+            "path": self.path,
+            "route": self.route,
+            "status": self.status,
+            "trigger": self.trigger,
+            "started_at": self.started_at.isoformat(timespec="milliseconds"),
+            "duration_ms": self.duration_ms,
+            "samples": self.samples,
+            "interval_ms": PROFILE_INTERVAL_MS,
+            "concurrent": self.concurrent,
+            "statements": len(self.statements) + self.statements_dropped,
+            "sql_ms": round(sum(s["ms"] for s in self.statements), 3),
+        }
+
+    def as_dict(self) -> dict:
+        return {**self.summary(), "stacks": dict(self.stacks), "sql": self.statements,
+                "statements_dropped": self.statements_dropped}
+
+def _before_sql(conn, cursor, statement, parameters, context, executemany):
+    if context is not None and _current.get() is not None:
+        context._profile_started = time.perf_counter()
+
+def _after_sql(conn, cursor, statement, parameters, context, executemany):
+    prof = _current.get()
+    started = getattr(context, "_profile_started", None)
+    if prof is not None and started is not None:
+        from metrics import query_origin
+        prof.add_statement(statement, (time.perf_counter() - started) * 1000, query_origin(), executemany)
+
+def collapsed(data: dict) -> str:
+    """Folded stacks ("frame;frame;frame count" per line) from a stored profile."""
+    return "".join(f"{stack} {n}\n" for stack, n in sorted(data["stacks"].items()))
+
+class Profiler:
+    """
+    At most one profile runs per worker at a time; a request that would start a second
+    one runs unprofiled (counted in `busy`). begin() is the only call an unprofiled
+    request makes. Shared-store reads and writes, and joining the sampler, run in the
+    threadpool so the event loop never waits on them.
+    """
+
+    def __init__(self, interval_ms: float = PROFILE_INTERVAL_MS, ring_size: int = PROFILE_RING_SIZE):
+        self.interval = interval_ms / 1000
+        self.ring_size = ring_size
+        self._lock = threading.Lock()
+        self._active: Optional[Profile] = None
+        self._store = None
+        self._toggle = None
+        self._toggle_checked_at = float("-inf")
+        self._sql_attached = False
+        self._inflight = 0
+        self.profiled = 0
+        self.busy = 0
+        self.rejected_headers = 0
+
+    def _shared(self) -> SharedStore:
+        if self._store is None:
+            self._store = SharedStore("profiles")
+        return self._store
+
+    def _toggle_due(self) -> bool:
+        return time.monotonic() - self._toggle_checked_at >= 1.0
+
+    def sampling(self) -> Optional[dict]:
+        """The admin sampling toggle, re-read from the shared store at most once a second."""
+        if self._toggle_due():
+            self._toggle_checked_at = time.monotonic()
+            raw = self._shared().get(TOGGLE_KEY)
+            self._toggle = json.loads(raw) if raw else None
+        return self._toggle
+
+    def set_sampling(self, rate: float, paths: str, seconds: float) -> dict:
+        toggle = {"rate": rate, "paths": paths, "until": round(time.time() + seconds, 3)}
+        self._shared().set(TOGGLE_KEY, json.dumps(toggle).encode(), ttl=seconds)
+        self._toggle_checked_at = float("-inf")
+        return toggle
+
+    def clear_sampling(self):
+        self._shared().delete(TOGGLE_KEY)
+        self._toggle_checked_at = float("-inf")
+
+    async def begin(self, method: str, path: str, header: Optional[str]) -> Optional[Profile]:
+        with self._lock:
+            self._inflight += 1
+            if self._active is not None:
+                self._active.concurrent += 1
+        trigger = None
+        if header is not None:
+            if verify(header):
+                trigger = "header"
+            else:
+                self.rejected_headers += 1
+        if trigger is None:
+            toggle = await run_in_threadpool(self.sampling) if self._toggle_due() else self._toggle
+            if toggle is None or not fnmatch(path, toggle["paths"]) or random.random() >= toggle["rate"]:
+                return None
+            trigger = "sample"
+        prof = Profile(method, path, trigger)
+        with self._lock:
+            if self._active is not None:
+                self.busy += 1
+                return None
+            self._active = prof
+            prof.concurrent = self._inflight - 1
+        self._attach_sql()
+        prof._token = _current.set(prof)
+        prof._thread = threading.Thread(target=prof._sample, args=(self.interval,), name="profiler", daemon=True)
+        prof._thread.start()
+        return prof
+
+    def _attach_sql(self):
+        # Listeners go on the first time this worker profiles and are no-ops outside a profile
+        if self._sql_attached:
+            return
+        from sqlalchemy import event
+        import database
+
+        for eng in database.engines:
+            event.listen(eng, "before_cursor_execute", _before_sql)
+            event.listen(eng, "after_cursor_execute", _after_sql)
+        self._sql_attached = True
+
+    def end(self):
+        """Every request that went through begin() calls this once it is done."""
+        with self._lock:
+            self._inflight -= 1
+
+    async def finish(self, prof: Profile, route: Optional[str], status: int) -> int:
+        """Stop sampling and store the profile; returns its id."""
+        prof._stop.set()
+        _current.reset(prof._token)
+        prof.duration_ms = round((time.perf_counter() - prof.t0) * 1000, 3)
+        prof.route = route
+        prof.status = status
+        with self._lock:
+            self._active = None
+            self.profiled += 1
+        return await run_in_threadpool(self._store_profile, prof)
+
+    def _store_profile(self, prof: Profile) -> int:
+        prof._thread.join()
+        return self.save(prof)
+
+    def save(self, prof: Profile) -> int:
+        store = self._shared()
+        prof.id = store.incr("seq")
+        store.set(f"slot-{prof.id % self.ring_size}", zlib.compress(json.dumps(prof.as_dict(), default=str).encode()))
+        return prof.id
+
+    def get(self, profile_id: int) -> Optional[dict]:
+        raw = self._shared().get(f"slot-{profile_id % self.ring_size}")
+        if raw is None:
+            return None
+        data = json.loads(zlib.decompress(raw))
+        return data if data["id"] == profile_id else None
+
+    def recent(self) -> list[dict]:
+        """Summaries of the stored profiles, newest first."""
+        keys = [f"slot-{i}" for i in range(self.ring_size)]
+        rows = [json.loads(zlib.decompress(v)) for v in self._shared().get_many(keys).values()]
+        return [{k: v for k, v in r.items() if k not in ("stacks", "sql")}
+                for r in sorted(rows, key=lambda r: r["id"], reverse=True)]
+
+    def stats(self) -> dict:
+        return {
+            "signed_headers": bool(PROFILE_SECRET),
+            "sampling": self.sampling(),
+            "active": self._active is not None,
+            "profiled": self.profiled,
+            "busy": self.busy,
+            "rejected_headers": self.rejected_headers,
+        }
+
+profiler = Profiler()
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Sign profiling headers and read stored profiles")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    sign_cmd = sub.add_parser("sign", help="print an X-Profile header value")
+    sign_cmd.add_argument("--ttl", type=int, default=600, help="seconds the value stays valid")
+    sub.add_parser("list", help="stored profiles, newest first")
+    for name in ("show", "collapsed"):
+        cmd = sub.add_parser(name, help="one profile as JSON" if name == "show" else "one profile as folded stacks")
+        cmd.add_argument("id", type=int)
+    args = ap.parse_args()
+    if args.cmd == "sign":
+        if not PROFILE_SECRET:
+            sys.exit("PROFILE_SECRET is not set")
+        print(f"X-Profile: {sign(int(time.time()) + min(args.ttl, PROFILE_TOKEN_MAX_TTL))}")
+    elif args.cmd == "list":
+        for p in profiler.recent():
+            print(f"{p['id']:>6}  {p['started_at']}  {p['method']:<6} {p['path']:<50} {p['status']}  "
+                  f"{p['duration_ms']:>9.1f} ms  {p['statements']:>3} sql ({p['sql_ms']:.1f} ms)  {p['trigger']}")
+    else:
+        data = profiler.get(args.id)
+        if data is None:
+            sys.exit(f"profile {args.id} is no longer in the ring")
+        print(json.dumps(data, indent=2) if args.cmd == "show" else collapsed(data), end="")
@@ -0,0 +1,160 @@
+"""
+Offline re-scoring of every answered session_images row, for model or formula changes.
+
+    python rescore.py                 # resume from the checkpoint if there is one
+    python rescore.py --restart       # start over
+    python rescore.py --dry-run       # report the score shift without writing
+
+Rows are streamed in id order through a server-side cursor; each chunk's user prompts are
+encoded in large batches against the persisted reference matrices and written back with
+one UPDATE ... CASE. The last id of every committed chunk is checkpointed, so an
+interrupted run picks up where it stopped. Finished sessions then get total_score = sum of
+points. Eliminations are historical facts and are not re-judged.
+"""
+import os
+import json
+import time
+import argparse
+import numpy as np
+from sqlalchemy import text
+from database import engine, SessionLocal
+from embedding_index import INDEX_DIR
+from game_rules import img_points
+from shared_store import SharedStore
+import models as m
+import crud
+import scoring_service
+
+CHECKPOINT_PATH = os.path.join(INDEX_DIR, "rescore.checkpoint.json")
+BINS = 10  # score histogram: 0-10, 10-20, ..., 90-100
+
+_ROWS_SQL = """
+    SELECT si.id, si.image_id, si.level, si.user_prompt, si.score, i.original_prompt
+    FROM session_images si
+    JOIN images i ON i.id = si.image_id
+    WHERE si.score IS NOT NULL AND si.user_prompt IS NOT NULL AND si.id > :after
+    ORDER BY si.id
+"""
+
+def _histogram(scores: np.ndarray) -> np.ndarray:
+    return np.bincount(np.clip((scores // (100 / BINS)).astype(int), 0, BINS - 1), minlength=BINS)
+
+def _new_progress(fingerprint: str) -> dict:
+    return {"fingerprint": fingerprint, "after": "", "rows": 0, "changed": 0, "seconds": 0.0,
+            "old_sum": 0.0, "new_sum": 0.0, "abs_delta_sum": 0.0,
+            "old_hist": [0] * BINS, "new_hist": [0] * BINS, "done": False}
+
+def _save(path: str, progress: dict):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(progress, f)
+    os.replace(tmp, path)
+
+def reference_blocks(image_ids: list[str], originals: list[str]) -> list[np.ndarray]:
+    """Each row's reference matrix, one lookup per distinct image."""
+    blocks = {}
+    for image_id, original in zip(image_ids, originals):
+        if image_id not in blocks:
+            blocks[image_id] = scoring_service.reference_matrix(original, image_id)
+    return [blocks[i] for i in image_ids]
+
+def encode_prompts(prompts: list[str], batch_size: int) -> np.ndarray:
+    """Encode normalized prompts, each distinct prompt once, batch_size at a time."""
+    unique = list(dict.fromkeys(prompts))
+    parts = [scoring_service.encode_texts(unique[i:i + batch_size]) for i in range(0, len(unique), batch_size)]
+    table = np.vstack(parts).astype(np.float32)
+    pos = {p: i for i, p in enumerate(unique)}
+    return table[[pos[p] for p in prompts]]
+
+def score_chunk(rows: list, encode_batch: int) -> tuple[np.ndarray, list[int]]:
+    users = encode_prompts([scoring_service.normalize(r.user_prompt) for r in rows], encode_batch)
+    refs = reference_blocks([r.image_id for r in rows], [r.original_prompt for r in rows])
+    scores = np.array([scoring_service._to_pct(scoring_service.similarity(u, ref)) for u, ref in zip(users, refs)])
+    points = [img_points(m.Level(r.level), float(s)) for r, s in zip(rows, scores)]
+    return scores, points
+
+def rescore(chunk_size: int, encode_batch: int, checkpoint: str, restart: bool, dry_run: bool) -> dict:
+    fingerprint = scoring_service.fingerprint()
+    progress = _new_progress(fingerprint)
+    if not restart and not dry_run and os.path.exists(checkpoint):
+        with open(checkpoint) as f:
+            saved = json.load(f)
+        if saved.get("fingerprint") != fingerprint:
+            raise SystemExit(f"checkpoint was written with model {saved.get('fingerprint')}, now {fingerprint}; "
+                             "use --restart")
+        if saved.get("done"):
+            print("Checkpoint says the last run finished; use --restart to re-score again.")
+            return saved
+        progress = saved
+        print(f"Resuming after {progress['after']!r} ({progress['rows']} rows done)")
+
+    db = SessionLocal()
+    try:
+        scoring_service.sync_reference_index(db)
+    finally:
+        db.close()
+
+    started = time.perf_counter() - progress["seconds"]
+    with engine.connect() as reader:
+        result = reader.execution_options(stream_results=True, yield_per=chunk_size).execute(
+            text(_ROWS_SQL), {"after": progress["after"]}
+        )
+        for rows in result.partitions(chunk_size):
+            old = np.array([float(r.score) for r in rows])
+            new, points = score_chunk(rows, encode_batch)
+            if not dry_run:
+                db = SessionLocal()
+                try:
+                    crud.set_scores_bulk(db, [(r.id, float(s), p) for r, s, p in zip(rows, new, points)])
+                    db.commit()
+                finally:
+                    db.close()
+            progress["after"] = rows[-1].id
+            progress["rows"] += len(rows)
+            progress["changed"] += int(np.count_nonzero(np.abs(new - old) >= 0.01))
+            progress["old_sum"] += float(old.sum())
+            progress["new_sum"] += float(new.sum())
+            progress["abs_delta_sum"] += float(np.abs(new - old).sum())
+            progress["old_hist"] = (np.array(progress["old_hist"]) + _histogram(old)).tolist()
+            progress["new_hist"] = (np.array(progress["new_hist"]) + _histogram(new)).tolist()
+            progress["seconds"] = time.perf_counter() - started
+            if not dry_run:
+                _save(checkpoint, progress)
+            print(f"  {progress['rows']} rows, {progress['rows'] / max(progress['seconds'], 1e-9):.0f} rows/s")
+
+    if not dry_run:
+        db = SessionLocal()
+        try:
+            progress["sessions"] = crud.recompute_total_scores(db)
+            db.commit()
+        finally:
+            db.close()
+        # Cached sessions carry the old scores: drop every worker's copy
+        SharedStore("session_versions").clear()
+        progress["done"] = True
+        _save(checkpoint, progress)
+    return progress
+
+def report(p: dict):
+    n = p["rows"]
+    if not n:
+        print("No answered rows.")
+        return
+    print(f"\n{n} rows in {p['seconds']:.1f}s ({n / max(p['seconds'], 1e-9):.0f} rows/s), {p['changed']} changed"
+          + (f", {p['sessions']} session totals recomputed" if "sessions" in p else ""))
+    print(f"mean score {p['old_sum'] / n:.2f} -> {p['new_sum'] / n:.2f}, mean |delta| {p['abs_delta_sum'] / n:.2f}")
+    print(f"{'bin':<10}{'before':>9}{'after':>9}{'delta':>9}")
+    width = 100 // BINS
+    for i, (a, b) in enumerate(zip(p["old_hist"], p["new_hist"])):
+        print(f"{i * width:>3}-{(i + 1) * width:<6}{a:>9}{b:>9}{b - a:>+9}")
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Re-score every answered session image with the current model")
+    ap.add_argument("--chunk-size", type=int, default=2000, help="rows per cursor fetch / UPDATE / checkpoint")
+    ap.add_argument("--encode-batch", type=int, default=256, help="sentences per model call")
+    ap.add_argument("--checkpoint", default=CHECKPOINT_PATH)
+    ap.add_argument("--restart", action="store_true", help="ignore an existing checkpoint")
+    ap.add_argument("--dry-run", action="store_true", help="compute and report, write nothing")
+    args = ap.parse_args()
+    report(rescore(args.chunk_size, args.encode_batch, args.checkpoint, args.restart, args.dry_run))
@@ -23,6 +23,7 @@ class StartResponse(BaseModel):
     session_id: str
     current_stage: Stage
     images: List[ImageOut]  # images for the current stage to answer
+    stages: Optional[Dict[Stage, List[ImageOut]]] = None  # /api/start?manifest=1: every stage, play order
 
 class SubmitStageRequest(BaseModel):
     items: List[Dict[str, str]]  # {session_image_id, user_prompt}
@@ -48,6 +49,11 @@ class LeaderboardRow(BaseModel):
     eliminated_at: Optional[str] = None
     created_at: str
 
+class LeaderboardRank(BaseModel):
+    rank: int   # 1-based position on the leaderboard
+    total: int  # finished sessions on the board
+    row: LeaderboardRow
+
 class ResultsImage(BaseModel):
     session_image_id: str
     stage_order: int
@@ -65,3 +71,8 @@ class StatusResponse(BaseModel):
     images_completed: int
     eliminated_at: str | None = None
     images: List[ResultsImage] = []
+
+class ProfilingToggle(BaseModel):
+    rate: float = Field(gt=0, le=1)           # fraction of matching requests to profile
+    paths: str = "*"                          # glob on the request path, e.g. /api/session/*/submit_stage
+    seconds: float = Field(default=300, gt=0, le=86400)  # switches itself off after this long
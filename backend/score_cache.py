@@ -0,0 +1,169 @@
+import os
+import time
+import struct
+import hashlib
+import threading
+import numpy as np
+from collections import OrderedDict
+from typing import Optional
+from shared_store import SharedStore
+
+# Tier 1: per-process LRU
+SCORE_CACHE_SIZE = int(os.getenv("SCORE_CACHE_SIZE", "20000"))
+SCORE_CACHE_TTL = float(os.getenv("SCORE_CACHE_TTL_SECONDS", "3600"))
+# Tier 2: SQLite file shared by the workers on this host; set SCORE_CACHE_SHARED=0 to disable
+SCORE_CACHE_SHARED = os.getenv("SCORE_CACHE_SHARED", "1") == "1"
+SCORE_CACHE_SHARED_TTL = float(os.getenv("SCORE_CACHE_SHARED_TTL_SECONDS", "86400"))
+# Row cap for the shared tier; the oldest writes go first
+SCORE_CACHE_SHARED_MAX_ROWS = int(os.getenv("SCORE_CACHE_SHARED_MAX_ROWS", "500000"))
+
+class LRUCache:
+    """Thread-safe LRU with a size bound and per-entry TTL."""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
+
+def _digest(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+class ScoreCache:
+    """
+    Two-tier cache of similarity scores and user-prompt embeddings.
+
+      score key:      (scoring mode, image_id, hash(normalized original), hash(reference set),
+                       hash(normalized user prompt))
+      embedding key:  hash(normalized user prompt)
+
+    Every key is prefixed with the model fingerprint, and the shared tier is wiped when
+    a worker starts with a fingerprint different from the one that filled it.
+    """
+
+    def __init__(self, fingerprint: str, scoring: str = "", shared: bool = SCORE_CACHE_SHARED):
+        self.fingerprint = fingerprint
+        self.scoring = scoring
+        self.local = LRUCache(SCORE_CACHE_SIZE, SCORE_CACHE_TTL)
+        self.shared = SharedStore("score_cache", max_rows=SCORE_CACHE_SHARED_MAX_ROWS) if shared else None
+        self.shared_hits = 0
+        self.shared_misses = 0
+        self._stats_lock = threading.Lock()
+        if self.shared is not None:
+            stored = self.shared.get("__fingerprint__")
+            if stored is not None and stored.decode() != fingerprint:
+                self.shared.clear()
+            self.shared.set("__fingerprint__", fingerprint.encode())
+
+    def score_key(self, image_id: Optional[str], original: str, references: str, user: str) -> str:
+        """references: hash of the reference set the score is computed against."""
+        return (f"{self.fingerprint}:s:{self.scoring}:{image_id or '-'}:{_digest(original)}"
+                f":{references[:16]}:{_digest(user)}")
+
+    def embedding_key(self, user: str) -> str:
+        return f"{self.fingerprint}:e:{_digest(user)}"
+
+    def _get_many(self, keys: list[str]) -> dict:
+        found, missing = {}, []
+        for k in keys:
+            v = self.local.get(k)
+            if v is None:
+                missing.append(k)
+            else:
+                found[k] = v
+        if missing and self.shared is not None:
+            raw = self.shared.get_many(missing)
+            with self._stats_lock:
+                self.shared_hits += len(raw)
+                self.shared_misses += len(missing) - len(raw)
+            for k, blob in raw.items():
+                v = _decode(blob)
+                self.local.put(k, v)
+                found[k] = v
+        return found
+
+    def _put_many(self, items: dict):
+        for k, v in items.items():
+            self.local.put(k, v)
+        if self.shared is not None:
+            self.shared.set_many({k: _encode(v) for k, v in items.items()}, SCORE_CACHE_SHARED_TTL)
+
+    def get_scores(self, keys: list[str]) -> dict[str, float]:
+        return self._get_many(keys)
+
+    def put_scores(self, items: dict[str, float]):
+        self._put_many(items)
+
+    def get_embeddings(self, keys: list[str]) -> dict[str, np.ndarray]:
+        return self._get_many(keys)
+
+    def put_embeddings(self, items: dict[str, np.ndarray]):
+        self._put_many({k: np.asarray(v, dtype=np.float32) for k, v in items.items()})
+
+    def clear(self):
+        self.local.clear()
+        if self.shared is not None:
+            self.shared.clear()
+
+    def stats(self) -> dict:
+        out = {"fingerprint": self.fingerprint, "local": self.local.stats()}
+        if self.shared is not None:
+            with self._stats_lock:
+                out["shared"] = {"hits": self.shared_hits, "misses": self.shared_misses}
+            swept = self.shared.stats()
+            out["shared"].update(evictions=swept["evicted"], expirations=swept["expired"])
+        return out
+
+# Shared-tier encoding: b"f" + float64 for scores, b"v" + float32 bytes for embeddings
+def _encode(value) -> bytes:
+    if isinstance(value, np.ndarray):
+        return b"v" + value.astype(np.float32).tobytes()
+    return b"f" + struct.pack("<d", float(value))
+
+def _decode(blob: bytes):
+    if blob[:1] == b"v":
+        return np.frombuffer(blob[1:], dtype=np.float32)
+    return struct.unpack("<d", blob[1:])[0]
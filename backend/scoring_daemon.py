@@ -0,0 +1,214 @@
+"""
+Out-of-process scorer: one process holds the model and serves every web worker on the
+host over a Unix domain socket.
+
+    python scoring_daemon.py --socket /run/pictoprompt/scoring.sock --threads 4
+    SCORING_DAEMON_SOCKET=/run/pictoprompt/scoring.sock uvicorn main:app --workers 8
+
+Wire format (network byte order). Request: op (B), item count (H), body length (I), then
+per item three lengths (HHH) and the UTF-8 user prompt, original prompt and image id
+(empty = none). Response: status (B), count (H), body length (I), then count float32
+scores, or a UTF-8 error message when status != 0.
+"""
+import os
+import json
+import time
+import socket
+import struct
+import argparse
+import threading
+import socketserver
+from typing import Optional
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Unset: score in-process as before.
+SCORING_DAEMON_SOCKET = os.getenv("SCORING_DAEMON_SOCKET", "")
+SCORING_DAEMON_TIMEOUT = float(os.getenv("SCORING_DAEMON_TIMEOUT_SECONDS", "5"))
+# "none": fail the request with 503 + Retry-After and keep workers model-free;
+# "local": score in this process when the daemon socket is missing or refuses connections
+# (loads the model here). Timeouts and errors from a running daemon always give 503.
+SCORING_DAEMON_FALLBACK = os.getenv("SCORING_DAEMON_FALLBACK", "none")
+
+OP_SCORE = 1
+OP_STATS = 2
+STATUS_OK = 0
+STATUS_ERROR = 1
+
+_HEADER = struct.Struct("!BHI")
+_ITEM = struct.Struct("!HHH")
+MAX_FIELD = 0xFFFF
+MAX_BODY = 1 << 20
+
+class ScoringUnavailable(Exception):
+    pass
+
+class DaemonUnreachable(ScoringUnavailable):
+    """No daemon to talk to: socket file missing or connection refused."""
+
+class ScoringRequestTooLarge(ValueError):
+    """Items that do not fit the wire format (a field over MAX_FIELD bytes, a body over MAX_BODY)."""
+
+def encode_items(items: list[tuple[str, str, Optional[str]]]) -> bytes:
+    parts = []
+    for up, op, image_id in items:
+        fields = [up.encode(), op.encode(), (image_id or "").encode()]
+        if any(len(f) > MAX_FIELD for f in fields):
+            raise ScoringRequestTooLarge(f"a prompt is longer than {MAX_FIELD} bytes")
+        parts.append(_ITEM.pack(*(len(f) for f in fields)))
+        parts.extend(fields)
+    body = b"".join(parts)
+    if len(body) > MAX_BODY:
+        raise ScoringRequestTooLarge(f"prompts total more than {MAX_BODY} bytes")
+    return body
+
+def decode_items(body: bytes, count: int) -> list[tuple[str, str, Optional[str]]]:
+    items, pos = [], 0
+    for _ in range(count):
+        lens = _ITEM.unpack_from(body, pos)
+        pos += _ITEM.size
+        fields = []
+        for n in lens:
+            fields.append(body[pos:pos + n].decode())
+            pos += n
+        items.append((fields[0], fields[1], fields[2] or None))
+    return items
+
+def _recv_exact(sock: socket.socket, n: int) -> bytes:
+    buf = bytearray()
+    while len(buf) < n:
+        chunk = sock.recv(n - len(buf))
+        if not chunk:
+            raise ConnectionError("scoring daemon closed the connection")
+        buf += chunk
+    return bytes(buf)
+
+def read_frame(sock: socket.socket) -> tuple[int, int, bytes]:
+    code, count, length = _HEADER.unpack(_recv_exact(sock, _HEADER.size))
+    if length > MAX_BODY:
+        raise ConnectionError(f"frame of {length} bytes exceeds {MAX_BODY}")
+    return code, count, _recv_exact(sock, length)
+
+def write_frame(sock: socket.socket, code: int, count: int, body: bytes = b""):
+    sock.sendall(_HEADER.pack(code, count, len(body)) + body)
+
+class DaemonClient:
+    """
+    Thin client used by web workers. Each thread keeps one persistent connection; a
+    failed call drops it and the next call reconnects.
+    """
+
+    def __init__(self, path: str, timeout: float = SCORING_DAEMON_TIMEOUT):
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.failures = 0
+
+    def _sock(self) -> socket.socket:
+        sock = getattr(self._local, "sock", None)
+        if sock is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            sock.connect(self.path)
+            self._local.sock = sock
+        return sock
+
+    def _call(self, op: int, count: int, body: bytes) -> tuple[int, bytes]:
+        try:
+            sock = self._sock()
+        except OSError as e:
+            with self._lock:
+                self.failures += 1
+            raise DaemonUnreachable(f"scoring daemon at {self.path}: {e}") from e
+        try:
+            write_frame(sock, op, count, body)
+            status, n, payload = read_frame(sock)
+        except (OSError, ConnectionError, struct.error) as e:
+            self._drop()
+            with self._lock:
+                self.failures += 1
+            raise ScoringUnavailable(f"scoring daemon at {self.path}: {e}") from e
+        with self._lock:
+            self.calls += 1
+        if status != STATUS_OK:
+            raise ScoringUnavailable(payload.decode(errors="replace"))
+        return n, payload
+
+    def _drop(self):
+        sock = getattr(self._local, "sock", None)
+        self._local.sock = None
+        if sock is not None:
+            sock.close()
+
+    def score(self, items: list[tuple[str, str, Optional[str]]]) -> list[float]:
+        n, payload = self._call(OP_SCORE, len(items), encode_items(items))
+        return [round(v, 2) for v in struct.unpack(f"!{n}f", payload)]
+
+    def stats(self) -> dict:
+        _, payload = self._call(OP_STATS, 0, b"")
+        return json.loads(payload)
+
+    def client_stats(self) -> dict:
+        with self._lock:
+            return {"socket": self.path, "calls": self.calls, "failures": self.failures}
+
+class _Handler(socketserver.BaseRequestHandler):
+    def handle(self):
+        import scoring_service
+
+        sock = self.request
+        while True:
+            try:
+                op, count, body = read_frame(sock)
+            except (ConnectionError, OSError, struct.error):
+                return
+            try:
+                if op == OP_SCORE:
+                    scores = scoring_service.score_prompts(decode_items(body, count), local=True)
+                    write_frame(sock, STATUS_OK, len(scores), struct.pack(f"!{len(scores)}f", *scores))
+                elif op == OP_STATS:
+                    stats = {**scoring_service.batching_stats(), "cache": scoring_service.cache_stats()}
+                    write_frame(sock, STATUS_OK, 0, json.dumps(stats).encode())
+                else:
+                    write_frame(sock, STATUS_ERROR, 0, f"unknown op {op}".encode())
+            except Exception as e:
+                write_frame(sock, STATUS_ERROR, 0, f"{type(e).__name__}: {e}".encode())
+
+class _Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+def serve(path: str):
+    import scoring_service
+    from database import SessionLocal
+
+    t0 = time.perf_counter()
+    timings = scoring_service.warmup(local=True)
+    db = SessionLocal()
+    try:
+        timings["reference_index"] = scoring_service.sync_reference_index(db)
+    finally:
+        db.close()
+    if os.path.exists(path):
+        os.remove(path)
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with _Server(path, _Handler) as server:
+        os.chmod(path, 0o660)
+        print(f"Scoring daemon ({scoring_service.SCORING_BACKEND}) on {path}, ready in "
+              f"{time.perf_counter() - t0:.2f}s: {timings}", flush=True)
+        try:
+            server.serve_forever()
+        finally:
+            os.remove(path)
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Serve prompt scoring over a Unix domain socket")
+    ap.add_argument("--socket", default=SCORING_DAEMON_SOCKET or os.path.join(SCRIPT_DIR, "index", "scoring.sock"))
+    ap.add_argument("--threads", type=int, default=0, help="model intra-op threads (0 = runtime default)")
+    args = ap.parse_args()
+    if args.threads:
+        # Read by the backends when the model loads
+        os.environ["ONNX_THREADS"] = str(args.threads)
+        os.environ["SCORING_TORCH_THREADS"] = str(args.threads)
+    serve(args.socket)
@@ -0,0 +1,67 @@
+import os
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import partial
+
+# Submissions admitted at once (running + waiting for a scoring thread). Beyond this we shed load.
+SCORING_MAX_INFLIGHT = int(os.getenv("SCORING_MAX_INFLIGHT", "64"))
+# Threads that run scoring work; kept apart from the threadpool serving plain routes. They
+# mostly wait on the micro-batcher (or the daemon socket), so by default every admitted
+# submission gets one and all of them can join the same encode batch.
+SCORING_WORKERS = int(os.getenv("SCORING_WORKERS", str(SCORING_MAX_INFLIGHT)))
+# Hint sent back in Retry-After when a submission is rejected.
+SCORING_RETRY_AFTER_SECONDS = int(os.getenv("SCORING_RETRY_AFTER_SECONDS", "2"))
+
+class ScoringOverloaded(Exception):
+    pass
+
+class ScoringPool:
+    """
+    Size-limited executor for scoring plus a non-blocking admission gate.
+    admit() fails immediately instead of queueing once max_inflight submissions are in
+    progress, so latency stays bounded and the rest of the API keeps answering.
+    """
+
+    def __init__(self, workers: int = SCORING_WORKERS, max_inflight: int = SCORING_MAX_INFLIGHT):
+        self.workers = workers
+        self.max_inflight = max_inflight
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="scoring")
+        self._lock = threading.Lock()
+        self._inflight = 0
+        self.admitted = 0
+        self.rejected = 0
+
+    @contextmanager
+    def admit(self):
+        with self._lock:
+            if self._inflight >= self.max_inflight:
+                self.rejected += 1
+                raise ScoringOverloaded()
+            self._inflight += 1
+            self.admitted += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._inflight -= 1
+
+    async def run(self, fn, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, partial(fn, *args, **kwargs))
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "max_inflight": self.max_inflight,
+                "inflight": self._inflight,
+                "admitted": self.admitted,
+                "rejected": self.rejected,
+            }
+
+scoring_pool = ScoringPool()
@@ -1,33 +1,249 @@
 import os
 import re
+import time
+import logging
 import numpy as np
 from functools import lru_cache
-from sentence_transformers import SentenceTransformer
+from typing import Optional
+from embedding_index import (EmbeddingIndex, INDEX_DIR, model_fingerprint, reference_texts, set_hash, sync_with_catalog,
+                             text_hash, unit_rows)
+from batch_encoder import BatchEncoder
+from score_cache import ScoreCache, LRUCache
+from inference_backends import load_backend, import_runtime
+from metrics import SCORING_STAGE, SCORING_SECONDS
+from scoring_daemon import DaemonClient, DaemonUnreachable, ScoringUnavailable, SCORING_DAEMON_SOCKET, SCORING_DAEMON_FALLBACK
+
+log = logging.getLogger("uvicorn.error")
 
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 LOCAL_MODEL_PATH = os.path.join(SCRIPT_DIR, "model", "all-MiniLM-L6-v2")
 
+# Inference backend: "torch" (sentence_transformers), "onnx" or "onnx-int8" (ONNX Runtime).
+# Check drift with `python backend_parity.py` before switching.
+SCORING_BACKEND = os.getenv("SCORING_BACKEND", "torch")
+
+# Micro-batching: flush when this many sentences are queued or after this many ms.
+BATCH_MAX_SIZE = int(os.getenv("SCORE_BATCH_MAX_SIZE", "32"))
+BATCH_MAX_WAIT_MS = float(os.getenv("SCORE_BATCH_MAX_WAIT_MS", "5"))
+# A caller stops waiting for its embeddings after this long (the submission gets a 503)
+BATCH_RESULT_TIMEOUT = float(os.getenv("SCORE_BATCH_RESULT_TIMEOUT_SECONDS", "30"))
+
+# Images may list accepted paraphrases in meta.references; a prompt scores against the
+# best one ("max") or the mean of its SCORE_REFERENCE_TOPK best ("topk").
+REFERENCE_AGGREGATE = os.getenv("SCORE_REFERENCE_AGGREGATE", "max")
+REFERENCE_TOPK = int(os.getenv("SCORE_REFERENCE_TOPK", "2"))
+# Reference blocks of images missing from the index are encoded on first use and held in
+# memory (per process) until sync_reference_index or ingest persists them.
+REFERENCE_MISS_CACHE_SIZE = int(os.getenv("SCORE_REFERENCE_MISS_CACHE_SIZE", "1024"))
+REFERENCE_MISS_TTL = float(os.getenv("SCORE_REFERENCE_MISS_TTL_SECONDS", "300"))
+
 @lru_cache(maxsize=1)
 def _load_model():
     if not os.path.isdir(LOCAL_MODEL_PATH):
         raise RuntimeError(
             f"Local model not found at: {LOCAL_MODEL_PATH}. Expected: backend/model/all-MiniLM-L6-v2"
         )
-    return SentenceTransformer(LOCAL_MODEL_PATH)
+    return load_backend(SCORING_BACKEND, LOCAL_MODEL_PATH)
+
+@lru_cache(maxsize=1)
+def _encoder() -> BatchEncoder:
+    return BatchEncoder(encode_texts, BATCH_MAX_SIZE, BATCH_MAX_WAIT_MS, BATCH_RESULT_TIMEOUT)
+
+def fingerprint() -> str:
+    """Identifies the vectors this process produces: model files plus inference backend."""
+    fp = model_fingerprint(LOCAL_MODEL_PATH)
+    return fp if SCORING_BACKEND == "torch" else f"{fp}-{SCORING_BACKEND}"
+
+@lru_cache(maxsize=1)
+def reference_index() -> EmbeddingIndex:
+    return EmbeddingIndex(INDEX_DIR, fingerprint())
+
+@lru_cache(maxsize=1)
+def score_cache() -> ScoreCache:
+    mode = f"topk{REFERENCE_TOPK}" if REFERENCE_AGGREGATE == "topk" else REFERENCE_AGGREGATE
+    return ScoreCache(fingerprint(), mode)
 
 def normalize(text: str) -> str:
     return re.sub(r"\s+", " ", re.sub(r"[^a-zA-Z0-9\s]", " ", text.lower())).strip()
 
-def cosine(a: np.ndarray, b: np.ndarray) -> float:
-    a = np.asarray(a).reshape(-1)
-    b = np.asarray(b).reshape(-1)
-    denom = (np.linalg.norm(a) * np.linalg.norm(b)) + 1e-8
-    return float(np.dot(a, b) / denom)
-
-def score_prompt(user_prompt: str, original_prompt: str) -> float:
-    model = _load_model()
-    u, o = normalize(user_prompt), normalize(original_prompt)
-    u_emb = model.encode(u, normalize_embeddings=False)
-    o_emb = model.encode(o, normalize_embeddings=False)
-    score = max(0.0, min(1.0, cosine(u_emb, o_emb))) * 100.0
-    return round(score, 2)
+def similarity(user_vec: np.ndarray, references: np.ndarray) -> float:
+    """
+    Cosine similarity of one user embedding against an image's unit-norm reference rows:
+    a single matrix-vector product, then max or top-k mean (SCORE_REFERENCE_AGGREGATE).
+    """
+    u = np.asarray(user_vec, dtype=np.float32).reshape(-1)
+    sims = references @ (u / (np.linalg.norm(u) + 1e-8))
+    if REFERENCE_AGGREGATE == "topk" and len(sims) > REFERENCE_TOPK:
+        return float(np.partition(sims, -REFERENCE_TOPK)[-REFERENCE_TOPK:].mean())
+    if REFERENCE_AGGREGATE == "topk":
+        return float(sims.mean())
+    return float(sims.max())
+
+def encode_texts(texts: list[str]) -> np.ndarray:
+    """Batch-encode already normalized texts."""
+    with SCORING_STAGE.time("model"):
+        return _load_model().encode(texts)
+
+@lru_cache(maxsize=1)
+def _missed_references() -> LRUCache:
+    return LRUCache(REFERENCE_MISS_CACHE_SIZE, REFERENCE_MISS_TTL)
+
+def _unindexed_block(o: str, image_id: str) -> tuple[str, np.ndarray]:
+    """
+    (set_hash, unit rows) for an image the index misses (new image, edited prompt, new
+    model): its full reference list, read from the images table and encoded once per
+    process. Nothing is written to the index here.
+    """
+    key = f"{image_id}:{text_hash(o)}"
+    block = _missed_references().get(key)
+    if block is None:
+        from sqlalchemy import select
+        from database import SessionLocal
+        from models import Image
+
+        with SessionLocal() as db:
+            meta = db.execute(select(Image.meta).where(Image.id == image_id)).scalar()
+        texts = reference_texts(o, meta, normalize)
+        block = (set_hash(texts), unit_rows(_encoder().encode(texts)))
+        _missed_references().put(key, block)
+    return block
+
+def reference_matrix(original_prompt: str, image_id: Optional[str] = None) -> np.ndarray:
+    """
+    Unit-norm reference rows of an image (original_prompt plus meta.references), served
+    from the persisted index, or encoded in memory on a miss (see _unindexed_block).
+    """
+    o = normalize(original_prompt)
+    if image_id is None:
+        return unit_rows(_encoder().encode([o]))
+    refs = reference_index().get(image_id, o)
+    return refs if refs is not None else _unindexed_block(o, image_id)[1]
+
+def reference_hash(original: str, image_id: Optional[str] = None) -> str:
+    """Identifies the reference set reference_matrix() scores against (o already normalized)."""
+    if image_id is None:
+        return set_hash([original])
+    stored = reference_index().reference_hash(image_id, original)
+    return stored if stored is not None else _unindexed_block(original, image_id)[0]
+
+def sync_reference_index(db) -> int:
+    """Bring the index in line with the images table; returns how many prompts were encoded."""
+    return sync_with_catalog(db, reference_index(), encode_texts, normalize)
+
+def _to_pct(similarity: float) -> float:
+    return round(max(0.0, min(1.0, similarity)) * 100.0, 2)
+
+def score_prompt(user_prompt: str, original_prompt: str, image_id: Optional[str] = None) -> float:
+    return score_prompts([(user_prompt, original_prompt, image_id)])[0]
+
+@lru_cache(maxsize=1)
+def _daemon() -> DaemonClient:
+    return DaemonClient(SCORING_DAEMON_SOCKET)
+
+def score_prompts(items: list[tuple[str, str, Optional[str]]], local: bool = False) -> list[float]:
+    """
+    Score several (user_prompt, original_prompt, image_id) triples. Repeat answers are
+    served from the score cache; the remaining user prompts are queued together, so one
+    stage submission rides in a single encode batch.
+
+    With SCORING_DAEMON_SOCKET set the work is sent to the scoring daemon instead, unless
+    local=True (the daemon itself) or, with SCORING_DAEMON_FALLBACK=local, no daemon is
+    listening on the socket.
+    """
+    if not items:
+        return []
+    started = last = time.perf_counter()
+    if SCORING_DAEMON_SOCKET and not local:
+        try:
+            scores = _daemon().score(items)
+            SCORING_STAGE.observe(time.perf_counter() - started, "daemon")
+            SCORING_SECONDS.observe(time.perf_counter() - started)
+            return scores
+        except DaemonUnreachable as e:
+            if SCORING_DAEMON_FALLBACK != "local":
+                raise
+            log.warning("Scoring in-process, daemon unavailable: %s", e)
+
+    def lap(stage: str):
+        nonlocal last
+        now = time.perf_counter()
+        SCORING_STAGE.observe(now - last, stage)
+        last = now
+
+    cache = score_cache()
+    norm = [(normalize(up), normalize(op), image_id) for up, op, image_id in items]
+    lap("normalize")
+    score_keys = [cache.score_key(image_id, o, reference_hash(o, image_id), u) for u, o, image_id in norm]
+    scores = cache.get_scores(score_keys)
+    todo = [i for i, k in enumerate(score_keys) if k not in scores]
+    if todo:
+        emb_keys = {norm[i][0]: cache.embedding_key(norm[i][0]) for i in todo}
+        cached = cache.get_embeddings(list(emb_keys.values()))
+        u_embs = {u: cached[k] for u, k in emb_keys.items() if k in cached}
+        fresh = [u for u in emb_keys if u not in u_embs]
+        lap("cache")
+        if fresh:
+            vecs = _encoder().encode(fresh)
+            u_embs.update(zip(fresh, vecs))
+            lap("encode")
+            cache.put_embeddings({emb_keys[u]: v for u, v in zip(fresh, vecs)})
+            lap("cache")
+        refs = [reference_matrix(items[i][1], items[i][2]) for i in todo]
+        lap("reference")
+        new_scores = {
+            score_keys[i]: _to_pct(similarity(u_embs[norm[i][0]], ref)) for i, ref in zip(todo, refs)
+        }
+        lap("similarity")
+        cache.put_scores(new_scores)
+        scores.update(new_scores)
+    lap("cache")
+    SCORING_SECONDS.observe(last - started)
+    return [scores[k] for k in score_keys]
+
+def cache_stats() -> dict:
+    return score_cache().stats()
+
+def warmup(rounds: int = 3, local: bool = False) -> dict:
+    """
+    Load the inference runtime and model, then run a few encodes so first-call costs
+    (allocator growth, graph optimization, tokenizer caches) are paid before traffic.
+    Returns seconds spent per phase. Web workers using the daemon only check it answers.
+    """
+    timings = {}
+    t0 = time.perf_counter()
+    if SCORING_DAEMON_SOCKET and not local:
+        try:
+            _daemon().stats()
+            timings["daemon_ping"] = round(time.perf_counter() - t0, 3)
+        except ScoringUnavailable as e:
+            timings["daemon_ping"] = None
+            log.warning("Scoring daemon not answering at startup: %s", e)
+        return timings
+    import_runtime(SCORING_BACKEND)
+    t1 = time.perf_counter()
+    _load_model()
+    t2 = time.perf_counter()
+    sample = ["a warmup sentence for the scoring model"]
+    for _ in range(rounds):
+        _encoder().encode(sample)
+        encode_texts(sample * BATCH_MAX_SIZE)
+    t3 = time.perf_counter()
+    timings["imports"] = round(t1 - t0, 3)
+    timings["model_load"] = round(t2 - t1, 3)
+    timings["warmup"] = round(t3 - t2, 3)
+    return timings
+
+def batching_stats() -> dict:
+    return _encoder().stats()
+
+def daemon_stats() -> Optional[dict]:
+    """Client counters plus the daemon's own batching/cache stats; None when scoring in-process."""
+    if not SCORING_DAEMON_SOCKET:
+        return None
+    out = _daemon().client_stats()
+    try:
+        out["remote"] = _daemon().stats()
+    except ScoringUnavailable as e:
+        out["remote"] = None
+        out["error"] = str(e)
+    return out
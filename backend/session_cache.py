@@ -0,0 +1,186 @@
+import os
+import time
+import uuid
+import threading
+from collections import OrderedDict
+from typing import Optional
+from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool
+from shared_store import SharedStore
+import crud
+
+SESSION_CACHE_SIZE = int(os.getenv("SESSION_CACHE_SIZE", "10000"))
+# Drop sessions nobody has polled for this long.
+SESSION_CACHE_IDLE_SECONDS = float(os.getenv("SESSION_CACHE_IDLE_SECONDS", "900"))
+# Row cap for the host-wide version stamps (they also expire after 4x the idle time)
+SESSION_VERSIONS_MAX_ROWS = int(os.getenv("SESSION_VERSIONS_MAX_ROWS", "200000"))
+
+class SessionState:
+    """Session header plus its session_images rows (ordered by stage_order) as plain dicts."""
+    __slots__ = ("session_id", "state", "current_stage", "total_score", "images_completed",
+                 "eliminated_at", "items", "version", "touched_at")
+
+    def __init__(self, session_id: str, state: str, current_stage: str, total_score: Optional[float],
+                 images_completed: int, eliminated_at: Optional[str], items: list[dict]):
+        self.session_id = session_id
+        self.state = state
+        self.current_stage = current_stage
+        self.total_score = total_score
+        self.images_completed = images_completed
+        self.eliminated_at = eliminated_at
+        self.items = items
+        self.version = None
+        self.touched_at = time.monotonic()
+
+    def stage_items(self, stage: str) -> list[dict]:
+        return [it for it in self.items if it["stage_name"] == stage]
+
+class SessionCache:
+    """
+    Read-through cache for next_stage/status polling.
+
+    Entries are bounded by LRU size and idle time. Every write goes through put(), which
+    stamps the session with a fresh version in the host-wide SharedStore; a worker only
+    serves its entry while its version matches the shared stamp, so a submission handled
+    by another worker invalidates everyone else's copy without touching MySQL.
+
+    Writers' stamps start with the wall-clock write time, which is what the read replica
+    routing uses to keep a player's own session read-your-writes (written_within).
+    """
+
+    def __init__(self, maxsize: int = SESSION_CACHE_SIZE, idle_seconds: float = SESSION_CACHE_IDLE_SECONDS):
+        self.maxsize = maxsize
+        self.idle_seconds = idle_seconds
+        self._data: OrderedDict[str, SessionState] = OrderedDict()
+        self._lock = threading.Lock()
+        self._stamps = None
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.evictions = 0
+
+    def _versions(self) -> SharedStore:
+        if self._stamps is None:
+            self._stamps = SharedStore("session_versions", max_rows=SESSION_VERSIONS_MAX_ROWS)
+        return self._stamps
+
+    def get(self, session_id: str) -> Optional[SessionState]:
+        now = time.monotonic()
+        with self._lock:
+            st = self._data.get(session_id)
+            if st is not None and now - st.touched_at > self.idle_seconds:
+                del self._data[session_id]
+                st = None
+            if st is None:
+                self.misses += 1
+                return None
+        stamp = self._versions().get(session_id)
+        with self._lock:
+            if stamp is None or stamp.decode() != st.version:
+                self._data.pop(session_id, None)
+                self.stale += 1
+                self.misses += 1
+                return None
+            st.touched_at = now
+            self._data.move_to_end(session_id)
+            self.hits += 1
+            return st
+
+    def put(self, st: SessionState, version: Optional[str] = None):
+        """
+        Store st. Writers (start, submit_stage) call this after their commit without a
+        version, which publishes a new stamp; loads pass the stamp they read before querying.
+        """
+        if version is None:
+            version = f"{time.time():.3f}-{uuid.uuid4().hex}"
+            self._versions().set(st.session_id, version.encode(), ttl=self.idle_seconds * 4)
+        st.version = version
+        st.touched_at = time.monotonic()
+        with self._lock:
+            self._data[st.session_id] = st
+            self._data.move_to_end(st.session_id)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def _reserve(self, session_id: str) -> tuple[bool, Optional[bytes]]:
+        # Take the stamp before reading rows: a write committed in between replaces the
+        # stamp, so at worst this entry is discarded on its next get().
+        versions = self._versions()
+        created = versions.add(session_id, f"0-{uuid.uuid4().hex}".encode(), ttl=self.idle_seconds * 4)
+        return created, versions.get(session_id)
+
+    def _lookup(self, session_id: str) -> tuple[Optional[SessionState], bool, Optional[bytes]]:
+        st = self.get(session_id)
+        if st is not None:
+            return st, False, None
+        return (None, *self._reserve(session_id))
+
+    @staticmethod
+    def _read(db: Session, session_id: str) -> Optional[SessionState]:
+        """The session's rows as a SessionState (SQL only)."""
+        sess = crud.get_session(db, session_id)
+        if not sess:
+            return None
+        return SessionState(
+            sess.id,
+            sess.state.value,
+            sess.current_stage.value,
+            float(sess.total_score) if sess.total_score is not None else None,
+            int(sess.images_completed or 0),
+            sess.eliminated_at,
+            [dict(r) for r in crud.get_session_items(db, session_id)],
+        )
+
+    def _settle(self, session_id: str, st: Optional[SessionState], created: bool, stamp: Optional[bytes]):
+        if st is None:
+            if created:
+                self._versions().delete(session_id)
+            return None
+        if stamp is None:
+            self.put(st)
+        else:
+            self.put(st, stamp.decode())
+        return st
+
+    def load(self, db: Session, session_id: str) -> Optional[SessionState]:
+        """Cached state, or read it from the database and cache it. None if no such session."""
+        st, created, stamp = self._lookup(session_id)
+        if st is not None:
+            return st
+        return self._settle(session_id, self._read(db, session_id), created, stamp)
+
+    async def load_async(self, db: AsyncSession, session_id: str) -> Optional[SessionState]:
+        """load() for request handlers: SharedStore calls go to the threadpool, only the SELECTs run on the loop."""
+        st, created, stamp = await run_in_threadpool(self._lookup, session_id)
+        if st is not None:
+            return st
+        st = await db.run_sync(self._read, session_id)
+        return await run_in_threadpool(self._settle, session_id, st, created, stamp)
+
+    def written_within(self, session_id: str, seconds: float) -> bool:
+        """True if a writer on this host stamped the session less than `seconds` ago."""
+        stamp = self._versions().get(session_id)
+        if stamp is None:
+            return False
+        if b"-" not in stamp:
+            return True  # stamped before write times were recorded: assume recent
+        written_at = float(stamp.split(b"-", 1)[0])
+        return time.time() - written_at < seconds
+
+    def stats(self) -> dict:
+        swept = self._stamps.stats() if self._stamps is not None else {"expired": 0, "evicted": 0}
+        with self._lock:
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "stale": self.stale,
+                "evictions": self.evictions,
+                "stamp_expirations": swept["expired"],
+                "stamp_evictions": swept["evicted"],
+            }
+
+session_cache = SessionCache()
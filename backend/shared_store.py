@@ -0,0 +1,154 @@
+import os
+import time
+import sqlite3
+import threading
+from typing import Optional
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# One SQLite file shared by every uvicorn worker on the host (WAL mode: concurrent readers, one writer).
+SHARED_STORE_PATH = os.getenv("SHARED_STORE_PATH", os.path.join(SCRIPT_DIR, "index", "shared.sqlite3"))
+# Each process sweeps a table (expired rows, then the max_rows cap) after this many writes to it
+SHARED_STORE_SWEEP_EVERY = int(os.getenv("SHARED_STORE_SWEEP_EVERY", "1000"))
+
+class SharedStore:
+    """
+    Small cross-process key/value table with optional expiry, backed by SQLite.
+    Each thread gets its own connection; values are bytes.
+
+    Expired rows are deleted every SHARED_STORE_SWEEP_EVERY writes; with max_rows set the
+    same sweep also drops the least recently written rows above the cap. Keys starting
+    with "__" (bookkeeping such as the score cache fingerprint) are never capped.
+    """
+
+    def __init__(self, table: str, path: str = SHARED_STORE_PATH, max_rows: Optional[int] = None):
+        if not table.isidentifier():
+            raise ValueError(f"bad table name {table!r}")
+        self.table = table
+        self.path = path
+        self.max_rows = max_rows
+        self._local = threading.local()
+        self._writes = 0
+        self._sweep_lock = threading.Lock()
+        self.expired = 0
+        self.evicted = 0
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn().execute(
+            f"CREATE TABLE IF NOT EXISTS {table} (k TEXT PRIMARY KEY, v BLOB NOT NULL, expires_at REAL)"
+        )
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=1.0, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key: str) -> Optional[bytes]:
+        row = self._conn().execute(f"SELECT v, expires_at FROM {self.table} WHERE k = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        value, expires_at = row
+        if expires_at is not None and expires_at < time.time():
+            self.delete(key)
+            return None
+        return value
+
+    def get_many(self, keys: list[str]) -> dict[str, bytes]:
+        if not keys:
+            return {}
+        now = time.time()
+        marks = ",".join("?" * len(keys))
+        rows = self._conn().execute(
+            f"SELECT k, v, expires_at FROM {self.table} WHERE k IN ({marks})", keys
+        ).fetchall()
+        return {k: v for k, v, exp in rows if exp is None or exp >= now}
+
+    def set(self, key: str, value: bytes, ttl: Optional[float] = None):
+        self.set_many({key: value}, ttl)
+
+    def set_many(self, items: dict[str, bytes], ttl: Optional[float] = None):
+        if not items:
+            return
+        expires_at = time.time() + ttl if ttl else None
+        self._conn().executemany(
+            f"INSERT OR REPLACE INTO {self.table} (k, v, expires_at) VALUES (?, ?, ?)",
+            [(k, v, expires_at) for k, v in items.items()],
+        )
+        self._wrote(len(items))
+
+    def add(self, key: str, value: bytes, ttl: Optional[float] = None) -> bool:
+        """Set key only if it is absent (or expired). Returns True if this call wrote it."""
+        self.purge_key_if_expired(key)
+        expires_at = time.time() + ttl if ttl else None
+        cur = self._conn().execute(
+            f"INSERT OR IGNORE INTO {self.table} (k, v, expires_at) VALUES (?, ?, ?)", (key, value, expires_at)
+        )
+        self._wrote(cur.rowcount)
+        return cur.rowcount == 1
+
+    def incr(self, key: str) -> int:
+        """Add 1 to an integer counter (absent counts as 0) across processes; returns the new value."""
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(f"SELECT v FROM {self.table} WHERE k = ?", (key,)).fetchone()
+            value = int(row[0]) + 1 if row else 1
+            conn.execute(f"INSERT OR REPLACE INTO {self.table} (k, v, expires_at) VALUES (?, ?, NULL)",
+                         (key, str(value).encode()))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return value
+
+    def purge_key_if_expired(self, key: str):
+        self._conn().execute(
+            f"DELETE FROM {self.table} WHERE k = ? AND expires_at IS NOT NULL AND expires_at < ?", (key, time.time())
+        )
+
+    def delete(self, key: str):
+        self._conn().execute(f"DELETE FROM {self.table} WHERE k = ?", (key,))
+
+    def purge_expired(self) -> int:
+        cur = self._conn().execute(f"DELETE FROM {self.table} WHERE expires_at IS NOT NULL AND expires_at < ?", (time.time(),))
+        return cur.rowcount
+
+    def _wrote(self, n: int):
+        with self._sweep_lock:
+            self._writes += n
+            if self._writes < SHARED_STORE_SWEEP_EVERY:
+                return
+            self._writes = 0
+        self.sweep()
+
+    def sweep(self) -> int:
+        """Purge expired rows and trim to max_rows (oldest writes first); returns rows removed."""
+        expired = self.purge_expired()
+        evicted = 0
+        if self.max_rows is not None:
+            conn = self._conn()
+            excess = conn.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0] - self.max_rows
+            if excess > 0:
+                # INSERT OR REPLACE gives a row a new rowid, so rowid order is write order
+                evicted = conn.execute(
+                    f"DELETE FROM {self.table} WHERE rowid IN (SELECT rowid FROM {self.table}"
+                    f" WHERE k NOT LIKE '\\_\\_%' ESCAPE '\\' ORDER BY rowid LIMIT ?)", (excess,)
+                ).rowcount
+        with self._sweep_lock:
+            self.expired += expired
+            self.evicted += evicted
+        return expired + evicted
+
+    def stats(self) -> dict:
+        """Rows this process removed in sweeps."""
+        with self._sweep_lock:
+            return {"expired": self.expired, "evicted": self.evicted}
+
+    def clear(self):
+        self._conn().execute(f"DELETE FROM {self.table}")
+
+    def __len__(self) -> int:
+        return self._conn().execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
@@ -0,0 +1,14 @@
+"""Query-plan regression check (explain_check.py) against a throwaway SQLite database."""
+import random
+import explain_check
+from loadtest import prepare_database
+
+def test_no_query_plan_regressions(tmp_path):
+    url = f"sqlite:///{tmp_path / 'plans.db'}"
+    prepare_database(url, False)
+    ids = explain_check.seed(url, 2000, random.Random(7))
+    results = explain_check.check(url, ids)
+    assert results, "no statements captured"
+    regressed = [f"{name}: {verdict}\n    {' '.join(stmt.split())[:160]}\n    {explain_check.summary(plan)}"
+                 for name, stmt, plan, verdict in results if verdict.startswith("FAIL")]
+    assert not regressed, "\n".join(regressed)
@@ -1,18 +1,62 @@
 import axios from 'axios'
 const api = axios.create({ baseURL: '' })
 
+const STAGE_ORDER = ['easy', 'medium', 'hard']
+
+// Every stage's images per session, from /api/start?manifest=1
+const manifests = {}
+// Stage each session moves to next, learned from submitStage
+const upcoming = {}
+const prefetched = new Set()
+
+const whenIdle = (fn) => (window.requestIdleCallback ? window.requestIdleCallback(fn) : setTimeout(fn, 200))
+
+// Warm the browser cache for the stages after `stage`, without competing with the current one
+const prefetchAfter = (sessionId, stage) => {
+  const stages = manifests[sessionId]
+  if (!stages) return
+  const later = STAGE_ORDER.slice(STAGE_ORDER.indexOf(stage) + 1)
+  whenIdle(() => {
+    for (const s of later) {
+      for (const img of stages[s] || []) {
+        if (prefetched.has(img.image_url)) continue
+        prefetched.add(img.image_url)
+        const el = new Image()
+        el.decoding = 'async'
+        el.src = img.image_url
+      }
+    }
+  })
+}
+
 export const startGame = async (display_name) => {
-  const { data } = await api.post('/api/start', { display_name })
+  const { data } = await api.post('/api/start', { display_name }, { params: { manifest: 1 } })
+  if (data.stages) {
+    manifests[data.session_id] = data.stages
+    prefetchAfter(data.session_id, data.current_stage)
+  }
   return data
 }
 
 export const getNextStage = async (sessionId) => {
+  // After a pass the next stage's images are already known (and cached); skip the round trip
+  const stage = upcoming[sessionId]
+  const stages = manifests[sessionId]
+  if (stage && stages && stages[stage]) {
+    delete upcoming[sessionId]
+    return { session_id: sessionId, current_stage: stage, images: stages[stage] }
+  }
   const { data } = await api.get(`/api/session/${sessionId}/next_stage`)
   return data
 }
 
 export const submitStage = async (sessionId, items) => {
   const { data } = await api.post(`/api/session/${sessionId}/submit_stage`, { items })
+  if (data.passed && STAGE_ORDER.includes(data.next_stage)) {
+    upcoming[sessionId] = data.next_stage
+  } else {
+    delete upcoming[sessionId]
+  }
   return data
 }
 
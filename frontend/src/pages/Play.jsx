@@ -123,7 +123,15 @@ export default function Play() {
       navigate(`/results/${sessionId}`)
       return
     }
-    await loadStage()
+    // The submit response already carried the progress; the next stage comes from the start manifest when there is one
+    try {
+      const ns = await getNextStage(sessionId)
+      setPrompts({})
+      setStage(ns.current_stage)
+      setImages(ns.images)
+    } catch (e) {
+      await loadStage()
+    }
   }
 
   const currentStageProgress = useMemo(() => {